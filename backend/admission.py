@@ -0,0 +1,145 @@
+import os
+import math
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+from deadline import remaining_seconds
+
+# Comparisons running at once (each one drives its own browsers)
+MAX_ACTIVE_COMPARISONS = int(os.environ.get("MAX_ACTIVE_COMPARISONS", "2"))
+# Running comparisons bulk requests may occupy; the rest are kept free for interactive requests
+BULK_SLOTS = int(os.environ.get("ADMISSION_BULK_SLOTS", str(max(1, MAX_ACTIVE_COMPARISONS - 1))))
+# Requests allowed to wait for a slot in each lane before new ones are turned away with 429
+INTERACTIVE_QUEUE_SIZE = int(os.environ.get("ADMISSION_QUEUE_SIZE", "8"))
+BULK_QUEUE_SIZE = int(os.environ.get("ADMISSION_BULK_QUEUE_SIZE", "32"))
+# Longest a request waits for a slot (shortened by its deadline)
+ADMISSION_MAX_WAIT = float(os.environ.get("ADMISSION_MAX_WAIT", "30"))
+
+# Assumed comparison time for Retry-After before any comparison has finished
+DEFAULT_SERVICE_SECONDS = 30
+
+LANES = ("interactive", "bulk")
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request can't be admitted; `retry_after` is a suggested wait in seconds."""
+
+    def __init__(self, lane, reason, retry_after):
+        super().__init__(f"{lane} lane {reason}")
+        self.lane = lane
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Bounds how many comparisons run at once. Requests wait in a FIFO per priority lane;
+    a free slot goes to the oldest interactive request first, and bulk requests never
+    take more than `bulk_slots` slots. A full lane or a wait past `max_wait` is rejected.
+    """
+
+    def __init__(self, slots=MAX_ACTIVE_COMPARISONS, bulk_slots=BULK_SLOTS,
+                 queue_sizes=None, max_wait=ADMISSION_MAX_WAIT):
+        self.slots = max(1, slots)
+        self.bulk_slots = max(1, min(bulk_slots, self.slots))
+        self.queue_sizes = queue_sizes or {"interactive": INTERACTIVE_QUEUE_SIZE, "bulk": BULK_QUEUE_SIZE}
+        self.max_wait = max_wait
+        self.cond = threading.Condition()
+        self.active = {lane: 0 for lane in LANES}
+        self.waiting = {lane: deque() for lane in LANES}
+        self.admitted = {lane: 0 for lane in LANES}
+        self.rejected = {lane: 0 for lane in LANES}
+        # Moving average of how long an admitted comparison holds its slot (None until one finishes)
+        self.service_seconds = None
+
+    def _can_start(self, lane, ticket):
+        if self.waiting[lane][0] is not ticket or sum(self.active.values()) >= self.slots:
+            return False
+        if lane == "bulk":
+            return self.active["bulk"] < self.bulk_slots and not self.waiting["interactive"]
+        return True
+
+    def _retry_after(self):
+        queued = sum(len(queue) for queue in self.waiting.values())
+        service_seconds = self.service_seconds or DEFAULT_SERVICE_SECONDS
+        return max(1, math.ceil(service_seconds * (queued + 1) / self.slots))
+
+    def _reject(self, lane, reason):
+        self.rejected[lane] += 1
+        raise AdmissionRejected(lane, reason, self._retry_after())
+
+    def acquire(self, lane, timeout=None):
+        """
+        Wait for a slot in `lane`.
+
+        Raises:
+            AdmissionRejected: if the lane's queue is full or no slot frees up within `timeout`
+        """
+        timeout = self.max_wait if timeout is None else timeout
+        with self.cond:
+            if len(self.waiting[lane]) >= self.queue_sizes[lane]:
+                self._reject(lane, "queue is full")
+            ticket = object()
+            self.waiting[lane].append(ticket)
+            give_up_at = time.monotonic() + timeout
+            try:
+                while not self._can_start(lane, ticket):
+                    left = give_up_at - time.monotonic()
+                    if left <= 0:
+                        self._reject(lane, "wait timed out")
+                    self.cond.wait(left)
+            finally:
+                self.waiting[lane].remove(ticket)
+                # The next waiter may be able to start now that this one left the queue
+                self.cond.notify_all()
+            self.active[lane] += 1
+            self.admitted[lane] += 1
+
+    def release(self, lane, seconds):
+        with self.cond:
+            self.active[lane] -= 1
+            self.service_seconds = seconds if self.service_seconds is None else 0.8 * self.service_seconds + 0.2 * seconds
+            self.cond.notify_all()
+
+    @contextmanager
+    def admit(self, lane="interactive"):
+        """Hold a slot in `lane` for the duration of the block (waiting at most until the request deadline)."""
+        self.acquire(lane, remaining_seconds(self.max_wait))
+        start_time = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(lane, time.monotonic() - start_time)
+
+    def metrics(self):
+        with self.cond:
+            return {
+                "slots": self.slots,
+                "bulk_slots": self.bulk_slots,
+                "avg_service_seconds": round(self.service_seconds, 2) if self.service_seconds else None,
+                "lanes": {
+                    lane: {
+                        "active": self.active[lane],
+                        "waiting": len(self.waiting[lane]),
+                        "queue_size": self.queue_sizes[lane],
+                        "admitted_total": self.admitted[lane],
+                        "rejected_total": self.rejected[lane],
+                    }
+                    for lane in LANES
+                },
+            }
+
+
+_controller = None
+_controller_lock = threading.Lock()
+
+
+def get_admission_controller():
+    """Return the process-wide AdmissionController, creating it on first use."""
+    global _controller
+    with _controller_lock:
+        if _controller is None:
+            _controller = AdmissionController()
+        return _controller
@@ -1,39 +1,383 @@
-from flask import Flask, request, jsonify, send_from_directory
-from website_comparison import compare_websites
+from flask import Flask, request, jsonify, send_from_directory, Response
+from website_comparison import compare_websites, compare_websites_batch, comparison_flight
+from gemini_client import get_gemini_client
+from results_store import get_results_store
+from job_queue import get_job_queue
+from singleflight import comparison_key
+from response_format import compact_scores, project_fields, serialize, compress
+from screenshot_cache import get_thumbnail, get_archived_thumbnail, file_etag
+from image_archive import get_image_archive, SCREENSHOT_STORAGE
+from deadline import deadline_scope, DEFAULT_DEADLINE_SECONDS
+from admission import get_admission_controller, AdmissionRejected, LANES
+from prewarm import get_prewarm_store
+from profiler import (
+    profile_scope, list_profiles, load_profile, to_folded, get_continuous_profiler,
+    PROFILE_SAMPLE_HZ, MAX_SAMPLE_HZ
+)
+from werkzeug.security import safe_join
+from werkzeug.exceptions import NotFound
 from flask_cors import CORS
 import os
+import hmac
+import math
+import mimetypes
+
+SCREENSHOTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'screenshots')
+# Only images are served from the screenshots tree; caches and indexes live in dot-directories
+SERVED_IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp')
+# Screenshots are overwritten on recapture, so clients revalidate with the ETag after this
+SCREENSHOT_MAX_AGE = int(os.environ.get('SCREENSHOT_MAX_AGE', '300'))
+# Token admins send as X-Admin-Token for profiling; admin endpoints are disabled when unset
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN', '')
+# Widest extra viewport a request may ask for (4K)
+MAX_VIEWPORT_WIDTH = 3840
 
 # Initialize Flask app
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
+get_continuous_profiler()  # Starts the always-on sampler when PROFILE_CONTINUOUS_HZ is set
+
+def json_response(payload, status=200):
+    """Serialize a payload with the fast encoder and compress it if the client accepts it."""
+    body, encoding = compress(serialize(payload), request.headers.get('Accept-Encoding', ''))
+    response = Response(body, status=status, mimetype='application/json')
+    response.headers['Vary'] = 'Accept-Encoding'
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+def format_scores(scores):
+    """Apply the ?format=compact and ?fields=a,b query options to a comparison result."""
+    if request.args.get('format') == 'compact':
+        scores = compact_scores(scores)
+    fields = request.args.get('fields')
+    if fields:
+        scores = project_fields(scores, [f.strip() for f in fields.split(',') if f.strip()])
+    return scores
+
+def is_admin():
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(request.headers.get('X-Admin-Token', ''), ADMIN_TOKEN)
+
+def request_lane(data, default='interactive'):
+    """Priority lane of a request: the X-Priority header or "priority" body field (None if unknown)."""
+    lane = (request.headers.get('X-Priority') or data.get('priority') or default).lower()
+    return lane if lane in LANES else None
+
+class InvalidRequest(ValueError):
+    """A request field that can't be used; answered with 400 and the message."""
+
+def parse_viewports(data):
+    """Extra viewport widths from the "viewports" body field: whole pixels up to MAX_VIEWPORT_WIDTH."""
+    widths = data.get('viewports') or []
+    error = InvalidRequest(f"viewports must be a list of whole widths between 1 and {MAX_VIEWPORT_WIDTH} pixels")
+    if not isinstance(widths, list):
+        raise error
+    parsed = []
+    for width in widths:
+        # "375" is accepted like 375; 375.5 and true are not
+        if isinstance(width, bool) or not isinstance(width, (int, str)):
+            raise error
+        try:
+            width = int(width)
+        except ValueError:
+            raise error
+        if not 0 < width <= MAX_VIEWPORT_WIDTH:
+            raise error
+        parsed.append(width)
+    return parsed
+
+def parse_max_age(data):
+    """The "max_age" body field in seconds (None when omitted)."""
+    if data.get('max_age') is None:
+        return None
+    error = InvalidRequest("max_age must be a whole number of seconds, 0 or more")
+    if isinstance(data['max_age'], bool) or not isinstance(data['max_age'], (int, str)):
+        raise error
+    try:
+        max_age = int(data['max_age'])
+    except ValueError:
+        raise error
+    if max_age < 0:
+        raise error
+    return max_age
+
+def parse_deadline(data):
+    """Seconds the client will wait, from X-Request-Deadline or the "deadline" body field."""
+    value = request.headers.get('X-Request-Deadline') or data.get('deadline')
+    if not value:
+        return DEFAULT_DEADLINE_SECONDS
+    error = InvalidRequest("deadline must be a number of seconds, 0 or more")
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise error
+    try:
+        deadline = float(value)
+    except ValueError:
+        raise error
+    if not math.isfinite(deadline) or deadline < 0:
+        raise error
+    return deadline
+
+def busy_response(error):
+    """429 for a request turned away by admission control, telling the client when to retry."""
+    response = jsonify({"error": "Server busy, retry later", "lane": error.lane, "reason": error.reason,
+                        "retry_after": error.retry_after})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
 
 # --- Flask API endpoint ---
 @app.route('/compare_websites', methods=['POST'])
 def compare_websites_api():
     try:
-        data = request.get_json()
-        if not data:
+        data = request.get_json(silent=True)
+        if not data or not isinstance(data, dict):
             return jsonify({"error": "No data provided"}), 400
 
         print(f"Received data: {data}")
-        print(f"Received data type: {data['category']}")
+        print(f"Received data type: {data.get('category')}")
         websites = data.get('websites', [])
         category = data.get('category', 'ecommerce')
 
         if not websites:
             return jsonify({"error": "No websites provided"}), 400
 
-        scores = compare_websites(websites, category)
-        return jsonify(scores), 200
+        viewports = parse_viewports(data)
+        # Omitted: the server's defaults for stored results and pre-warmed captures
+        max_age = parse_max_age(data)
+        # Seconds the client will wait; sites not finished by then are listed in "missing_sites"
+        deadline = parse_deadline(data)
+        lane = request_lane(data)
+        if lane is None:
+            return jsonify({"error": f"priority must be one of {', '.join(LANES)}"}), 400
+
+        # Request frequency decides which sites the pre-warm scheduler keeps fresh
+        try:
+            get_prewarm_store().record_request(websites, category)
+        except Exception as e:
+            print(f"⚠️ Could not record request for pre-warming: {e}")
+
+        # ?profile=1 (admins only) samples the comparison; the profile id is returned in X-Profile-Id
+        profiling = request.args.get('profile') not in (None, '', '0')
+        if profiling and not is_admin():
+            return jsonify({"error": "Profiling requires an admin token"}), 403
 
+        # An admission slot is only taken if this request ends up running the comparison
+        with deadline_scope(deadline):
+            if profiling:
+                hz = min(request.args.get('profile_hz', PROFILE_SAMPLE_HZ, type=float), MAX_SAMPLE_HZ)
+                meta = {"category": category, "websites": [site.get('name') for site in websites]}
+                with profile_scope("compare_websites", hz, meta) as profile:
+                    scores = compare_websites(websites, category, viewports, max_age, lane)
+            else:
+                scores = compare_websites(websites, category, viewports, max_age, lane)
+        response = json_response(format_scores(scores), 200)
+        if profiling:
+            response.headers['X-Profile-Id'] = profile['id']
+            response.headers['X-Profile-Url'] = f"/admin/profiles/{profile['id']}"
+        return response
+
+    except InvalidRequest as e:
+        return jsonify({"error": str(e)}), 400
+    except AdmissionRejected as e:
+        return busy_response(e)
     except Exception as e:
         print(f"Error processing request: {str(e)}")
         return jsonify({"error": f"Server error: {str(e)}"}), 500
 
-# Route to serve screenshot files
+# --- Batch endpoint: capture each distinct site once, score many groupings ---
+@app.route('/compare_websites/batch', methods=['POST'])
+def compare_websites_batch_api():
+    try:
+        data = request.get_json(silent=True)
+        if not data or not isinstance(data, dict):
+            return jsonify({"error": "No data provided"}), 400
+
+        comparisons = data.get('comparisons', [])
+        if not comparisons:
+            return jsonify({"error": "No comparisons provided"}), 400
+        if any(not comparison.get('websites') for comparison in comparisons):
+            return jsonify({"error": "Every comparison needs websites"}), 400
+
+        viewports = parse_viewports(data)
+        lane = request_lane(data, default='bulk')
+        if lane is None:
+            return jsonify({"error": f"priority must be one of {', '.join(LANES)}"}), 400
+
+        with get_admission_controller().admit(lane):
+            batch = compare_websites_batch(comparisons, viewports=viewports)
+        batch["results"] = [format_scores(scores) for scores in batch["results"]]
+        return json_response(batch, 200)
+
+    except InvalidRequest as e:
+        return jsonify({"error": str(e)}), 400
+    except AdmissionRejected as e:
+        return busy_response(e)
+    except Exception as e:
+        print(f"Error processing batch request: {str(e)}")
+        return jsonify({"error": f"Server error: {str(e)}"}), 500
+
+# --- Worker mode: enqueue comparisons for queue workers (see worker.py) ---
+@app.route('/jobs/compare_websites', methods=['POST'])
+def enqueue_comparison_api():
+    data = request.get_json(silent=True)
+    if not data or not isinstance(data, dict):
+        return jsonify({"error": "No data provided"}), 400
+
+    websites = data.get('websites', [])
+    category = data.get('category', 'ecommerce')
+    if not websites:
+        return jsonify({"error": "No websites provided"}), 400
+
+    try:
+        viewports = parse_viewports(data)
+    except InvalidRequest as e:
+        return jsonify({"error": str(e)}), 400
+    job_id = get_job_queue().enqueue("capture", {
+        "websites": websites,
+        "category": category,
+        "viewports": viewports,
+        "comparison_key": comparison_key(websites, category, {"viewports": sorted(viewports)})
+    })
+    return jsonify({"job_id": job_id, "status_url": f"/jobs/{job_id}"}), 202
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def comparison_job_api(job_id):
+    queue = get_job_queue()
+    job = queue.get(job_id)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+
+    status = {"job_id": job_id, "stage": "capture", "status": job["status"], "attempts": job["attempts"]}
+    if job["status"] == "failed":
+        status["error"] = job["error"]
+    elif job["status"] == "done":
+        # Capture finished: report on the scoring job it handed off to
+        score_job = queue.get(job["result"]["score_job"])
+        status.update(stage="score", status=score_job["status"], attempts=score_job["attempts"])
+        if score_job["status"] == "done":
+            return json_response({**status, "result": format_scores(score_job["result"])}, 200)
+        if score_job["status"] == "failed":
+            status["error"] = score_job["error"]
+    return jsonify(status), 200
+
+# --- Results history (answered from the index, no re-analysis) ---
+@app.route('/results/latest', methods=['GET'])
+def latest_results_api():
+    category = request.args.get('category', 'ecommerce')
+    sites = request.args.getlist('site')
+    include_fallback = request.args.get('include_fallback') == '1'
+    results = get_results_store().latest_scores(category, sites or None, include_fallback)
+    return json_response({"category": category, "results": results}, 200)
+
+@app.route('/results/trend', methods=['GET'])
+def results_trend_api():
+    site = request.args.get('site')
+    if not site:
+        return jsonify({"error": "No site provided"}), 400
+    category = request.args.get('category', 'ecommerce')
+    days = request.args.get('days', 30, type=int)
+    include_fallback = request.args.get('include_fallback') == '1'
+    trend = get_results_store().score_trend(site, category, days, include_fallback)
+    return json_response({"site": site, "category": category, "days": days, "trend": trend}, 200)
+
+# Gemini limiter / circuit breaker and request coalescing metrics
+@app.route('/metrics', methods=['GET'])
+def metrics_api():
+    return jsonify({
+        "gemini": get_gemini_client().metrics(),
+        "comparisons": comparison_flight.metrics(),
+        "admission": get_admission_controller().metrics(),
+        "jobs": get_job_queue().stats(),
+        "archive": get_image_archive().stats() if SCREENSHOT_STORAGE == 'archive' else None
+    }), 200
+
+# --- Profiles (admins only): speedscope JSON, or ?format=folded for flamegraph tools ---
+def profile_response(document, filename):
+    if request.args.get('format') == 'folded':
+        return Response(to_folded(document), mimetype='text/plain')
+    response = json_response(document, 200)
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}.speedscope.json"'
+    return response
+
+@app.route('/admin/profiles', methods=['GET'])
+def profiles_api():
+    if not is_admin():
+        return jsonify({"error": "Admin token required"}), 403
+    return jsonify({"profiles": list_profiles()}), 200
+
+@app.route('/admin/profiles/continuous', methods=['GET'])
+def continuous_profile_api():
+    if not is_admin():
+        return jsonify({"error": "Admin token required"}), 403
+    profiler = get_continuous_profiler()
+    if profiler is None:
+        return jsonify({"error": "Continuous profiling is off (set PROFILE_CONTINUOUS_HZ)"}), 404
+    response = profile_response(profiler.speedscope(), "continuous")
+    if request.args.get('reset'):
+        profiler.reset()
+    return response
+
+@app.route('/admin/profiles/<profile_id>', methods=['GET'])
+def profile_api(profile_id):
+    if not is_admin():
+        return jsonify({"error": "Admin token required"}), 403
+    document = load_profile(profile_id)
+    if document is None:
+        return jsonify({"error": "Profile not found"}), 404
+    return profile_response(document, profile_id)
+
+# Route to serve screenshot files (?w=320 serves a cached thumbnail)
+def is_public_screenshot(path):
+    """Whether a /screenshots/ path may be served: an image, not inside a dot-directory."""
+    parts = path.replace('\\', '/').split('/')
+    return not any(part.startswith('.') for part in parts) and path.lower().endswith(SERVED_IMAGE_EXTENSIONS)
+
 @app.route('/screenshots/<path:path>')
 def serve_screenshots(path):
-    return send_from_directory('screenshots', path)
+    if not is_public_screenshot(path):
+        raise NotFound()
+    source = safe_join(SCREENSHOTS_DIR, path)
+    if source is None:
+        raise NotFound()
+    if not os.path.isfile(source):
+        return serve_archived_screenshot(path)
+
+    width = request.args.get('w', type=int)
+    if width and width > 0:
+        path = get_thumbnail(SCREENSHOTS_DIR, path, width)
+
+    # send_from_directory answers If-None-Match with 304 and honours Range requests
+    response = send_from_directory(
+        SCREENSHOTS_DIR,
+        path,
+        etag=file_etag(os.path.join(SCREENSHOTS_DIR, path)),
+        max_age=SCREENSHOT_MAX_AGE,
+        conditional=True
+    )
+    response.cache_control.public = True
+    return response
+
+def serve_archived_screenshot(key):
+    """Serve a screenshot from the packed archive with the same caching as loose files."""
+    archive = get_image_archive()
+    if SCREENSHOT_STORAGE != 'archive' or archive.info(key) is None:
+        raise NotFound()
+
+    width = request.args.get('w', type=int)
+    if width and width > 0:
+        key = get_archived_thumbnail(archive, key, width)
+
+    entry = archive.info(key)
+    data = archive.get(key)
+    if entry is None or data is None:
+        raise NotFound()
+    response = Response(data.tobytes(), mimetype=mimetypes.guess_type(key)[0] or 'application/octet-stream')
+    response.set_etag(entry['etag'])
+    response.last_modified = entry['created_at']
+    response.cache_control.max_age = SCREENSHOT_MAX_AGE
+    response.cache_control.public = True
+    # Answers If-None-Match with 304 and honours Range requests, like send_from_directory
+    return response.make_conditional(request, accept_ranges=True, complete_length=entry['length'])
 
 # Run the Flask app
 if __name__ == "__main__":
@@ -0,0 +1,106 @@
+import os
+import base64
+import weakref
+
+# Browser used for captures: firefox, chromium or webkit
+BROWSER_ENGINE = os.environ.get("BROWSER_ENGINE", "firefox").lower()
+ENGINES = ("firefox", "chromium", "webkit")
+# On Chromium, take screenshots with the DevTools protocol's Page.captureScreenshot instead of
+# Playwright's generic path (no scrolling or viewport resizing for full-page and clipped shots)
+CDP_SCREENSHOTS = os.environ.get("CDP_SCREENSHOTS", "1") != "0"
+
+LAUNCH_ARGS = {
+    # /dev/shm is small in containers; Chromium falls back to /tmp for shared memory
+    "chromium": ["--disable-dev-shm-usage"],
+}
+
+# CDP session of each Chromium page, opened on its first screenshot
+_cdp_sessions = weakref.WeakKeyDictionary()
+
+
+def launch_browser(playwright, engine=None):
+    """
+    Launch a headless browser of the configured engine.
+
+    Args:
+        playwright: Started sync Playwright instance
+        engine: firefox / chromium / webkit (default BROWSER_ENGINE)
+
+    Returns:
+        Playwright Browser
+    """
+    engine = engine or BROWSER_ENGINE
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown browser engine {engine!r}; expected one of {', '.join(ENGINES)}")
+    return getattr(playwright, engine).launch(headless=True, args=LAUNCH_ARGS.get(engine, []))
+
+
+def uses_cdp(page):
+    return CDP_SCREENSHOTS and page.context.browser is not None and page.context.browser.browser_type.name == "chromium"
+
+
+def _cdp_session(page):
+    session = _cdp_sessions.get(page)
+    if session is None:
+        session = _cdp_sessions[page] = page.context.new_cdp_session(page)
+    return session
+
+
+def _cdp_screenshot(page, clip, full_page, image_format, quality):
+    session = _cdp_session(page)
+    if full_page:
+        metrics = session.send("Page.getLayoutMetrics")
+        size = metrics.get("cssContentSize") or metrics["contentSize"]
+        region = {"x": 0, "y": 0, "width": size["width"], "height": size["height"]}
+    elif clip:
+        # Playwright clips are relative to the viewport, CDP clips to the document
+        scroll_x, scroll_y = page.evaluate("() => [window.scrollX, window.scrollY]")
+        region = {**clip, "x": clip["x"] + scroll_x, "y": clip["y"] + scroll_y}
+    else:
+        region = None
+
+    params = {"format": image_format, "captureBeyondViewport": bool(region), "optimizeForSpeed": True}
+    if region:
+        params["clip"] = {**region, "scale": 1}
+    if quality is not None and image_format != "png":
+        params["quality"] = quality
+    return base64.b64decode(session.send("Page.captureScreenshot", params)["data"])
+
+
+def screenshot(page, clip=None, full_page=False, image_format="png", quality=None):
+    """
+    Screenshot a page, a clip of it or the full scrollable page with whichever engine the page
+    belongs to. Chromium pages go through CDP Page.captureScreenshot (falling back to Playwright
+    if the protocol call fails); other engines use Playwright's page.screenshot.
+
+    Args:
+        page: Playwright page
+        clip: {"x", "y", "width", "height"} relative to the viewport, like page.screenshot
+        full_page: Capture the whole scrollable page
+        image_format: png, jpeg or webp (webp only on Chromium)
+        quality: 0-100 for jpeg / webp
+
+    Returns:
+        Image bytes
+    """
+    if uses_cdp(page):
+        try:
+            return _cdp_screenshot(page, clip, full_page, image_format, quality)
+        except Exception as e:
+            print(f"⚠️ CDP screenshot failed, using Playwright's: {e}")
+    options = {"full_page": full_page, "type": "jpeg" if image_format == "jpeg" else "png"}
+    if clip:
+        options["clip"] = clip
+    if quality is not None and image_format == "jpeg":
+        options["quality"] = quality
+    return page.screenshot(**options)
+
+
+def element_screenshot(page, element, box=None):
+    """Screenshot one element by its bounding box (`box` if already known)."""
+    if not uses_cdp(page):
+        return element.screenshot()
+    box = box or element.bounding_box()
+    if not box or box["width"] < 1 or box["height"] < 1:
+        return element.screenshot()  # Lets Playwright raise its usual error for hidden elements
+    return screenshot(page, clip=box)
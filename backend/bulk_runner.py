@@ -0,0 +1,226 @@
+# Resumable bulk runner: capture and score a CSV / JSONL list of sites on a worker pool.
+#
+#     python bulk_runner.py sites.csv --output results.jsonl --workers 4
+import os
+import sys
+import csv
+import json
+import time
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent))
+from singleflight import comparison_key
+
+
+def result_status(result):
+    """
+    Status of a finished comparison: "failed" when no site was scored, "partial" when some
+    sites are missing or the local scorer stood in for Gemini, otherwise "ok".
+
+    Returns:
+        Tuple of (status, reason), reason None for "ok"
+    """
+    if not result.get("full"):
+        return "failed", result.get("error") or "no site could be captured and scored"
+    if result.get("partial"):
+        return "partial", f"missing {', '.join(result.get('missing_sites', []))}"
+    if result.get("fallback"):
+        return "partial", f"scored locally ({result.get('fallback_reason') or 'Gemini unavailable'})"
+    return "ok", None
+
+
+def load_jobs(path, default_category):
+    """
+    Read comparison jobs from a CSV or JSONL file.
+
+    Returns:
+        List of dicts with "id", "websites" and "category"
+    """
+    comparisons = []
+    groups = {}
+
+    if path.endswith(".jsonl"):
+        with open(path) as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+    else:
+        with open(path, newline="") as f:
+            rows = list(csv.DictReader(f))
+
+    for row in rows:
+        category = (row.get("category") or default_category).strip()
+        if "websites" in row:
+            comparisons.append({"websites": row["websites"], "category": category})
+            continue
+        site = {"name": row.get("name") or row["url"], "url": row["url"].strip()}
+        group = row.get("group")
+        if group:
+            if (group, category) not in groups:
+                groups[(group, category)] = {"websites": [], "category": category}
+                comparisons.append(groups[(group, category)])
+            groups[(group, category)]["websites"].append(site)
+        else:
+            comparisons.append({"websites": [site], "category": category})
+
+    for comparison in comparisons:
+        key = comparison_key(comparison["websites"], comparison["category"])
+        comparison["id"] = hashlib.sha1(key.encode()).hexdigest()[:16]
+    return comparisons
+
+
+def load_checkpoint(path, retry_failed=False):
+    """
+    Job ids already finished in an earlier run: ok ones, and failed ones unless retry_failed.
+    Partial results are always run again.
+    """
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue  # Torn last line from an interrupted write
+            if entry.get("status") == "ok" or (entry.get("status") == "failed" and not retry_failed):
+                done.add(entry["id"])
+    return done
+
+
+class BulkRunner:
+    """Runs comparison jobs on a worker pool, streaming results and checkpoints to disk."""
+
+    def __init__(self, output_path, checkpoint_path, workers=4, viewports=None, max_age=0):
+        self.output_path = output_path
+        self.checkpoint_path = checkpoint_path
+        self.workers = workers
+        self.viewports = viewports
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.completed = 0
+        self.failed = 0
+        self.partial = 0
+        self.sites_done = 0
+        self.total = 0
+        self.started_at = None
+
+    def _append(self, path, entry):
+        with open(path, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _run_job(self, job):
+        # Imported lazily so --help and checkpoint inspection don't need a browser stack
+        from website_comparison import compare_websites
+
+        start_time = time.time()
+        try:
+            result = compare_websites(job["websites"], job["category"], self.viewports, self.max_age)
+            status, reason = result_status(result)
+            payload = {"result": result} if status == "ok" else {"result": result, "error": reason}
+        except Exception as e:
+            status, payload = "failed", {"error": str(e)}
+
+        entry = {
+            "id": job["id"],
+            "status": status,
+            "category": job["category"],
+            "websites": job["websites"],
+            "seconds": round(time.time() - start_time, 2),
+            **payload
+        }
+        with self.lock:
+            self._append(self.output_path, entry)
+            self._append(self.checkpoint_path, {"id": job["id"], "status": status})
+            self.completed += 1
+            self.failed += status == "failed"
+            self.partial += status == "partial"
+            self.sites_done += len(job["websites"])
+        return entry
+
+    def _print_progress(self):
+        elapsed = time.time() - self.started_at
+        rate = self.completed / elapsed if elapsed > 0 else 0
+        remaining = self.total - self.completed
+        eta = remaining / rate if rate > 0 else float("inf")
+        eta_text = time.strftime("%H:%M:%S", time.gmtime(eta)) if eta != float("inf") else "--:--:--"
+        sys.stdout.write(
+            f"\r[{self.completed}/{self.total}] {self.failed} failed, {self.partial} partial | "
+            f"{rate * 60:.1f} jobs/min, {self.sites_done / elapsed * 60 if elapsed else 0:.1f} sites/min | "
+            f"ETA {eta_text}   "
+        )
+        sys.stdout.flush()
+
+    def run(self, jobs):
+        self.total = len(jobs)
+        self.started_at = time.time()
+        stop = threading.Event()
+
+        def report():
+            while not stop.wait(1.0):
+                with self.lock:
+                    self._print_progress()
+
+        reporter = threading.Thread(target=report, daemon=True)
+        reporter.start()
+        executor = ThreadPoolExecutor(max_workers=self.workers)
+        try:
+            futures = [executor.submit(self._run_job, job) for job in jobs]
+            for future in as_completed(futures):
+                entry = future.result()
+                if entry["status"] == "failed":
+                    sys.stdout.write(f"\n❌ {entry['id']} failed: {entry['error']}\n")
+                elif entry["status"] == "partial":
+                    sys.stdout.write(f"\n⚠️ {entry['id']} partial: {entry['error']}\n")
+        except KeyboardInterrupt:
+            # Drop queued jobs; running ones finish and are checkpointed so a re-run resumes here
+            sys.stdout.write("\n⚠️ Interrupted. Waiting for running jobs to finish...\n")
+            executor.shutdown(wait=True, cancel_futures=True)
+            raise
+        finally:
+            executor.shutdown(wait=True)
+            stop.set()
+            reporter.join()
+            with self.lock:
+                self._print_progress()
+            print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Capture and score a large list of websites.")
+    parser.add_argument("input", help="CSV or JSONL file of sites / comparisons")
+    parser.add_argument("--output", default="bulk_results.jsonl", help="JSONL file results are streamed to")
+    parser.add_argument("--checkpoint", help="Checkpoint file (default: <output>.checkpoint)")
+    parser.add_argument("--category", default="ecommerce", help="Category for rows without one")
+    parser.add_argument("--workers", type=int, default=4, help="Concurrent jobs (one browser each)")
+    parser.add_argument("--viewports", default="", help="Extra viewport widths, e.g. 375,768")
+    parser.add_argument("--max-age", type=int, default=0, help="Reuse stored results newer than this (seconds)")
+    parser.add_argument("--retry-failed", action="store_true", help="Re-run jobs that failed last time")
+    args = parser.parse_args()
+
+    checkpoint = args.checkpoint or f"{args.output}.checkpoint"
+    jobs = load_jobs(args.input, args.category)
+    done = load_checkpoint(checkpoint, args.retry_failed)
+    pending = [job for job in jobs if job["id"] not in done]
+
+    print(f"{len(jobs)} jobs in {args.input}: {len(jobs) - len(pending)} already done, {len(pending)} to run")
+    if not pending:
+        return
+
+    viewports = [int(width) for width in args.viewports.split(",") if width.strip()]
+    runner = BulkRunner(args.output, checkpoint, args.workers, viewports, args.max_age)
+    try:
+        runner.run(pending)
+    except KeyboardInterrupt:
+        print(f"Stopped after {runner.completed} jobs. Run the same command again to resume.")
+        return
+    ok = runner.completed - runner.failed - runner.partial
+    print(f"Finished: {ok} ok, {runner.partial} partial, {runner.failed} failed. Results in {args.output}")
+
+
+if __name__ == "__main__":
+    main()
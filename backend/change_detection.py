@@ -0,0 +1,184 @@
+import os
+import json
+import time
+import hashlib
+import threading
+import numpy as np
+from PIL import Image
+
+from singleflight import normalize_url
+from image_archive import screenshot_file
+from result_model import GEMINI_SECTION_KEYS
+
+# Full-page screenshots can be very tall; PIL refuses them by default
+Image.MAX_IMAGE_PIXELS = None
+
+# A section counts as unchanged when its dHash differs by at most this many bits (of 64)...
+MAX_HASH_DISTANCE = int(os.environ.get("CHANGE_MAX_HASH_DISTANCE", "6"))
+# ...and at most this fraction of its grid cells changed brightness noticeably
+MAX_CHANGED_REGION_FRACTION = float(os.environ.get("CHANGE_MAX_REGION_FRACTION", "0.05"))
+# Per-cell mean brightness difference (0-255) that marks a cell as changed
+CELL_DIFF_THRESHOLD = 12
+# Relative height change beyond which a section is always treated as changed
+MAX_HEIGHT_CHANGE = 0.10
+
+GRID_SIZE = 16
+# Kept out of the screenshots tree, which /screenshots/<path> serves publicly
+DATA_DIR = os.environ.get("DATA_DIR", "data")
+ANALYSIS_CACHE_DIR = os.environ.get("ANALYSIS_CACHE_DIR", os.path.join(DATA_DIR, "analysis"))
+
+
+def fingerprint(image_path):
+    """
+    Perceptual fingerprint of a screenshot: 64-bit difference hash plus a
+    GRID_SIZE x GRID_SIZE grid of mean brightness values for region diffs.
+
+    Returns:
+        Dict with "dhash" (hex), "cells" (flat list) and "size" ([width, height]), or None
+    """
+    try:
+        with Image.open(screenshot_file(image_path)) as image:
+            size = [image.width, image.height]
+            gray = image.convert("L")
+            hash_pixels = np.asarray(gray.resize((9, 8), Image.BILINEAR), dtype=np.int16)
+            cells = np.asarray(gray.resize((GRID_SIZE, GRID_SIZE), Image.BOX), dtype=np.uint8)
+    except (OSError, ValueError) as e:
+        print(f"⚠️ Could not fingerprint {image_path}: {e}")
+        return None
+
+    bits = (hash_pixels[:, 1:] > hash_pixels[:, :-1]).flatten()
+    dhash = int("".join("1" if bit else "0" for bit in bits), 2)
+    return {"dhash": f"{dhash:016x}", "cells": cells.flatten().tolist(), "size": size}
+
+
+def fingerprint_distance(a, b):
+    """
+    Returns:
+        Tuple of (hash bit distance, fraction of changed grid cells, relative height change)
+    """
+    hash_distance = bin(int(a["dhash"], 16) ^ int(b["dhash"], 16)).count("1")
+    diff = np.abs(np.asarray(a["cells"], dtype=np.int16) - np.asarray(b["cells"], dtype=np.int16))
+    changed_fraction = float(np.count_nonzero(diff > CELL_DIFF_THRESHOLD)) / diff.size
+    height_change = abs(a["size"][1] - b["size"][1]) / max(1, b["size"][1])
+    return hash_distance, changed_fraction, height_change
+
+
+def is_unchanged(current, previous, max_hash_distance=MAX_HASH_DISTANCE,
+                 max_region_fraction=MAX_CHANGED_REGION_FRACTION):
+    """Whether two fingerprints are within the configured visual-distance threshold."""
+    if not current or not previous:
+        return False
+    hash_distance, changed_fraction, height_change = fingerprint_distance(current, previous)
+    return (hash_distance <= max_hash_distance
+            and changed_fraction <= max_region_fraction
+            and height_change <= MAX_HEIGHT_CHANGE)
+
+
+class AnalysisCache:
+    """
+    Last scored analysis per (URL, category), stored as small JSON files together
+    with the fingerprints of the screenshots it was computed from.
+    """
+
+    def __init__(self, directory=ANALYSIS_CACHE_DIR):
+        self.directory = directory
+        self.lock = threading.Lock()
+
+    def _path(self, url, category):
+        key = hashlib.sha1(f"{normalize_url(url)}|{category.strip().lower()}".encode()).hexdigest()
+        return os.path.join(self.directory, f"{key}.json")
+
+    def load(self, url, category):
+        try:
+            with open(self._path(url, category)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def save(self, url, category, fingerprints, analysis, viewports=None):
+        record = {
+            "url": url,
+            "category": category,
+            "fingerprints": fingerprints,
+            "analysis": analysis,
+            "viewports": viewports or [],
+            "scored_at": time.time()
+        }
+        path = self._path(url, category)
+        with self.lock:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(record, f)
+            os.replace(tmp_path, path)
+
+
+class RelevanceCache:
+    """
+    Text relevance scores keyed by a hash of the category and a site's section texts, so a
+    site whose visible text hasn't changed isn't sent to Gemini for relevance again.
+    """
+
+    def __init__(self, directory=os.path.join(ANALYSIS_CACHE_DIR, "relevance")):
+        self.directory = directory
+        self.lock = threading.Lock()
+
+    def _path(self, texts, category):
+        # Whitespace is collapsed the same way the relevance prompt does
+        normalized = {section: " ".join((text or "").split()) for section, text in sorted(texts.items())}
+        key = hashlib.sha1(json.dumps([category.strip().lower(), normalized]).encode()).hexdigest()
+        return os.path.join(self.directory, f"{key}.json")
+
+    def load(self, texts, category):
+        try:
+            with open(self._path(texts, category)) as f:
+                return json.load(f)["scores"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def save(self, texts, category, scores):
+        path = self._path(texts, category)
+        with self.lock:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"category": category, "scores": scores, "scored_at": time.time()}, f)
+            os.replace(tmp_path, path)
+
+
+def plan_reanalysis(sections, cached):
+    """
+    Compare freshly captured sections against the cached analysis.
+
+    Args:
+        sections: Dict of section name → screenshot path (from capture)
+        cached: Record from AnalysisCache.load, or None
+
+    Returns:
+        Tuple of (fingerprints, changed) where changed lists the sections that need
+        re-analysis; None means the whole page needs a full analysis
+    """
+    fingerprints = {
+        section: fingerprint(sections[section])
+        for section in ["header", "main", "footer", "full"]
+        if sections.get(section)
+    }
+    if not cached or "full" not in fingerprints:
+        return fingerprints, None
+
+    previous = cached.get("fingerprints", {})
+    if is_unchanged(fingerprints["full"], previous.get("full")):
+        return fingerprints, []
+
+    changed = [
+        section for section in GEMINI_SECTION_KEYS
+        if section in fingerprints and not is_unchanged(fingerprints[section], previous.get(section))
+    ]
+    if not changed:
+        # The page moved but no single crop did: the main content absorbed the change
+        changed = ["main"] if "main" in fingerprints else None
+        return fingerprints, changed
+    # Everything moved (or the layout shifted): a full analysis is cheaper to reason about
+    if len(changed) == len([s for s in GEMINI_SECTION_KEYS if s in fingerprints]):
+        return fingerprints, None
+    return fingerprints, changed
@@ -0,0 +1,213 @@
+import os
+import json
+import hashlib
+from io import BytesIO
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+
+from image_archive import read_screenshot
+
+try:
+    import cloudinary
+    import cloudinary.uploader
+except ImportError:  # Cloudinary is optional; uploads are skipped without it
+    cloudinary = None
+
+# Number of concurrent uploads running in the background
+UPLOAD_WORKERS = int(os.environ.get("CLOUDINARY_UPLOAD_WORKERS", "4"))
+
+# Content hash of everything already uploaded, keyed by full public_id
+UPLOAD_INDEX_PATH = os.environ.get("CLOUDINARY_UPLOAD_INDEX", "screenshots/.cloudinary_index.json")
+
+_configured = False
+_index = None
+_index_lock = threading.Lock()
+
+
+def init_cloudinary():
+    """
+    Configure Cloudinary from CLOUDINARY_URL or CLOUDINARY_CLOUD_NAME / _API_KEY / _API_SECRET.
+
+    Returns:
+        True if uploads are enabled
+    """
+    global _configured
+    if cloudinary is None:
+        print("⚠️ cloudinary package not installed. Screenshots will only be stored locally.")
+        return False
+
+    cloud_name = os.environ.get("CLOUDINARY_CLOUD_NAME")
+    api_key = os.environ.get("CLOUDINARY_API_KEY")
+    api_secret = os.environ.get("CLOUDINARY_API_SECRET")
+
+    if os.environ.get("CLOUDINARY_URL"):
+        cloudinary.config(secure=True)
+    elif cloud_name and api_key and api_secret:
+        cloudinary.config(cloud_name=cloud_name, api_key=api_key, api_secret=api_secret, secure=True)
+    else:
+        print("⚠️ Cloudinary credentials not set. Screenshots will only be stored locally.")
+        return False
+
+    _configured = True
+    return True
+
+
+def _load_index():
+    global _index
+    if _index is None:
+        try:
+            with open(UPLOAD_INDEX_PATH) as f:
+                _index = json.load(f)
+        except (OSError, ValueError):
+            _index = {}
+    return _index
+
+
+def _save_index():
+    os.makedirs(os.path.dirname(UPLOAD_INDEX_PATH) or ".", exist_ok=True)
+    tmp_path = f"{UPLOAD_INDEX_PATH}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(_index, f)
+    os.replace(tmp_path, UPLOAD_INDEX_PATH)
+
+
+def upload_image(image, public_id=None, folder=None):
+    """
+    Upload an image to Cloudinary, skipping the upload if identical content is
+    already stored under the same public_id.
+
+    Args:
+        image: Local file path or raw image bytes
+        public_id: Cloudinary public_id (without folder)
+        folder: Cloudinary folder
+
+    Returns:
+        Dict with "url" and "public_id" (and "cached": True when skipped), or {"error": ...}
+    """
+    if not _configured:
+        return {"error": "Cloudinary not configured"}
+
+    try:
+        if isinstance(image, (bytes, bytearray, memoryview)):
+            data = bytes(image)
+        else:
+            data = read_screenshot(image)
+            if data is None:
+                raise FileNotFoundError(image)
+            data = bytes(data)
+    except OSError as e:
+        return {"error": f"Could not read image: {e}"}
+
+    full_id = f"{folder}/{public_id}" if folder and public_id else public_id
+    digest = hashlib.sha256(data).hexdigest()
+
+    with _index_lock:
+        known = _load_index().get(full_id) if full_id else None
+    if known and known["sha256"] == digest:
+        return {"url": known["url"], "public_id": full_id, "cached": True}
+
+    try:
+        result = cloudinary.uploader.upload(
+            BytesIO(data),
+            public_id=public_id,
+            folder=folder,
+            overwrite=True,
+            resource_type="image",
+        )
+    except Exception as e:
+        return {"error": str(e)}
+
+    url = result.get("secure_url") or result.get("url")
+    stored_id = result.get("public_id", full_id)
+    with _index_lock:
+        _load_index()[stored_id] = {"sha256": digest, "url": url}
+        _save_index()
+    return {"url": url, "public_id": stored_id}
+
+
+class UploadQueue:
+    """
+    Background upload queue backed by a thread pool. Concurrent submissions of the
+    same content for the same public_id share one in-flight upload.
+    """
+
+    def __init__(self, max_workers=UPLOAD_WORKERS):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="cloudinary-upload")
+        self.in_flight = {}
+        self.lock = threading.Lock()
+
+    def submit(self, data, public_id, folder=None):
+        key = (f"{folder}/{public_id}" if folder else public_id, hashlib.sha256(data).hexdigest())
+        with self.lock:
+            pending = self.in_flight.get(key)
+            if pending is not None and not pending.done():
+                return pending
+            future = self.executor.submit(upload_image, data, public_id=public_id, folder=folder)
+            self.in_flight[key] = future
+        future.add_done_callback(lambda f, key=key: self._forget(key, f))
+        return future
+
+    def _forget(self, key, future):
+        with self.lock:
+            if self.in_flight.get(key) is future:
+                del self.in_flight[key]
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_upload_queue():
+    """Return the process-wide upload queue, creating it on first use."""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = UploadQueue()
+        return _queue
+
+
+def upload_website_screenshots(website_name, images):
+    """
+    Queue the section screenshots of a website for background upload.
+
+    Args:
+        website_name: Website name (used for folder and public_id)
+        images: Dict mapping section name to raw image bytes (None entries are skipped)
+
+    Returns:
+        Dict mapping section name to a Future resolving to the upload_image result
+    """
+    if not _configured:
+        return {}
+
+    folder = f"website_screenshots/{website_name}"
+    queue = get_upload_queue()
+    return {
+        section: queue.submit(data, public_id=f"{website_name}_{section}", folder=folder)
+        for section, data in images.items()
+        if data
+    }
+
+
+def collect_uploads(pending, timeout=None):
+    """
+    Wait for queued uploads and turn them into `<section>_cloudinary_url` entries.
+
+    Args:
+        pending: Dict mapping section name to Future (from upload_website_screenshots)
+        timeout: Maximum seconds to wait per upload
+
+    Returns:
+        Dict mapping "<section>_cloudinary_url" to the uploaded URL
+    """
+    urls = {}
+    for section, future in pending.items():
+        try:
+            result = future.result(timeout=timeout) if isinstance(future, Future) else future
+        except Exception as e:
+            result = {"error": str(e)}
+        if "error" not in result:
+            urls[f"{section}_cloudinary_url"] = result["url"]
+        else:
+            print(f"⚠️ Failed to upload {section} screenshot to Cloudinary: {result['error']}")
+    return urls
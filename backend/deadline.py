@@ -0,0 +1,73 @@
+import os
+import time
+import contextvars
+from contextlib import contextmanager
+
+# Deadline applied to comparison requests that don't send one (0 = no deadline)
+DEFAULT_DEADLINE_SECONDS = float(os.environ.get("REQUEST_DEADLINE_SECONDS", "0"))
+# Time capture leaves for uploading and analysing what it captured (at most half the deadline)
+ANALYSIS_RESERVE_SECONDS = float(os.environ.get("DEADLINE_ANALYSIS_RESERVE", "20"))
+
+
+class DeadlineExceeded(Exception):
+    """Raised when there is no time left for a step before the request deadline."""
+
+
+class Deadline:
+    """Absolute point in time by which a request has to answer."""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+
+_current = contextvars.ContextVar("request_deadline", default=None)
+
+
+@contextmanager
+def deadline_scope(seconds):
+    """
+    Apply a deadline to everything run in this context (threads started with
+    contextvars.copy_context() and asyncio tasks inherit it). None or 0 means no deadline.
+    """
+    token = _current.set(Deadline(seconds) if seconds else None)
+    try:
+        yield _current.get()
+    finally:
+        _current.reset(token)
+
+
+def current_deadline():
+    return _current.get()
+
+
+def remaining_seconds(default=None, reserve=0.0):
+    """
+    Seconds a step may take: `default` shrunk to the time left before the deadline,
+    minus `reserve` seconds kept back for later steps. Without a deadline, `default`.
+    """
+    deadline = _current.get()
+    if deadline is None:
+        return default
+    left = max(0.0, deadline.remaining() - reserve)
+    return left if default is None else min(default, left)
+
+
+def timeout_ms(default_ms, reserve=0.0):
+    """Like remaining_seconds, in whole milliseconds (for Playwright timeouts)."""
+    return int(remaining_seconds(default_ms / 1000.0, reserve) * 1000)
+
+
+def deadline_passed(reserve=0.0):
+    """Whether less than `reserve` seconds are left before the deadline."""
+    deadline = _current.get()
+    return deadline is not None and deadline.remaining() <= reserve
+
+
+def capture_reserve():
+    """Seconds capture must leave for the upload and analysis stages."""
+    deadline = _current.get()
+    return min(ANALYSIS_RESERVE_SECONDS, deadline.seconds / 2) if deadline else 0.0
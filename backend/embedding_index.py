@@ -0,0 +1,285 @@
+# Visual-embedding index: section embeddings (e.g. CLIP) appended to a memory-mapped float32
+# matrix with one JSON metadata line per row, searched with a single matrix-vector product.
+#
+#     python embedding_index.py --index clip-vit-b32 --stats
+#     python embedding_index.py --index clip-vit-b32 --like screenshots/amazon/amazon_header.png -k 5
+#     python embedding_index.py --index clip-vit-b32 --like screenshots/jio/jio_footer.png --best 5
+import os
+import json
+import time
+import argparse
+import threading
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: appends are only serialized within one process
+    fcntl = None
+
+# Kept out of the screenshots tree, which /screenshots/<path> serves publicly
+DATA_DIR = os.environ.get("DATA_DIR", "data")
+EMBEDDINGS_DIR = os.environ.get("EMBEDDINGS_DIR", os.path.join(DATA_DIR, "embeddings"))
+
+
+class EmbeddingIndex:
+    """
+    Append-only store of L2-normalized embeddings for one model. Vectors live in
+    `vectors.f32` (rows of `dim` float32) and are read through a read-only memmap;
+    `meta.jsonl` holds one metadata dict per row (site, url, category, section, path,
+    score, created_at). Other processes' appends are picked up on the next search.
+    Only the newest embedding of each (url, section) is searched unless asked otherwise.
+    """
+
+    def __init__(self, name, directory=EMBEDDINGS_DIR):
+        self.name = name
+        self.directory = os.path.join(directory, name)
+        self.vectors_path = os.path.join(self.directory, "vectors.f32")
+        self.meta_path = os.path.join(self.directory, "meta.jsonl")
+        self.lock = threading.Lock()
+        self.dim = None
+        self.meta = []
+        self.meta_offset = 0  # Bytes of meta.jsonl already read
+        self.latest = {}  # (url, section) -> newest row
+        self.paths = {}  # image path -> row
+        self.matrix = None
+        self.columns = {}
+        self.is_latest = None
+        self.header_path = os.path.join(self.directory, "index.json")
+        os.makedirs(self.directory, exist_ok=True)
+        self._read_header()
+
+    def _read_header(self):
+        """Load the embedding size, once the first append (of any process) has written it."""
+        try:
+            with open(self.header_path) as f:
+                self.dim = json.load(f)["dim"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    class _AppendLock:
+        """Serializes appends across threads, and across processes where flock is available."""
+
+        def __init__(self, index):
+            self.index = index
+
+        def __enter__(self):
+            self.index.lock.acquire()
+            self.file = open(os.path.join(self.index.directory, "append.lock"), "a")
+            if fcntl:
+                fcntl.flock(self.file, fcntl.LOCK_EX)
+            return self
+
+        def __exit__(self, *exc):
+            if fcntl:
+                fcntl.flock(self.file, fcntl.LOCK_UN)
+            self.file.close()
+            self.index.lock.release()
+
+    def _refresh(self):
+        """Read metadata appended since the last call and remap the vectors if rows were added."""
+        if not os.path.exists(self.meta_path):
+            return
+        if self.dim is None:
+            # Opened while the index was empty; another process has appended since
+            self._read_header()
+            if self.dim is None:
+                return
+        with open(self.meta_path, "rb") as f:
+            f.seek(self.meta_offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # An append in progress; picked up next time
+                self.meta_offset += len(line)
+                row = len(self.meta)
+                entry = json.loads(line)
+                self.meta.append(entry)
+                self.latest[(entry.get("url"), entry.get("section"))] = row
+                if entry.get("path"):
+                    self.paths[entry["path"]] = row
+        rows = len(self.meta)
+        if rows and (self.matrix is None or self.matrix.shape[0] != rows):
+            self.matrix = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(rows, self.dim))
+
+    def add(self, vector, meta):
+        """
+        Append one embedding.
+
+        Args:
+            vector: 1-D embedding (any float dtype, normalized here)
+            meta: Dict with at least "section" and "url"; "site", "category", "path" and "score" are used by searches
+
+        Returns:
+            Row number of the embedding
+        """
+        vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+        vector = vector / (np.linalg.norm(vector) or 1.0)
+        with self._AppendLock(self):
+            if self.dim is None:
+                self._read_header()
+            if self.dim is None:
+                self.dim = len(vector)
+                tmp_path = f"{self.header_path}.{os.getpid()}.tmp"
+                with open(tmp_path, "w") as f:
+                    json.dump({"name": self.name, "dim": self.dim}, f)
+                os.replace(tmp_path, self.header_path)
+            if len(vector) != self.dim:
+                raise ValueError(f"Index {self.name} holds {self.dim}-d embeddings, got {len(vector)}")
+            self._refresh()
+            row = len(self.meta)
+            with open(self.vectors_path, "ab") as f:
+                # Drop a vector left behind by an append that died before writing its metadata
+                f.truncate(row * self.dim * 4)
+                f.write(vector.tobytes())
+            # The metadata line is what makes the row visible, so it's written last
+            with open(self.meta_path, "ab") as f:
+                f.write((json.dumps({**meta, "created_at": meta.get("created_at", time.time())}) + "\n").encode())
+        return row
+
+    def vector(self, row):
+        with self.lock:
+            self._refresh()
+            return np.array(self.matrix[row])
+
+    def row_for_path(self, path):
+        with self.lock:
+            self._refresh()
+            return self.paths.get(path)
+
+    def _candidates(self, section=None, category=None, latest_only=True, exclude_url=None):
+        rows = len(self.meta)
+        if self.is_latest is None or len(self.is_latest) != rows:
+            # Metadata columns as arrays (rebuilt after appends), so filters are vectorized like the similarity
+            self.columns = {
+                key: np.array([entry.get(key) for entry in self.meta], dtype=object)
+                for key in ("section", "category", "url")
+            }
+            self.is_latest = np.zeros(rows, dtype=bool)
+            self.is_latest[list(self.latest.values())] = True
+        mask = self.is_latest.copy() if latest_only else np.ones(rows, dtype=bool)
+        if section is not None:
+            mask &= self.columns["section"] == section
+        if category is not None:
+            mask &= self.columns["category"] == category
+        if exclude_url is not None:
+            mask &= self.columns["url"] != exclude_url
+        return np.flatnonzero(mask)
+
+    def search(self, query, k=10, section=None, category=None, latest_only=True, exclude_url=None):
+        """
+        The k stored embeddings most similar (cosine) to `query`.
+
+        Args:
+            query: Embedding, or a row number of this index
+            k: Results to return
+            section / category: Only search embeddings with this metadata
+            latest_only: Only the newest embedding of each (url, section)
+            exclude_url: Leave out this site (e.g. the query's own)
+
+        Returns:
+            List of metadata dicts with "row" and "similarity", most similar first
+        """
+        with self.lock:
+            self._refresh()
+            if self.matrix is None:
+                return []
+            if isinstance(query, (int, np.integer)):
+                query = self.matrix[query]
+            query = np.asarray(query, dtype=np.float32).reshape(-1)
+            query = query / (np.linalg.norm(query) or 1.0)
+            rows = self._candidates(section, category, latest_only, exclude_url)
+            if not len(rows):
+                return []
+            similarities = self.matrix[rows] @ query
+            k = min(k, len(rows))
+            top = np.argpartition(-similarities, k - 1)[:k]
+            top = top[np.argsort(-similarities[top])]
+            return [{**self.meta[rows[i]], "row": int(rows[i]), "similarity": float(similarities[i])} for i in top]
+
+    def rank_against_best(self, query, section, category, best=5, exclude_url=None):
+        """
+        Compare an embedding with the `best` highest-scored stored embeddings of a section and category.
+
+        Returns:
+            Dict with the mean "similarity" to them and the "references" (metadata with similarity)
+        """
+        with self.lock:
+            self._refresh()
+            if self.matrix is None:
+                return {"similarity": None, "references": []}
+            rows = self._candidates(section, category, True, exclude_url)
+            scored = [row for row in rows if self.meta[row].get("score") is not None]
+            scored.sort(key=lambda row: self.meta[row]["score"], reverse=True)
+            rows = np.array(scored[:best], dtype=np.int64)
+            if not len(rows):
+                return {"similarity": None, "references": []}
+            if isinstance(query, (int, np.integer)):
+                query = self.matrix[query]
+            query = np.asarray(query, dtype=np.float32).reshape(-1)
+            similarities = self.matrix[rows] @ (query / (np.linalg.norm(query) or 1.0))
+            references = [
+                {**self.meta[row], "row": int(row), "similarity": float(similarity)}
+                for row, similarity in zip(rows, similarities)
+            ]
+            return {"similarity": float(similarities.mean()), "references": references}
+
+    def stats(self):
+        with self.lock:
+            self._refresh()
+            sections = {}
+            for row in self.latest.values():
+                section = self.meta[row].get("section")
+                sections[section] = sections.get(section, 0) + 1
+            return {"name": self.name, "dim": self.dim, "embeddings": len(self.meta), "latest_by_section": sections}
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_embedding_index(name):
+    """Return the process-wide index for one embedding model, opening it on first use."""
+    with _indexes_lock:
+        if name not in _indexes:
+            _indexes[name] = EmbeddingIndex(name)
+        return _indexes[name]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect and search a visual-embedding index.")
+    parser.add_argument("--index", required=True, help="Index name (one per embedding model)")
+    parser.add_argument("--stats", action="store_true", help="Print the index size per section")
+    parser.add_argument("--like", help="Image path of an indexed screenshot to search with")
+    parser.add_argument("-k", type=int, default=5, help="Results to show")
+    parser.add_argument("--category", help="Only compare with sites of this category")
+    parser.add_argument("--best", type=int, help="Rank against the N best-scored sites of the section instead")
+    args = parser.parse_args()
+
+    index = get_embedding_index(args.index)
+    if args.stats or not args.like:
+        print(json.dumps(index.stats(), indent=2))
+        return
+
+    row = index.row_for_path(args.like)
+    if row is None:
+        print(f"❌ {args.like} isn't in index {args.index}")
+        return
+    entry = index.meta[row]
+    section, url = entry.get("section"), entry.get("url")
+    category = args.category or entry.get("category")
+    if args.best:
+        ranked = index.rank_against_best(row, section, category, args.best, exclude_url=url)
+        if ranked["similarity"] is None:
+            print(f"No scored {section} embeddings for {category}")
+            return
+        print(f"Mean similarity to the {len(ranked['references'])} best {category} {section}s: {ranked['similarity']:.3f}")
+        matches = ranked["references"]
+    else:
+        matches = index.search(row, args.k, section=section, category=args.category, exclude_url=url)
+    for match in matches:
+        score = f"  score {match['score']:.3f}" if match.get("score") is not None else ""
+        print(f"{match['similarity']:.3f}  {match.get('site', ''):<20} {match.get('path', '')}{score}")
+
+
+if __name__ == "__main__":
+    main()
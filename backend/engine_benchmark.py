@@ -0,0 +1,181 @@
+# Browser engine benchmark: load time, full-page screenshot time and peak browser memory per
+# engine over a set of fixture pages.
+#
+#     python engine_benchmark.py --engines firefox chromium webkit --runs 3
+#     python engine_benchmark.py --pages fixtures.txt --output engines.json
+#
+# Chromium runs twice: with CDP screenshots (the capture fast path) and with Playwright's.
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import threading
+from pathlib import Path
+
+import psutil
+from playwright.sync_api import sync_playwright
+
+sys.path.append(str(Path(__file__).parent))
+import browser_engine
+from browser_engine import launch_browser, screenshot, ENGINES
+
+# Same viewport as the capture browser context
+VIEWPORT = {"width": 1280, "height": 3000}
+# Sites the comparison tool is most often pointed at; override with --pages
+FIXTURE_PAGES = [
+    ("Amazon", "https://www.amazon.com"),
+    ("Flipkart", "https://www.flipkart.com"),
+    ("Blinkit", "https://blinkit.com"),
+    ("Wikipedia", "https://en.wikipedia.org/wiki/Kolkata"),
+]
+
+
+def load_pages(path):
+    """Fixture pages from a file with one "url" or "name,url" per line."""
+    pages = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            name, _, url = line.rpartition(",")
+            pages.append((name.strip() or url, url.strip()))
+    return pages
+
+
+class MemorySampler:
+    """Peak resident memory of this process's child processes (Playwright driver and browsers) above a baseline."""
+
+    def __init__(self, interval=0.1):
+        self.interval = interval
+        self.baseline = self.current()
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    @staticmethod
+    def current():
+        total = 0
+        for child in psutil.Process().children(recursive=True):
+            try:
+                total += child.memory_info().rss
+            except psutil.Error:
+                continue  # Exited between listing and reading
+        return total
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, self.current() - self.baseline)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def bench_page(context, url, timeout):
+    """Load one page and take a full-page screenshot. Returns a dict of timings."""
+    page = context.new_page()
+    try:
+        start_time = time.perf_counter()
+        page.goto(url, wait_until="load", timeout=timeout * 1000)
+        load_seconds = time.perf_counter() - start_time
+        page.wait_for_timeout(1000)  # Same settle time for every engine, not counted
+
+        start_time = time.perf_counter()
+        image = screenshot(page, full_page=True)
+        screenshot_seconds = time.perf_counter() - start_time
+        return {"load_seconds": load_seconds, "screenshot_seconds": screenshot_seconds, "bytes": len(image)}
+    finally:
+        page.close()
+
+
+def bench_engine(playwright, engine, pages, runs, timeout, cdp=True):
+    """
+    Run every fixture page `runs` times on a fresh browser of one engine.
+
+    Returns:
+        Dict with per-page results, medians and peak memory
+    """
+    browser_engine.CDP_SCREENSHOTS = cdp
+    label = f"{engine}{'' if cdp or engine != 'chromium' else ' (no CDP)'}"
+    results = []
+    with MemorySampler() as memory:
+        start_time = time.perf_counter()
+        browser = launch_browser(playwright, engine)
+        launch_seconds = time.perf_counter() - start_time
+        context = browser.new_context(viewport=VIEWPORT)
+        for _ in range(runs):
+            for name, url in pages:
+                try:
+                    results.append({"page": name, **bench_page(context, url, timeout)})
+                    print(f"  {label:<18} {name:<15} load {results[-1]['load_seconds']:.2f}s  "
+                          f"screenshot {results[-1]['screenshot_seconds']:.2f}s")
+                except Exception as e:
+                    results.append({"page": name, "error": str(e)})
+                    print(f"  {label:<18} {name:<15} failed: {e}")
+        browser.close()
+
+    ok = [r for r in results if "error" not in r]
+
+    def median(key):
+        return statistics.median(r[key] for r in ok) if ok else None
+
+    return {
+        "engine": label,
+        "launch_seconds": launch_seconds,
+        "load_seconds": median("load_seconds"),
+        "screenshot_seconds": median("screenshot_seconds"),
+        "screenshot_bytes": median("bytes"),
+        "peak_memory_mb": memory.peak / 2**20,
+        "failures": len(results) - len(ok),
+        "results": results
+    }
+
+
+def print_summary(summaries):
+    def fmt(value, unit="s"):
+        return f"{value:.2f}{unit}" if value is not None else "-"
+
+    print(f"\n{'Engine':<18} {'Launch':>8} {'Load p50':>10} {'Shot p50':>10} {'Shot size':>10} {'Peak mem':>10} {'Failed':>7}")
+    print("-" * 79)
+    for s in summaries:
+        size = f"{s['screenshot_bytes'] / 1024:.0f}KB" if s["screenshot_bytes"] is not None else "-"
+        print(f"{s['engine']:<18} {fmt(s['launch_seconds']):>8} {fmt(s['load_seconds']):>10} "
+              f"{fmt(s['screenshot_seconds']):>10} {size:>10} {s['peak_memory_mb']:>8.0f}MB {s['failures']:>7}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare browser engines for page capture.")
+    parser.add_argument("--engines", nargs="+", default=list(ENGINES), choices=ENGINES)
+    parser.add_argument("--pages", help='File with one "url" or "name,url" per line (default: built-in fixtures)')
+    parser.add_argument("--runs", type=int, default=3, help="Times each page is loaded per engine")
+    parser.add_argument("--timeout", type=float, default=60, help="Page load timeout in seconds")
+    parser.add_argument("--no-baseline", action="store_true", help="Skip the Chromium run without CDP screenshots")
+    parser.add_argument("--output", help="Write the full results as JSON")
+    args = parser.parse_args()
+
+    pages = load_pages(args.pages) if args.pages else FIXTURE_PAGES
+    print(f"Benchmarking {', '.join(args.engines)} on {len(pages)} pages x {args.runs} runs")
+
+    summaries = []
+    with sync_playwright() as p:
+        for engine in args.engines:
+            summaries.append(bench_engine(p, engine, pages, args.runs, args.timeout))
+            if engine == "chromium" and not args.no_baseline:
+                summaries.append(bench_engine(p, engine, pages, args.runs, args.timeout, cdp=False))
+
+    print_summary(summaries)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(summaries, f, indent=2)
+        print(f"Results written to {os.path.abspath(args.output)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,90 +1,157 @@
-from google import genai
 from google.genai import types
 import json
 import os
 import time
 import re
+import cv2
+import numpy as np
 
-# Initialize the Gemini API client
-client = genai.Client(api_key="")  ##Your API key here.
+from gemini_client import get_gemini_client, CircuitOpenError
+from image_archive import read_screenshot, screenshot_exists
+from image_budget import select_regions, IMAGE_TOKEN_BUDGET, VIEWPORT_TOKEN_BUDGET
+from result_model import GEMINI_SECTION_KEYS
 
-def analyze_websites_with_gemini(websites, category="e-commerce"):
+# Shared, rate-limited Gemini API client
+client = get_gemini_client()
+
+# Share of the full page treated as header / footer by the local scorer
+LOCAL_HEADER_FRACTION = 0.08
+LOCAL_FOOTER_FRACTION = 0.10
+
+
+def _local_region_score(gray):
+    """Heuristic 1-10 design score for a grayscale region: contrast, edge density and whitespace balance."""
+    if gray is None or gray.size == 0:
+        return 5.0
+    contrast = min(1.0, float(gray.std()) / 64.0)
+    edges = cv2.Canny(gray, 100, 200)
+    edge_density = float(np.count_nonzero(edges)) / edges.size
+    # Busy pages sit around 10-15% edge pixels; penalise both clutter and emptiness
+    clutter_balance = 1.0 - min(1.0, abs(edge_density - 0.08) / 0.08)
+    whitespace = float(np.count_nonzero(gray > 235)) / gray.size
+    whitespace_balance = 1.0 - min(1.0, abs(whitespace - 0.45) / 0.45)
+    score = 1 + 9 * (0.4 * contrast + 0.3 * clutter_balance + 0.3 * whitespace_balance)
+    return round(score, 1)
+
+
+def local_score_websites(websites, category="e-commerce", reason=""):
     """
-    Analyze and compare websites using Google's Gemini API.
-    Takes full page screenshots and analyzes different sections in a single API call.
-    
+    Score websites locally from their full-page screenshots when Gemini is unavailable.
+    Produces the same JSON shape as the Gemini analysis so callers don't need a separate path.
+
     Args:
         websites: List of dictionaries containing website names and their full screenshot paths
-        category: Website category (default: "e-commerce")
-        
+        category: Website category
+        reason: Why the local scorer was used (surfaced in the result)
+
     Returns:
-        Dict containing scores and analysis for each website and their sections
+        Dict shaped like the Gemini response, flagged with "fallback": True
     """
-    results = {}
-    
-    print("Starting website analysis...")
-    
-    # Collect full screenshots for all websites
-    uploaded_files = []
-    website_names = []
-    website_urls = []
-    
+    print(f"Using local scorer for {len(websites)} websites ({reason or 'Gemini unavailable'})")
+    note = "Scored locally because the Gemini API is degraded; no qualitative analysis available."
+    results = []
+
     for website in websites:
         name = website["name"]
-        full_image_path = website["full_path"]
-        url = website.get("url", f"https://{name.lower()}.com")
-        
-        print(f"Processing {name}...")
-        
-        # Check if file exists
-        if not os.path.exists(full_image_path):
-            print(f"Warning: Image file {full_image_path} not found for {name}")
+        full_path = website.get("full_path")
+        data = read_screenshot(full_path)
+        image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_GRAYSCALE) if data is not None else None
+        if image is None:
+            print(f"Warning: Image file {full_path} not found for {name}")
             continue
-            
-        # Upload the full screenshot
-        print(f"Uploading {name} screenshot...")
-        uploaded_file = client.files.upload(file=full_image_path)
-        uploaded_files.append(uploaded_file)
-        website_names.append(name)
-        website_urls.append(url)
-        print(f"Successfully uploaded {name} screenshot")
-    
-    # Check if any website images were found
-    if not website_names:
+
+        height = image.shape[0]
+        header_end = max(1, int(height * LOCAL_HEADER_FRACTION))
+        footer_start = min(height - 1, int(height * (1 - LOCAL_FOOTER_FRACTION)))
+        regions = {
+            "header": image[:header_end],
+            "main_content": image[header_end:footer_start],
+            "footer": image[footer_start:],
+        }
+
+        sections = {}
+        for section, region in regions.items():
+            sections[section] = {
+                "score": _local_region_score(region),
+                "strengths": [],
+                "weaknesses": [],
+                "recommendations": [note],
+            }
+
+        results.append({
+            "name": name,
+            "url": website.get("url", f"https://{name.lower()}.com"),
+            "overall_score": _local_region_score(image),
+            "sections": sections,
+            "vision_improvements": {},
+            "screenshot": full_path,
+        })
+
+    if not results:
         return {"error": "No valid website images found. Please check the paths."}
-    
-    print(f"Successfully uploaded {len(website_names)} website screenshots: {', '.join(website_names)}")
-    
-    # Create prompt for comparing websites with section-by-section analysis
-    section_types = ["header", "main content", "footer"]
-    
-    # Create website template for the JSON format
-    website_templates = []
-    for i, name in enumerate(website_names):
-        website_templates.append(f"""
-            {{
-                "name": "{name}",
-                "url": "{website_urls[i]}",
-                "overall_score": <score from 1-10>,
-                "sections": {{
-                    "header": {{
-                        "score": <score from 1-10>,
-                        "strengths": ["<strength1>", "<strength2>", ...],
-                        "weaknesses": ["<weakness1>", "<weakness2>", ...],
-                        "recommendations": ["<recommendation1>", "<recommendation2>", ...]
-                    }},
-                    "main_content": {{
-                        "score": <score from 1-10>,
-                        "strengths": ["<strength1>", "<strength2>", ...],
-                        "weaknesses": ["<weakness1>", "<weakness2>", ...],
-                        "recommendations": ["<recommendation1>", "<recommendation2>", ...]
-                    }},
-                    "footer": {{
+
+    return {
+        "websites": results,
+        "comparison": build_comparison(results, f"Local heuristic comparison of {len(results)} {category} websites. {note}"),
+        "fallback": True,
+        "fallback_reason": reason,
+    }
+
+
+def build_comparison(websites, summary):
+    """Pick the best website overall and per section from already scored website records."""
+    def best(score_of):
+        scored = [w for w in websites if score_of(w) is not None]
+        return max(scored, key=score_of)["name"] if scored else None
+
+    def section_score(section):
+        return lambda w: w.get("sections", {}).get(section, {}).get("score")
+
+    return {
+        "best_overall": best(lambda w: w.get("overall_score")),
+        "best_header": best(section_score("header")),
+        "best_main_content": best(section_score("main_content")),
+        "best_footer": best(section_score("footer")),
+        "summary": summary,
+    }
+
+
+SECTION_TEMPLATE = """{
                         "score": <score from 1-10>,
                         "strengths": ["<strength1>", "<strength2>", ...],
                         "weaknesses": ["<weakness1>", "<weakness2>", ...],
                         "recommendations": ["<recommendation1>", "<recommendation2>", ...]
-                    }}
+                    }"""
+
+
+def website_template(name, url, section_keys=None):
+    """
+    JSON template for one website in the prompt.
+
+    Args:
+        name: Website name
+        url: Website URL
+        section_keys: Response section keys to evaluate; None means a full analysis
+            (all sections, overall score and vision improvements)
+    """
+    keys = section_keys or list(GEMINI_SECTION_KEYS.values())
+    sections = ",\n                    ".join(f'"{key}": {SECTION_TEMPLATE}' for key in keys)
+    if section_keys:
+        return f"""
+            {{
+                "name": "{name}",
+                "url": "{url}",
+                "sections": {{
+                    {sections}
+                }}
+            }}"""
+    return f"""
+            {{
+                "name": "{name}",
+                "url": "{url}",
+                "overall_score": <score from 1-10>,
+                "sections": {{
+                    {sections}
                 }},
                 "vision_improvements": {{
                     "color_scheme": {{
@@ -116,7 +183,116 @@ def analyze_websites_with_gemini(websites, category="e-commerce"):
                         "recommendations": ["<specific accessibility improvement1>", "<specific accessibility improvement2>", ...]
                     }}
                 }}
-            }}""")
+            }}"""
+
+def prepare_website_images(website):
+    """
+    Select the budgeted regions of one website's screenshots as inline image parts.
+    The regions are small JPEGs, so they travel inside the one generate_content request
+    instead of costing a Files API upload (and a request of quota) each.
+    
+    Args:
+        website: Website dictionary as described in analyze_websites_with_gemini
+        
+    Returns:
+        Dict with the "website", its "labels", image "parts" and "section_keys",
+        or None if its screenshots are missing
+    """
+    name = website["name"]
+    full_image_path = website["full_path"]
+    partial = website.get("reanalyze_sections")
+    
+    print(f"Processing {name}...")
+    
+    # Check if files exist
+    viewport_paths = sorted(website.get("viewport_paths", {}).items(), key=lambda item: int(item[0]))
+    missing = [path for path in [full_image_path] + [path for _, path in viewport_paths] if not screenshot_exists(path)]
+    if missing:
+        print(f"Warning: Image file {missing[0]} not found for {name}")
+        return None
+    
+    # The budgeted regions of each screenshot: above the fold, sampled main content
+    # and footer, or only the sections marked for partial re-analysis
+    regions = select_regions(full_image_path, website.get("layout"), IMAGE_TOKEN_BUDGET, partial)
+    images = [(f"{name} - {region['label']}", region) for region in regions or []]
+    if not partial:
+        # Extra viewport captures of the same page for judging responsive design
+        for width, path in viewport_paths:
+            layout = website.get("viewport_layouts", {}).get(width)
+            for region in select_regions(path, layout, VIEWPORT_TOKEN_BUDGET) or []:
+                images.append((f"{name} - {width}px viewport width, {region['label']}", region))
+    if not images:
+        print(f"Warning: Couldn't read screenshots for {name}")
+        return None
+    print(f"{name}: {len(images)} regions, ~{sum(region['tokens'] for _, region in images)} image tokens")
+    
+    return {
+        "website": website,
+        "labels": [label for label, _ in images],
+        "parts": [types.Part.from_bytes(data=region["data"], mime_type="image/jpeg") for _, region in images],
+        "section_keys": [GEMINI_SECTION_KEYS[section] for section in partial] if partial else None
+    }
+
+def analyze_websites_with_gemini(websites, category="e-commerce"):
+    """
+    Analyze and compare websites using Google's Gemini API.
+    Takes full page screenshots and analyzes different sections in a single API call.
+    
+    Args:
+        websites: List of dictionaries containing website names and their full screenshot paths,
+            with the capture "layout" (page rows of each section). A website may carry
+            "reanalyze_sections" (e.g. ["header"]) to have only those sections analyzed, and
+            "viewport_paths" (width → path) / "viewport_layouts" with extra full-page captures
+            at other viewport widths. Each screenshot is reduced to the regions that fit the
+            image token budget (see image_budget.py).
+        category: Website category (default: "e-commerce")
+        
+    Returns:
+        Dict containing scores and analysis for each website and their sections
+    """
+    print("Starting website analysis...")
+    
+    prepared = []
+    for website in websites:
+        try:
+            images = prepare_website_images(website)
+        except Exception as e:
+            print(f"Error reading {website['name']} screenshot: {str(e)}")
+            return local_score_websites(websites, category, reason=f"screenshot read failed: {e}")
+        if images:
+            prepared.append(images)
+    
+    return analyze_prepared_websites(prepared, category)
+
+def analyze_prepared_websites(prepared, category="e-commerce"):
+    """
+    Run the comparison prompt over websites whose image regions are already prepared.
+    
+    Args:
+        prepared: Results of prepare_website_images
+        category: Website category
+        
+    Returns:
+        Dict containing scores and analysis for each website and their sections
+    """
+    results = {}
+    websites = [images["website"] for images in prepared]
+    website_names = [website["name"] for website in websites]
+    
+    # Check if any website images were found
+    if not website_names:
+        return {"error": "No valid website images found. Please check the paths."}
+    
+    print(f"Prepared screenshots of {len(website_names)} websites: {', '.join(website_names)}")
+    
+    # Create website template for the JSON format
+    website_templates = [
+        website_template(website["name"], website.get("url", f"https://{website['name'].lower()}.com"), images["section_keys"])
+        for website, images in zip(websites, prepared)
+    ]
+    image_labels = [label for images in prepared for label in images["labels"]]
+    image_parts = [part for images in prepared for part in images["parts"]]
+    image_order = "\n    ".join(f"{i + 1}. {label}" for i, label in enumerate(image_labels))
     
     prompt = f"""
     Compare the following {len(website_names)} {category} websites: {', '.join(website_names)}.
@@ -138,11 +314,21 @@ def analyze_websites_with_gemini(websites, category="e-commerce"):
     - Layout: Analyze spacing, alignment and suggest layout improvements
     - Visual Hierarchy: Evaluate importance signaling and suggest visual hierarchy improvements
     - Whitespace: Analyze use of whitespace and suggest improvements
-    - Responsive Design: Assess adaptability to different screen sizes
+    - Responsive Design: Assess adaptability to different screen sizes (using the narrower viewport screenshots when attached)
     - Accessibility: Evaluate color contrast, text size, and suggest accessibility improvements
     
     Also provide an overall score from 1-10 for each website.
     
+    The attached images are, in order:
+    {image_order}
+    
+    Long pages are represented by regions rather than the whole page: the part above the fold, samples of
+    the main content (repeated blocks such as product grids are sampled once) and the footer.
+    
+    Some websites only have individual section images attached because the rest of the page is unchanged
+    since the last analysis. For those, evaluate only the sections present in their JSON template and
+    leave out the overall score and visual design recommendations.
+    
     Return your response in the following JSON format:
     {{
         "websites": [
@@ -162,15 +348,14 @@ def analyze_websites_with_gemini(websites, category="e-commerce"):
     
     # Prepare contents for API call
     contents = [prompt]
-    for file in uploaded_files:
-        contents.append(file)
+    contents.extend(image_parts)
     
     # Call Gemini API
     print("Calling Gemini API to analyze websites (this may take a while)...")
     start_time = time.time()
     
     try:
-        response = client.models.generate_content(
+        response = client.generate_content(
             model="gemini-2.0-flash",
             contents=contents
         )
@@ -199,7 +384,7 @@ def analyze_websites_with_gemini(websites, category="e-commerce"):
             if "websites" in results:
                 for i, website in enumerate(results["websites"]):
                     # Add screenshot path if not present
-                    if "screenshot" not in website:
+                    if "screenshot" not in website and i < len(websites):
                         website["screenshot"] = websites[i]["full_path"]
             
         except json.JSONDecodeError as e:
@@ -226,11 +411,12 @@ def analyze_websites_with_gemini(websites, category="e-commerce"):
                     "error": "Failed to parse JSON response",
                     "raw_response": response_text[:1000] + "..." if len(response_text) > 1000 else response_text
                 }
+    except CircuitOpenError as e:
+        print(f"Gemini API degraded: {str(e)}")
+        results = local_score_websites(websites, category, reason=str(e))
     except Exception as e:
         print(f"Error in Gemini API call: {str(e)}")
-        results = {
-            "error": f"API call failed: {str(e)}"
-        }
+        results = local_score_websites(websites, category, reason=f"API call failed: {str(e)}")
     
     return results
 
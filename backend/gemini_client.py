@@ -0,0 +1,365 @@
+import os
+import io
+import random
+import threading
+import time
+
+from google import genai
+
+from deadline import remaining_seconds, deadline_passed, DeadlineExceeded
+
+# Default quota for gemini-2.0-flash; override with environment variables
+DEFAULT_REQUESTS_PER_MINUTE = int(os.environ.get("GEMINI_RPM", "15"))
+DEFAULT_TOKENS_PER_MINUTE = int(os.environ.get("GEMINI_TPM", "1000000"))
+
+# Rough token cost of one image part and of one character of prompt text
+IMAGE_TOKEN_ESTIMATE = 258
+CHARS_PER_TOKEN = 4
+
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+RETRYABLE_MARKERS = ("RESOURCE_EXHAUSTED", "UNAVAILABLE", "DEADLINE_EXCEEDED", "INTERNAL", "rate limit", "quota")
+
+
+class CircuitOpenError(Exception):
+    """Raised when the circuit breaker is open and calls fail fast."""
+
+
+class RateLimitTimeout(Exception):
+    """Raised when the limiter could not grant capacity within the allowed wait."""
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled continuously at `per_minute` units per minute.
+    Tracks how many callers are waiting and how long they waited.
+    """
+
+    def __init__(self, per_minute, name="bucket"):
+        self.name = name
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = float(per_minute)
+        self.updated = time.monotonic()
+        self.cond = threading.Condition()
+        self.waiting = 0
+        self.max_waiting = 0
+        self.total_waits = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, amount=1, timeout=None):
+        """
+        Block until `amount` units are available, then consume them.
+
+        Args:
+            amount: Units to consume (clamped to the bucket capacity)
+            timeout: Maximum seconds to wait, or None to wait indefinitely
+
+        Returns:
+            Seconds spent waiting
+        """
+        amount = min(float(amount), self.capacity)
+        start = time.monotonic()
+        deadline = None if timeout is None else start + timeout
+
+        with self.cond:
+            self._refill()
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return 0.0
+
+            self.waiting += 1
+            self.max_waiting = max(self.max_waiting, self.waiting)
+            try:
+                while True:
+                    self._refill()
+                    if self.tokens >= amount:
+                        self.tokens -= amount
+                        break
+                    needed = (amount - self.tokens) / self.rate
+                    if deadline is not None:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            raise RateLimitTimeout(f"{self.name} limiter wait exceeded {timeout:.1f}s")
+                        needed = min(needed, remaining)
+                    self.cond.wait(needed)
+            finally:
+                self.waiting -= 1
+
+            waited = time.monotonic() - start
+            self.total_waits += 1
+            self.total_wait_seconds += waited
+            self.max_wait_seconds = max(self.max_wait_seconds, waited)
+            return waited
+
+    def metrics(self):
+        with self.cond:
+            self._refill()
+            return {
+                "available": round(self.tokens, 2),
+                "capacity": self.capacity,
+                "queue_depth": self.waiting,
+                "max_queue_depth": self.max_waiting,
+                "total_waits": self.total_waits,
+                "total_wait_seconds": round(self.total_wait_seconds, 3),
+                "avg_wait_seconds": round(self.total_wait_seconds / self.total_waits, 3) if self.total_waits else 0.0,
+                "max_wait_seconds": round(self.max_wait_seconds, 3),
+            }
+
+
+class CircuitBreaker:
+    """
+    Classic closed / open / half-open breaker. After `failure_threshold` consecutive
+    failures the circuit opens for `reset_timeout` seconds, then lets one trial call through.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=60.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self.times_opened = 0
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                self.trial_in_flight = False
+            if self.state == "half_open" and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.state = "closed"
+            self.failures = 0
+            self.trial_in_flight = False
+
+    def release(self):
+        """Give back a half-open trial that ended without reaching the API (no success or failure to record)."""
+        with self.lock:
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial_in_flight = False
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    self.times_opened += 1
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+    def metrics(self):
+        with self.lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.failures,
+                "times_opened": self.times_opened,
+            }
+
+
+def is_retryable(error):
+    """Decide whether an API error is worth retrying (quota, overload, transient network)."""
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    code = getattr(error, "code", None) or getattr(error, "status_code", None)
+    if isinstance(code, int) and code in RETRYABLE_STATUS_CODES:
+        return True
+    message = str(error)
+    return any(marker.lower() in message.lower() for marker in RETRYABLE_MARKERS)
+
+
+def estimate_tokens(contents):
+    """Cheap input-token estimate for a list of prompt strings and uploaded files."""
+    total = 0
+    for part in contents if isinstance(contents, (list, tuple)) else [contents]:
+        if isinstance(part, str):
+            total += len(part) // CHARS_PER_TOKEN + 1
+        else:
+            total += IMAGE_TOKEN_ESTIMATE
+    return total
+
+
+class GeminiClient:
+    """
+    Wrapper around `genai.Client` shared by every module that talks to Gemini.
+    Every call goes through the request and token limiters, is retried with jittered
+    exponential backoff on retryable errors, and is short-circuited while the breaker is open.
+    """
+
+    def __init__(self, client, requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE,
+                 tokens_per_minute=DEFAULT_TOKENS_PER_MINUTE, max_retries=4,
+                 base_delay=1.0, max_delay=30.0, max_wait=120.0, breaker=None):
+        self.client = client
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.quota_share = 1
+        self.request_bucket = TokenBucket(requests_per_minute, name="requests")
+        self.token_bucket = TokenBucket(tokens_per_minute, name="tokens")
+        self.breaker = breaker or CircuitBreaker()
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_wait = max_wait
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0
+        self.rejected = 0
+
+    def share_quota(self, processes):
+        """
+        Limit this process to 1/`processes` of the configured quota, for when several
+        processes (e.g. prefork workers) call Gemini with the same API key.
+        """
+        self.quota_share = max(1, processes)
+        self.request_bucket = TokenBucket(self.requests_per_minute / self.quota_share, name="requests")
+        self.token_bucket = TokenBucket(self.tokens_per_minute / self.quota_share, name="tokens")
+
+    def _backoff(self, attempt):
+        # Full jitter: uniform in [0, min(max_delay, base * 2^attempt)]
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def _count(self, field):
+        with self.lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def call(self, fn, tokens=0):
+        """
+        Run `fn()` under rate limiting, retries and the circuit breaker.
+
+        Args:
+            fn: Zero-argument callable performing the actual API request
+            tokens: Estimated tokens the request consumes
+
+        Returns:
+            Whatever `fn` returns
+        """
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                self._count("rejected")
+                raise CircuitOpenError("Gemini circuit is open; failing fast")
+
+            try:
+                # Limiter waits and retries never run past the request deadline, if one is set
+                if deadline_passed():
+                    raise DeadlineExceeded("No time left before the request deadline for a Gemini call")
+                self.request_bucket.acquire(1, timeout=remaining_seconds(self.max_wait))
+                if tokens:
+                    self.token_bucket.acquire(tokens, timeout=remaining_seconds(self.max_wait))
+            except BaseException:
+                # The API was never called: a half-open trial taken above must not stay claimed
+                self.breaker.release()
+                raise
+
+            self._count("calls")
+            try:
+                result = fn()
+            except Exception as e:
+                if not is_retryable(e):
+                    # The API answered, the request itself was bad: not a sign of degradation
+                    self.breaker.record_success()
+                    self._count("failures")
+                    raise
+                self.breaker.record_failure()
+                if attempt >= self.max_retries:
+                    self._count("failures")
+                    raise
+                delay = self._backoff(attempt)
+                left = remaining_seconds()
+                if left is not None and delay >= left:
+                    self._count("failures")
+                    raise
+                attempt += 1
+                self._count("retries")
+                print(f"⚠️ Gemini call failed ({e}); retry {attempt}/{self.max_retries} in {delay:.2f}s")
+                time.sleep(delay)
+                continue
+
+            self.breaker.record_success()
+            return result
+
+    def generate_content(self, model, contents):
+        return self.call(
+            lambda: self.client.models.generate_content(
+                model=model, contents=contents, config=self._http_timeout_config()
+            ),
+            tokens=estimate_tokens(contents),
+        )
+
+    def upload_file(self, file, mime_type=None):
+        """
+        Upload a file to the Gemini Files API.
+
+        Args:
+            file: Path, image bytes or a seekable file object
+            mime_type: Required for bytes and file objects (e.g. images read from the screenshot archive)
+        """
+        def upload():
+            # Every attempt uploads from the start: a failed one may have consumed the stream
+            if isinstance(file, (bytes, bytearray)):
+                stream = io.BytesIO(file)
+            else:
+                stream = file
+                if hasattr(stream, "seek"):
+                    stream.seek(0)
+            # Timeout from the deadline as it stands at this attempt, not at the first one
+            config = {"mime_type": mime_type} if mime_type else {}
+            config.update(self._http_timeout_config() or {})
+            return self.client.files.upload(file=stream, config=config or None)
+
+        return self.call(upload)
+
+    @staticmethod
+    def _http_timeout_config():
+        """HTTP timeout (ms) that ends the request at the deadline, or None without a deadline."""
+        remaining = remaining_seconds()
+        if remaining is None:
+            return None
+        return {"http_options": {"timeout": max(1, int(remaining * 1000))}}
+
+    def is_degraded(self):
+        return self.breaker.metrics()["state"] != "closed"
+
+    def metrics(self):
+        with self.lock:
+            counters = {
+                "calls": self.calls,
+                "retries": self.retries,
+                "failures": self.failures,
+                "rejected_fast": self.rejected,
+                "quota_share": self.quota_share,
+            }
+        return {
+            **counters,
+            "requests_limiter": self.request_bucket.metrics(),
+            "tokens_limiter": self.token_bucket.metrics(),
+            "circuit_breaker": self.breaker.metrics(),
+        }
+
+
+_shared_client = None
+_shared_lock = threading.Lock()
+
+
+def get_gemini_client():
+    """Return the process-wide GeminiClient, creating it on first use."""
+    global _shared_client
+    with _shared_lock:
+        if _shared_client is None:
+            api_key = os.environ.get("GEMINI_API_KEY", "")  ##Your API key here.
+            _shared_client = GeminiClient(genai.Client(api_key=api_key))
+        return _shared_client
@@ -0,0 +1,374 @@
+import os
+import io
+import mmap
+import time
+import uuid
+import hashlib
+import sqlite3
+import argparse
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows: appends are only serialized within one process
+    fcntl = None
+
+# "archive" packs screenshots into segment files; "files" writes loose PNGs as before
+SCREENSHOT_STORAGE = os.environ.get("SCREENSHOT_STORAGE", "archive")
+SCREENSHOTS_ROOT = os.environ.get("SCREENSHOTS_ROOT", "screenshots")
+ARCHIVE_DIR = os.environ.get("ARCHIVE_DIR", os.path.join(SCREENSHOTS_ROOT, ".archive"))
+
+# A new segment file is started once the active one reaches this size
+SEGMENT_MAX_BYTES = int(os.environ.get("ARCHIVE_SEGMENT_MB", "256")) * 1024 * 1024
+# Retention: runs kept per site, and the age after which any run is dropped
+ARCHIVE_KEEP_RUNS = int(os.environ.get("ARCHIVE_KEEP_RUNS", "5"))
+ARCHIVE_MAX_AGE_DAYS = float(os.environ.get("ARCHIVE_MAX_AGE_DAYS", "30"))
+# Sealed segments with at least this share of dead bytes are rewritten by compaction
+COMPACT_MIN_DEAD_FRACTION = 0.5
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    path TEXT PRIMARY KEY,
+    site TEXT,
+    run_id TEXT,
+    segment INTEGER NOT NULL,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    etag TEXT NOT NULL,
+    source TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_images_run ON images (site, run_id);
+CREATE INDEX IF NOT EXISTS idx_images_extent ON images (segment, offset);
+CREATE INDEX IF NOT EXISTS idx_images_etag ON images (etag);
+"""
+
+
+def write_atomic(path, data):
+    """Write bytes to a temporary file and rename it into place so readers never see partial files."""
+    tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def archive_key(path):
+    """
+    Index key of a screenshot: its path relative to the screenshots root, with forward
+    slashes. Paths that are already relative to the root are used as they are.
+    """
+    if os.path.isabs(path):
+        relative = os.path.relpath(path, os.path.abspath(SCREENSHOTS_ROOT))
+        if not relative.startswith(".."):
+            path = relative
+    path = path.replace(os.sep, "/")
+    prefix = SCREENSHOTS_ROOT.replace(os.sep, "/").rstrip("/") + "/"
+    return path[len(prefix):] if path.startswith(prefix) else path
+
+
+class ImageArchive:
+    """
+    Append-only packed image store. Image bytes are appended to segment files and an
+    SQLite index maps each path to (segment, offset, length); reads are zero-copy
+    memoryviews over read-only mmaps of the segments. Identical images are stored once
+    and several paths may point at the same bytes (e.g. a run's capture and the
+    published latest copy). Retention drops old runs from the index; compaction
+    rewrites mostly-dead segments and deletes them.
+    """
+
+    def __init__(self, directory=ARCHIVE_DIR, segment_max_bytes=SEGMENT_MAX_BYTES):
+        self.directory = directory
+        self.segment_max_bytes = segment_max_bytes
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.maps = {}
+        self.maps_lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        with self.connection() as db:
+            db.executescript(SCHEMA)
+
+    def connection(self):
+        db = getattr(self.local, "db", None)
+        if db is None:
+            db = sqlite3.connect(os.path.join(self.directory, "index.db"), timeout=30)
+            db.row_factory = sqlite3.Row
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self.local.db = db
+        return db
+
+    def _segment_path(self, segment):
+        return os.path.join(self.directory, f"segment-{segment:06d}.pack")
+
+    def _segments(self):
+        return sorted(
+            int(name[8:14]) for name in os.listdir(self.directory)
+            if name.startswith("segment-") and name.endswith(".pack")
+        )
+
+    class _AppendLock:
+        """Serializes appends across threads, and across processes where flock is available."""
+
+        def __init__(self, archive):
+            self.archive = archive
+
+        def __enter__(self):
+            self.archive.lock.acquire()
+            self.file = open(os.path.join(self.archive.directory, "append.lock"), "a")
+            if fcntl:
+                fcntl.flock(self.file, fcntl.LOCK_EX)
+            return self
+
+        def __exit__(self, *exc):
+            if fcntl:
+                fcntl.flock(self.file, fcntl.LOCK_UN)
+            self.file.close()
+            self.archive.lock.release()
+
+    def _append(self, data):
+        """Append bytes to the active segment (caller holds the append lock). Returns (segment, offset)."""
+        segments = self._segments()
+        segment = segments[-1] if segments else 1
+        if segments and os.path.getsize(self._segment_path(segment)) >= self.segment_max_bytes:
+            segment += 1
+        with open(self._segment_path(segment), "ab") as f:
+            offset = f.tell()
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        return segment, offset
+
+    def put(self, path, data, site=None, run_id=None, source=None, aliases=()):
+        """
+        Store an image under a path (replacing any earlier image at that path).
+
+        Args:
+            path: Screenshot path or archive key
+            data: Image bytes
+            site: Website name, for retention
+            run_id: Capture run id, for retention (None for paths kept until replaced)
+            source: ETag of the image this one was derived from (thumbnails)
+            aliases: Further paths that should point at the same bytes, kept until replaced
+
+        Returns:
+            ETag of the image
+        """
+        etag = hashlib.sha1(data).hexdigest()
+        now = time.time()
+        with self._AppendLock(self):
+            db = self.connection()
+            existing = db.execute(
+                "SELECT segment, offset, length FROM images WHERE etag = ? LIMIT 1", (etag,)
+            ).fetchone()
+            if existing:
+                segment, offset = existing["segment"], existing["offset"]
+            else:
+                segment, offset = self._append(data)
+            with db:
+                db.executemany(
+                    """INSERT OR REPLACE INTO images (path, site, run_id, segment, offset, length, etag, source, created_at)
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                    [(archive_key(path), site, run_id, segment, offset, len(data), etag, source, now)] +
+                    [(archive_key(alias), site, None, segment, offset, len(data), etag, source, now) for alias in aliases]
+                )
+        return etag
+
+    def info(self, path):
+        """Index entry of a path (etag, length, created_at, ...), or None."""
+        row = self.connection().execute("SELECT * FROM images WHERE path = ?", (archive_key(path),)).fetchone()
+        return dict(row) if row else None
+
+    def _view(self, segment, offset, length):
+        with self.maps_lock:
+            mapped = self.maps.get(segment)
+            if mapped is None or len(mapped) < offset + length:
+                # Segments only grow; map again to see the new tail. Old maps stay valid for
+                # readers still holding views and are released once those are gone.
+                with open(self._segment_path(segment), "rb") as f:
+                    mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self.maps[segment] = mapped
+        return memoryview(mapped)[offset:offset + length]
+
+    def get(self, path):
+        """
+        Image bytes stored under a path.
+
+        Returns:
+            Read-only memoryview over the mapped segment, or None if the path isn't stored
+        """
+        for _ in range(2):
+            entry = self.info(path)
+            if entry is None:
+                return None
+            try:
+                return self._view(entry["segment"], entry["offset"], entry["length"])
+            except FileNotFoundError:
+                continue  # Compaction moved the image between the lookup and the read
+        return None
+
+    def apply_retention(self, keep_runs=ARCHIVE_KEEP_RUNS, max_age_days=ARCHIVE_MAX_AGE_DAYS):
+        """
+        Drop runs beyond the newest `keep_runs` per site and runs older than `max_age_days`,
+        plus thumbnails of images no longer stored. The bytes are reclaimed by compact().
+
+        Returns:
+            Number of index entries removed
+        """
+        cutoff = time.time() - max_age_days * 86400
+        db = self.connection()
+        runs = db.execute(
+            """SELECT site, run_id, MAX(created_at) AS created_at FROM images
+               WHERE run_id IS NOT NULL GROUP BY site, run_id ORDER BY site, created_at DESC"""
+        ).fetchall()
+        expired = []
+        kept = {}
+        for run in runs:
+            kept[run["site"]] = kept.get(run["site"], 0) + 1
+            if kept[run["site"]] > keep_runs or run["created_at"] < cutoff:
+                expired.append((run["site"], run["run_id"]))
+        with db:
+            removed = db.executemany("DELETE FROM images WHERE site = ? AND run_id = ?", expired).rowcount
+            removed += db.execute(
+                """DELETE FROM images WHERE source IS NOT NULL
+                   AND source NOT IN (SELECT etag FROM images WHERE source IS NULL)"""
+            ).rowcount
+        return removed
+
+    def compact(self, min_dead_fraction=COMPACT_MIN_DEAD_FRACTION):
+        """
+        Rewrite sealed segments whose dead share is at least `min_dead_fraction` into the
+        active segment and delete them.
+
+        Returns:
+            Dict with the segments removed and the bytes reclaimed
+        """
+        removed, reclaimed = [], 0
+        with self._AppendLock(self):
+            db = self.connection()
+            segments = self._segments()
+            for segment in segments[:-1]:
+                extents = db.execute(
+                    "SELECT DISTINCT offset, length FROM images WHERE segment = ? ORDER BY offset", (segment,)
+                ).fetchall()
+                size = os.path.getsize(self._segment_path(segment))
+                live = sum(extent["length"] for extent in extents)
+                if size == 0 or (size - live) / size < min_dead_fraction:
+                    continue
+
+                with open(self._segment_path(segment), "rb") as source, db:
+                    for extent in extents:
+                        source.seek(extent["offset"])
+                        new_segment, new_offset = self._append(source.read(extent["length"]))
+                        db.execute(
+                            "UPDATE images SET segment = ?, offset = ? WHERE segment = ? AND offset = ?",
+                            (new_segment, new_offset, segment, extent["offset"])
+                        )
+                with self.maps_lock:
+                    self.maps.pop(segment, None)
+                try:
+                    os.remove(self._segment_path(segment))
+                except OSError as e:
+                    print(f"⚠️ Couldn't remove compacted segment {segment}: {e}")
+                    continue
+                removed.append(segment)
+                reclaimed += size - live
+        return {"segments_removed": removed, "bytes_reclaimed": reclaimed}
+
+    def stats(self):
+        db = self.connection()
+        row = db.execute("SELECT COUNT(*) AS paths, COUNT(DISTINCT etag) AS images FROM images").fetchone()
+        live = db.execute(
+            "SELECT COALESCE(SUM(length), 0) FROM (SELECT DISTINCT segment, offset, length FROM images)"
+        ).fetchone()[0]
+        size = sum(os.path.getsize(self._segment_path(segment)) for segment in self._segments())
+        return {
+            "paths": row["paths"],
+            "images": row["images"],
+            "segments": len(self._segments()),
+            "bytes": size,
+            "live_bytes": live
+        }
+
+
+_archive = None
+_archive_lock = threading.Lock()
+
+
+def get_image_archive():
+    """Return the process-wide image archive, creating it on first use."""
+    global _archive
+    with _archive_lock:
+        if _archive is None:
+            _archive = ImageArchive()
+        return _archive
+
+
+def save_screenshot(path, data, site=None, run_id=None, aliases=()):
+    """
+    Store a capture in the configured storage: the packed archive, or a loose file.
+
+    Args:
+        path: Screenshot path (e.g. screenshots/{name}/runs/{run_id}/{name}_full.png)
+        data: Image bytes
+        site: Website name
+        run_id: Capture run id
+        aliases: Further paths that should serve the same image (the published latest copy)
+    """
+    if SCREENSHOT_STORAGE == "archive":
+        get_image_archive().put(path, data, site=site, run_id=run_id, aliases=aliases)
+        return
+    for target in (path, *aliases):
+        os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+        write_atomic(target, data)
+
+
+def read_screenshot(path):
+    """
+    Bytes of a screenshot from a loose file or the archive.
+
+    Returns:
+        bytes / memoryview, or None if it isn't stored anywhere
+    """
+    if not path:
+        return None
+    if os.path.isfile(path):
+        with open(path, "rb") as f:
+            return f.read()
+    return get_image_archive().get(path) if SCREENSHOT_STORAGE == "archive" else None
+
+
+def screenshot_exists(path):
+    if not path:
+        return False
+    if os.path.isfile(path):
+        return True
+    return SCREENSHOT_STORAGE == "archive" and get_image_archive().info(path) is not None
+
+
+def screenshot_file(path):
+    """A file path or file object for libraries that open images themselves (PIL, uploads)."""
+    if os.path.isfile(path):
+        return path
+    data = read_screenshot(path)
+    if data is None:
+        raise FileNotFoundError(path)
+    return io.BytesIO(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the packed screenshot archive.")
+    parser.add_argument("--keep-runs", type=int, default=ARCHIVE_KEEP_RUNS, help="Runs kept per site")
+    parser.add_argument("--max-age-days", type=float, default=ARCHIVE_MAX_AGE_DAYS, help="Drop runs older than this")
+    parser.add_argument("--min-dead", type=float, default=COMPACT_MIN_DEAD_FRACTION,
+                        help="Compact segments with at least this share of dead bytes")
+    args = parser.parse_args()
+
+    archive = get_image_archive()
+    print(f"Removed {archive.apply_retention(args.keep_runs, args.max_age_days)} expired entries")
+    result = archive.compact(args.min_dead)
+    print(f"Compacted {len(result['segments_removed'])} segments, reclaimed {result['bytes_reclaimed']} bytes")
+    print(archive.stats())
+
+
+if __name__ == "__main__":
+    main()
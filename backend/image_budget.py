@@ -0,0 +1,151 @@
+import os
+import math
+import cv2
+import numpy as np
+
+from image_archive import read_screenshot
+from image_segmentation import segment_screenshot
+
+# Gemini bills an image as 258 tokens per 768x768 tile (one tile when both sides are <= 384px)
+TILE_TOKENS = 258
+TILE_SIZE = 768
+SMALL_IMAGE_SIZE = 384
+
+# Image tokens spent per site on the page, and on each extra viewport capture
+IMAGE_TOKEN_BUDGET = int(os.environ.get("GEMINI_IMAGE_TOKEN_BUDGET", str(6 * TILE_TOKENS)))
+VIEWPORT_TOKEN_BUDGET = int(os.environ.get("GEMINI_VIEWPORT_TOKEN_BUDGET", str(2 * TILE_TOKENS)))
+# Height of the first screen of the page, in page pixels
+FOLD_HEIGHT = int(os.environ.get("BUDGET_FOLD_HEIGHT", "900"))
+# Sampled main-content windows closer than this many dHash bits count as repeats (e.g. product grids)
+REPEAT_HASH_DISTANCE = 10
+REGION_JPEG_QUALITY = 85
+
+
+def image_tokens(width, height):
+    """Input tokens Gemini charges for an image of this size."""
+    if width <= SMALL_IMAGE_SIZE and height <= SMALL_IMAGE_SIZE:
+        return TILE_TOKENS
+    return TILE_TOKENS * math.ceil(width / TILE_SIZE) * math.ceil(height / TILE_SIZE)
+
+
+def _encode_region(image, top, bottom, tiles=1):
+    """Crop rows [top, bottom) and downsample them to fit `tiles` tiles stacked vertically, as JPEG."""
+    region = image[top:bottom]
+    height, width = region.shape[:2]
+    scale = min(1.0, TILE_SIZE / width, tiles * TILE_SIZE / height)
+    if scale < 1.0:
+        size = (max(1, int(width * scale)), max(1, int(height * scale)))
+        region = cv2.resize(region, size, interpolation=cv2.INTER_AREA)
+    ok, encoded = cv2.imencode(".jpg", region, [cv2.IMWRITE_JPEG_QUALITY, REGION_JPEG_QUALITY])
+    return encoded.tobytes(), image_tokens(region.shape[1], region.shape[0])
+
+
+def _window_signature(window):
+    """Informativeness score (contrast plus edge density) and 64-bit dHash of a window."""
+    gray = cv2.cvtColor(cv2.resize(window, (160, max(1, round(window.shape[0] * 160 / window.shape[1]))),
+                                   interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+    edges = (np.abs(np.diff(gray.astype(np.int16), axis=1)) > 24).mean()
+    score = gray.std() / 128.0 + edges
+    hash_pixels = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA).astype(np.int16)
+    dhash = int("".join("1" if bit else "0" for bit in (hash_pixels[:, 1:] > hash_pixels[:, :-1]).flatten()), 2)
+    return score, dhash
+
+
+def _sample_windows(image, top, bottom, count, window_height):
+    """
+    Pick up to `count` non-overlapping windows of the main content: the most informative
+    ones first, skipping windows that look like repeats of one already picked.
+    """
+    if count <= 0 or bottom - top <= 0:
+        return []
+    if bottom - top <= count * window_height:
+        return [(start, min(start + window_height, bottom)) for start in range(top, bottom, window_height)]
+
+    candidates = []
+    for start in range(top, bottom - window_height // 2, window_height):
+        end = min(start + window_height, bottom)
+        score, dhash = _window_signature(image[start:end])
+        candidates.append((score, start, end, dhash))
+
+    picked = []
+    for score, start, end, dhash in sorted(candidates, reverse=True):
+        if any(bin(dhash ^ other).count("1") <= REPEAT_HASH_DISTANCE for *_, other in picked):
+            continue
+        picked.append((score, start, end, dhash))
+        if len(picked) == count:
+            break
+    # Near-repeats fill any remaining slots rather than wasting the budget
+    for candidate in sorted(candidates, reverse=True):
+        if len(picked) == count:
+            break
+        if candidate not in picked:
+            picked.append(candidate)
+    return sorted((start, end) for _, start, end, _ in picked)
+
+
+def select_regions(full_path, layout=None, budget=IMAGE_TOKEN_BUDGET, sections=None):
+    """
+    Choose the regions of a full-page screenshot to send for analysis within a token budget:
+    above-the-fold (including the header), the most informative distinct windows of the
+    main content and the footer, each downsampled to whole tiles. Short pages are sent whole.
+
+    Args:
+        full_path: Full-page screenshot path
+        layout: Dict of section → [top, bottom] page rows from capture (segmented if missing)
+        budget: Image tokens allowed for this screenshot
+        sections: Only these sections (e.g. ["main"]) instead of the whole page
+
+    Returns:
+        List of dicts with "label", "data" (JPEG bytes) and "tokens", top to bottom, or None
+    """
+    data = read_screenshot(full_path)
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR) if data is not None else None
+    if image is None:
+        return None
+    height, width = image.shape[:2]
+    layout = layout or segment_screenshot(image) or {
+        "header": [0, 0], "main": [0, height], "footer": [height, height]
+    }
+    tiles = max(1, budget // TILE_TOKENS)
+    # Page rows covered by one tile once the page is scaled to the tile width
+    window_height = max(TILE_SIZE, width)
+
+    def region(label, top, bottom, region_tiles=1):
+        top, bottom = max(0, int(top)), min(height, int(bottom))
+        if bottom <= top:
+            return None
+        encoded, tokens = _encode_region(image, top, bottom, region_tiles)
+        return {"label": label, "data": encoded, "tokens": tokens}
+
+    header_top, header_bottom = layout["header"]
+    main_top, main_bottom = layout["main"]
+    footer_top, footer_bottom = layout["footer"]
+
+    if sections is None:
+        if height <= tiles * window_height:
+            return [region("full page", 0, height, tiles)]
+        fold_bottom = min(height, max(FOLD_HEIGHT, header_bottom))
+        regions = [region("above the fold (with header)", 0, fold_bottom)]
+        has_footer = footer_bottom - footer_top > 0 and tiles > 1
+        main_windows = _sample_windows(
+            image, max(fold_bottom, main_top), main_bottom, tiles - 1 - has_footer, window_height
+        )
+        regions += [
+            region(f"main content sample, rows {start}-{end} of {height}", start, end) for start, end in main_windows
+        ]
+        if has_footer:
+            regions.append(region("footer", footer_top, footer_bottom))
+        return [r for r in regions if r]
+
+    regions = []
+    if "header" in sections:
+        regions.append(region("header section", header_top, header_bottom))
+    if "main" in sections:
+        count = tiles - ("header" in sections) - ("footer" in sections)
+        regions += [
+            region(f"main content section, rows {start}-{end} of {height}", start, end)
+            for start, end in _sample_windows(image, main_top, main_bottom, max(1, count), window_height)
+        ]
+    if "footer" in sections:
+        regions.append(region("footer section", footer_top, footer_bottom))
+    return [r for r in regions if r]
@@ -0,0 +1,127 @@
+import cv2
+import numpy as np
+
+# Screenshots are analysed at this width; boundaries are scaled back afterwards
+ANALYSIS_WIDTH = 320
+# Rows averaged on each side of a candidate boundary when measuring colour jumps
+WINDOW_ROWS = 6
+# Where header / footer boundaries may lie, as fractions of the page height
+MIN_HEADER_FRACTION, MAX_HEADER_FRACTION = 0.01, 0.25
+MIN_FOOTER_FRACTION, MAX_FOOTER_FRACTION = 0.03, 0.35
+# Horizontal gradient (0-255) that counts as an edge pixel
+EDGE_THRESHOLD = 24
+# A row with fewer edge pixels than this is treated as a whitespace gap
+GAP_EDGE_DENSITY = 0.01
+# Boundaries weaker than this fall back to fixed proportions
+MIN_BOUNDARY_SCORE = 0.08
+DEFAULT_HEADER_FRACTION, DEFAULT_FOOTER_FRACTION = 0.06, 0.10
+
+
+def decode_screenshot(image):
+    """Decode PNG bytes (or pass through a BGR array) for segmentation."""
+    if isinstance(image, np.ndarray):
+        return image
+    return cv2.imdecode(np.frombuffer(image, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+
+def _row_profiles(image):
+    """Per-row mean colour and edge density of a downscaled copy of the page."""
+    height, width = image.shape[:2]
+    small_height = max(1, round(height * ANALYSIS_WIDTH / width))
+    small = cv2.resize(image, (ANALYSIS_WIDTH, small_height), interpolation=cv2.INTER_AREA)
+
+    colors = small.reshape(small_height, -1, 3).mean(axis=1)
+    gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY).astype(np.int16)
+    edge_density = (np.abs(np.diff(gray, axis=1)) > EDGE_THRESHOLD).mean(axis=1)
+    return colors, edge_density
+
+
+def _window_means(values, window):
+    """Mean of the `window` rows above and below every row boundary (vectorized with prefix sums)."""
+    count = len(values)
+    prefix = np.vstack([np.zeros((1,) + values.shape[1:]), np.cumsum(values, axis=0)])
+    rows = np.arange(count)
+    start = np.maximum(rows - window, 0)
+    end = np.minimum(rows + window, count)
+    above = (prefix[rows] - prefix[start]) / np.maximum(rows - start, 1)[:, None]
+    below = (prefix[end] - prefix[rows]) / np.maximum(end - rows, 1)[:, None]
+    return above, below, prefix
+
+
+def _boundary_scores(colors, edge_density):
+    """
+    Score every row as a section boundary: background-colour band changes across
+    the row, plus a bonus when it sits at the edge of a whitespace gap.
+    """
+    above, below, prefix = _window_means(colors, WINDOW_ROWS)
+    colour_jump = np.linalg.norm(below - above, axis=1) / 255.0
+
+    gap = edge_density < GAP_EDGE_DENSITY
+    gap_edge = np.zeros_like(colour_jump)
+    gap_edge[1:] = (gap[1:] != gap[:-1]).astype(float)
+
+    edge_above, edge_below, _ = _window_means(edge_density[:, None], WINDOW_ROWS)
+    density_change = np.abs(edge_below - edge_above)[:, 0]
+
+    return colour_jump + 0.15 * gap_edge + 0.5 * density_change, prefix
+
+
+def segment_screenshot(image):
+    """
+    Find header / main / footer boundaries directly from a full-page screenshot using
+    row-projection profiles, background-colour band detection and edge density.
+
+    Args:
+        image: PNG bytes or BGR array of the full page
+
+    Returns:
+        Dict mapping "header", "main" and "footer" to (top, bottom) pixel ranges, or None
+    """
+    image = decode_screenshot(image)
+    if image is None or image.shape[0] < 10:
+        return None
+
+    height = image.shape[0]
+    colors, edge_density = _row_profiles(image)
+    rows = len(colors)
+    scores, prefix = _boundary_scores(colors, edge_density)
+
+    # Header: strongest boundary near the top
+    lo, hi = max(1, int(rows * MIN_HEADER_FRACTION)), max(2, int(rows * MAX_HEADER_FRACTION))
+    header_row = lo + int(np.argmax(scores[lo:hi]))
+    if scores[header_row] < MIN_BOUNDARY_SCORE:
+        header_row = max(1, round(rows * DEFAULT_HEADER_FRACTION))
+
+    # Footer: strongest boundary near the bottom whose band below is uniform and
+    # differs from the page background (footers are usually a distinct colour band)
+    lo = max(header_row + 1, rows - int(rows * MAX_FOOTER_FRACTION))
+    hi = max(lo + 1, rows - int(rows * MIN_FOOTER_FRACTION))
+    candidates = np.arange(lo, min(hi, rows))
+    footer_row = rows - max(1, round(rows * DEFAULT_FOOTER_FRACTION))
+    if len(candidates):
+        background = np.median(colors[header_row:lo], axis=0) if lo > header_row else colors.mean(axis=0)
+        prefix_sq = np.vstack([np.zeros((1, 3)), np.cumsum(colors ** 2, axis=0)])
+        band_rows = (rows - candidates)[:, None]
+        band_mean = (prefix[rows] - prefix[candidates]) / band_rows
+        band_var = (prefix_sq[rows] - prefix_sq[candidates]) / band_rows - band_mean ** 2
+        band_std = np.sqrt(np.maximum(band_var, 0).sum(axis=1)) / 255.0
+        band_contrast = np.linalg.norm(band_mean - background, axis=1) / 255.0
+        footer_scores = scores[candidates] + band_contrast - band_std
+        best = int(np.argmax(footer_scores))
+        if footer_scores[best] >= MIN_BOUNDARY_SCORE:
+            footer_row = int(candidates[best])
+
+    scale = height / rows
+    header_bottom = int(round(header_row * scale))
+    footer_top = max(header_bottom, int(round(footer_row * scale)))
+    return {
+        "header": (0, header_bottom),
+        "main": (header_bottom, footer_top),
+        "footer": (footer_top, height),
+    }
+
+
+def crop_rows(image, top, bottom):
+    """Crop a horizontal band out of a decoded screenshot and encode it as PNG bytes."""
+    ok, encoded = cv2.imencode(".png", image[top:bottom])
+    return encoded.tobytes() if ok else None
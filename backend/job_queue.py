@@ -0,0 +1,236 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+
+# Kept out of the screenshots tree, which /screenshots/<path> serves publicly
+DATA_DIR = os.environ.get("DATA_DIR", "data")
+JOB_QUEUE_PATH = os.environ.get("JOB_QUEUE_PATH", os.path.join(DATA_DIR, "jobs.db"))
+
+# A leased job whose worker stops heartbeating for this long is handed to another worker
+DEFAULT_LEASE_SECONDS = int(os.environ.get("JOB_LEASE_SECONDS", "120"))
+DEFAULT_MAX_ATTEMPTS = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    priority INTEGER NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 3,
+    lease_owner TEXT,
+    lease_expires REAL,
+    parent_id TEXT,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_ready ON jobs (kind, status, priority DESC, created_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_lease ON jobs (status, lease_expires);
+CREATE INDEX IF NOT EXISTS idx_jobs_parent ON jobs (parent_id);
+"""
+
+
+class JobQueue:
+    """
+    Durable job queue on a local SQLite file. Workers lease jobs, keep the lease alive
+    with heartbeats and complete or fail them; jobs whose lease expired (the worker
+    crashed) are re-delivered until max_attempts is reached.
+    Several processes, or hosts sharing the file over a filesystem with working locks,
+    can use the same queue.
+    """
+
+    def __init__(self, path=JOB_QUEUE_PATH):
+        self.path = path
+        self.local = threading.local()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self.connection() as db:
+            db.executescript(SCHEMA)
+
+    def connection(self):
+        db = getattr(self.local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.row_factory = sqlite3.Row
+            db.execute("PRAGMA journal_mode=WAL")
+            self.local.db = db
+        return db
+
+    @staticmethod
+    def new_job(kind, payload, priority=0, max_attempts=DEFAULT_MAX_ATTEMPTS, parent_id=None):
+        """A job not yet in the queue (for enqueueing with complete), with its id assigned."""
+        return {
+            "id": uuid.uuid4().hex,
+            "kind": kind,
+            "payload": payload,
+            "priority": priority,
+            "max_attempts": max_attempts,
+            "parent_id": parent_id
+        }
+
+    @staticmethod
+    def _insert(db, job):
+        now = time.time()
+        db.execute(
+            """INSERT INTO jobs (id, kind, payload, priority, max_attempts, parent_id, created_at, updated_at)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+            (job["id"], job["kind"], json.dumps(job["payload"]), job["priority"], job["max_attempts"],
+             job["parent_id"], now, now)
+        )
+
+    def enqueue(self, kind, payload, priority=0, max_attempts=DEFAULT_MAX_ATTEMPTS, parent_id=None):
+        """
+        Add a job to the queue.
+
+        Returns:
+            The new job id
+        """
+        job = self.new_job(kind, payload, priority, max_attempts, parent_id)
+        self._insert(self.connection(), job)
+        return job["id"]
+
+    def lease(self, kinds, worker_id, lease_seconds=DEFAULT_LEASE_SECONDS):
+        """
+        Atomically claim the highest-priority ready job of the given kinds.
+        Jobs whose previous lease expired are eligible again.
+
+        Returns:
+            Dict with "id", "kind", "payload" and "attempts", or None if nothing is ready
+        """
+        now = time.time()
+        db = self.connection()
+        placeholders = ", ".join("?" for _ in kinds)
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            # Expired leases that used up their attempts are failed rather than re-delivered
+            db.execute(
+                """UPDATE jobs SET status = 'failed', error = 'lease expired too many times', updated_at = ?
+                   WHERE status = 'leased' AND lease_expires < ? AND attempts >= max_attempts""",
+                (now, now)
+            )
+            row = db.execute(
+                f"""SELECT id, kind, payload, attempts FROM jobs
+                    WHERE kind IN ({placeholders})
+                      AND (status = 'queued' OR (status = 'leased' AND lease_expires < ?))
+                    ORDER BY priority DESC, created_at
+                    LIMIT 1""",
+                (*kinds, now)
+            ).fetchone()
+            if row is None:
+                db.execute("COMMIT")
+                return None
+            db.execute(
+                """UPDATE jobs SET status = 'leased', lease_owner = ?, lease_expires = ?,
+                   attempts = attempts + 1, updated_at = ? WHERE id = ?""",
+                (worker_id, now + lease_seconds, now, row["id"])
+            )
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+        return {
+            "id": row["id"],
+            "kind": row["kind"],
+            "payload": json.loads(row["payload"]),
+            "attempts": row["attempts"] + 1
+        }
+
+    def heartbeat(self, job_id, worker_id, lease_seconds=DEFAULT_LEASE_SECONDS):
+        """
+        Extend a lease. Returns False if the worker no longer owns the job
+        (its lease expired and the job was handed to someone else).
+        """
+        now = time.time()
+        cursor = self.connection().execute(
+            """UPDATE jobs SET lease_expires = ?, updated_at = ?
+               WHERE id = ? AND lease_owner = ? AND status = 'leased'""",
+            (now + lease_seconds, now, job_id, worker_id)
+        )
+        return cursor.rowcount == 1
+
+    def complete(self, job_id, worker_id, result=None, follow_ups=()):
+        """
+        Mark a leased job done and enqueue the jobs it hands off to (from new_job) in the same
+        transaction, so a handoff is neither lost nor enqueued twice if the worker dies or
+        its lease was lost.
+
+        Returns:
+            False if the worker no longer owns the job; nothing is enqueued then
+        """
+        db = self.connection()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            cursor = db.execute(
+                """UPDATE jobs SET status = 'done', result = ?, lease_expires = NULL, updated_at = ?
+                   WHERE id = ? AND lease_owner = ? AND status = 'leased'""",
+                (json.dumps(result), time.time(), job_id, worker_id)
+            )
+            if cursor.rowcount != 1:
+                db.execute("ROLLBACK")
+                return False
+            for job in follow_ups:
+                self._insert(db, job)
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+        return True
+
+    def fail(self, job_id, worker_id, error):
+        """Record a failure: the job is re-queued until it runs out of attempts."""
+        cursor = self.connection().execute(
+            """UPDATE jobs SET status = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'queued' END,
+               error = ?, lease_owner = NULL, lease_expires = NULL, updated_at = ?
+               WHERE id = ? AND lease_owner = ? AND status = 'leased'""",
+            (str(error), time.time(), job_id, worker_id)
+        )
+        return cursor.rowcount == 1
+
+    def get(self, job_id):
+        row = self.connection().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        return {
+            "id": row["id"],
+            "kind": row["kind"],
+            "status": row["status"],
+            "attempts": row["attempts"],
+            "parent_id": row["parent_id"],
+            "result": json.loads(row["result"]) if row["result"] else None,
+            "error": row["error"],
+            "created_at": row["created_at"],
+            "updated_at": row["updated_at"]
+        }
+
+    def children(self, job_id):
+        rows = self.connection().execute(
+            "SELECT id FROM jobs WHERE parent_id = ? ORDER BY created_at", (job_id,)
+        ).fetchall()
+        return [self.get(row["id"]) for row in rows]
+
+    def stats(self):
+        rows = self.connection().execute(
+            "SELECT kind, status, COUNT(*) AS count FROM jobs GROUP BY kind, status"
+        ).fetchall()
+        stats = {}
+        for row in rows:
+            stats.setdefault(row["kind"], {})[row["status"]] = row["count"]
+        return stats
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_job_queue():
+    """Return the process-wide job queue, creating it on first use."""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = JobQueue()
+        return _queue
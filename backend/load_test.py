@@ -0,0 +1,197 @@
+# Load test for the comparison API: drive /compare_websites with N concurrent clients and report
+# latency percentiles and the rejection rate.
+#
+#     python load_test.py --requests 200 --concurrency 16 --bulk-fraction 0.25
+#     python load_test.py --url http://localhost:5000 --requests 50 --concurrency 8
+#
+# Without --url, the app is served in-process with capture and Gemini analysis replaced by
+# timed sleeps, so admission control can be tuned without browsers or API quota.
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import tempfile
+import threading
+import urllib.request
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent))
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers (None when empty)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered) + 0.5)) - 1))]
+
+
+def busy_work(seconds):
+    """Pure-Python work that holds the GIL, standing in for decoding, preprocessing and assembly."""
+    give_up_at = time.process_time() + seconds
+    while time.process_time() < give_up_at:
+        sum(i * i for i in range(1000))
+
+
+def stub_comparison(capture_seconds, analysis_seconds, jitter, cpu_seconds=0.0):
+    """
+    Stand-in for website_comparison.run_comparison: each site "captures" and is "analysed"
+    by sleeping (plus `cpu_seconds` of GIL-bound work), honouring the request deadline
+    like the real pipeline.
+    """
+    from deadline import deadline_passed
+
+    def vary(seconds):
+        return max(0.0, seconds * random.uniform(1 - jitter, 1 + jitter))
+
+    def run_comparison(websites, category, viewports=None):
+        full = []
+        missing = []
+        for site in websites:
+            if deadline_passed():
+                missing.append(site["name"])
+                continue
+            time.sleep(vary(capture_seconds) + vary(analysis_seconds))
+            busy_work(vary(cpu_seconds))
+            full.append({"name": site["name"], "url": site["url"], "score": round(random.uniform(5, 9), 1)})
+        scores = {"header": [], "main": [], "footer": [], "full": full}
+        if missing:
+            scores["partial"] = True
+            scores["missing_sites"] = missing
+        return scores
+
+    return run_comparison
+
+
+def start_stub_server(args):
+    """
+    Serve the app on a free local port with stubbed backends, in this process or, with
+    --workers, in pre-forked worker processes (see serve.py). Returns (base URL, stop function).
+    """
+    workdir = tempfile.mkdtemp(prefix="load_test_")
+    os.environ.setdefault("RESULTS_DB_PATH", os.path.join(workdir, "results.db"))
+    os.environ.setdefault("JOB_QUEUE_PATH", os.path.join(workdir, "jobs.db"))
+    # Admission settings are read at import, so they're applied before the app is loaded
+    if args.slots:
+        os.environ["MAX_ACTIVE_COMPARISONS"] = str(args.slots)
+    if args.queue_size is not None:
+        os.environ["ADMISSION_QUEUE_SIZE"] = str(args.queue_size)
+        os.environ["ADMISSION_BULK_QUEUE_SIZE"] = str(args.queue_size)
+
+    from werkzeug.serving import make_server
+    import website_comparison
+    from app import app
+
+    website_comparison.run_comparison = stub_comparison(
+        args.capture_ms / 1000, args.analysis_ms / 1000, args.jitter, args.cpu_ms / 1000
+    )
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)  # One access log line per request drowns the report
+
+    if args.workers:
+        import serve
+        sock = serve.bind_socket("127.0.0.1", 0)
+        pids = serve.start_workers(app, sock, args.workers)
+        time.sleep(1)  # Let the workers start accepting
+        return f"http://127.0.0.1:{sock.getsockname()[1]}", lambda: serve.stop_workers(pids)
+
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}", server.shutdown
+
+
+def send_request(base_url, number, args):
+    """POST one comparison; returns (lane, status, seconds, retry_after)."""
+    lane = "bulk" if random.random() < args.bulk_fraction else "interactive"
+    # Distinct sites per request so requests aren't coalesced or served from the results store
+    websites = [{"name": f"site{number}-{i}", "url": f"https://site{number}-{i}.example"} for i in range(args.sites)]
+    body = {"websites": websites, "category": args.category, "max_age": 0}
+    if args.deadline:
+        body["deadline"] = args.deadline
+    req = urllib.request.Request(
+        f"{base_url}/compare_websites",
+        data=json.dumps(body).encode(),
+        headers={"Content-Type": "application/json", "X-Priority": lane},
+        method="POST"
+    )
+    start_time = time.time()
+    retry_after = None
+    try:
+        with urllib.request.urlopen(req, timeout=args.timeout) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+        retry_after = e.headers.get("Retry-After")
+    except Exception:
+        status = "error"
+    return lane, status, time.time() - start_time, retry_after
+
+
+def summarize(label, results, wall):
+    ok = [seconds for _, status, seconds, _ in results if status == 200]
+    rejected = [r for r in results if r[1] == 429]
+    errors = len(results) - len(ok) - len(rejected)
+
+    def ms(value):
+        return f"{value * 1000:.0f}ms" if value is not None else "-"
+
+    retry_afters = [int(r[3]) for r in rejected if r[3]]
+    print(
+        f"{label:<12} {len(results):>5} sent | {len(ok):>5} ok | {len(rejected):>5} rejected "
+        f"({len(rejected) / len(results) * 100 if results else 0:.1f}%) | {errors} errors | "
+        f"p50 {ms(percentile(ok, 50))} p95 {ms(percentile(ok, 95))} p99 {ms(percentile(ok, 99))}"
+        + (f" | Retry-After avg {sum(retry_afters) / len(retry_afters):.1f}s" if retry_afters else "")
+    )
+    if label == "all":
+        print(f"Throughput: {len(ok) / wall:.2f} ok/s over {wall:.1f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the comparison API.")
+    parser.add_argument("--url", help="Base URL of a running server (default: in-process server with stubbed backends)")
+    parser.add_argument("--requests", type=int, default=100, help="Total requests to send")
+    parser.add_argument("--concurrency", type=int, default=10, help="Concurrent clients")
+    parser.add_argument("--bulk-fraction", type=float, default=0.0, help="Share of requests sent in the bulk lane")
+    parser.add_argument("--sites", type=int, default=2, help="Websites per comparison")
+    parser.add_argument("--category", default="ecommerce")
+    parser.add_argument("--deadline", type=float, default=0, help="Request deadline in seconds (0 = none)")
+    parser.add_argument("--timeout", type=float, default=300, help="Client timeout per request in seconds")
+    parser.add_argument("--capture-ms", type=float, default=400, help="Stub: capture time per site")
+    parser.add_argument("--analysis-ms", type=float, default=300, help="Stub: Gemini analysis time per site")
+    parser.add_argument("--cpu-ms", type=float, default=0, help="Stub: GIL-bound CPU time per site")
+    parser.add_argument("--jitter", type=float, default=0.2, help="Stub: +/- fraction applied to stage times")
+    parser.add_argument("--workers", type=int, default=0, help="Stub: serve from this many forked processes")
+    parser.add_argument("--slots", type=int, help="Stub: MAX_ACTIVE_COMPARISONS for the in-process server")
+    parser.add_argument("--queue-size", type=int, help="Stub: admission queue size per lane")
+    args = parser.parse_args()
+
+    stop = None
+    if args.url:
+        base_url = args.url.rstrip("/")
+    else:
+        base_url, stop = start_stub_server(args)
+        print(f"Serving the app with stubbed capture / Gemini at {base_url}")
+
+    print(f"Sending {args.requests} requests with {args.concurrency} concurrent clients...")
+    start_time = time.time()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        results = list(executor.map(lambda n: send_request(base_url, n, args), range(args.requests)))
+    wall = time.time() - start_time
+
+    summarize("all", results, wall)
+    for lane in ("interactive", "bulk"):
+        lane_results = [r for r in results if r[0] == lane]
+        if lane_results:
+            summarize(lane, lane_results, wall)
+
+    if stop:
+        stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,14 @@
 import os
+import sys
 import torch
 from PIL import Image
 import open_clip
+from pathlib import Path
 from playwright.sync_api import sync_playwright
 
+sys.path.append(str(Path(__file__).parent.parent))
+from embedding_index import get_embedding_index
+
 # Load CLIP model and preprocessing tools
 clip_model, _, clip_preprocess = open_clip.create_model_and_transforms('ViT-B-32', pretrained='laion2b_s34b_b79k')
 clip_tokenizer = open_clip.get_tokenizer('ViT-B-32')
@@ -11,6 +16,9 @@ clip_tokenizer = open_clip.get_tokenizer('ViT-B-32')
 device = "cuda" if torch.cuda.is_available() else "cpu"
 clip_model.to(device)
 
+# Section embeddings are kept for similarity search (see embedding_index.py)
+embedding_index = get_embedding_index("clip-vit-b32-laion2b")
+
 # --- Phase 1: Capture screenshots section-wise ---
 def capture_sections_and_fullpage(page, url, website_name):
     screenshots_folder = f"screenshots/{website_name}"
@@ -75,7 +83,7 @@ def capture_sections_and_fullpage(page, url, website_name):
 
 # --- Phase 2: Score each section using CLIP ---
 @torch.no_grad()
-def score_section(image_path, section_type, category):
+def score_section(image_path, section_type, category, site=None):
     # Generate a general prompt based on the category
     prompt = f"Score on basis of  user-friendly {section_type} for {category} websites, showcasing modern design and clear navigation."
 
@@ -89,6 +97,11 @@ def score_section(image_path, section_type, category):
     image_features /= image_features.norm(dim=-1, keepdim=True)
     text_features /= text_features.norm(dim=-1, keepdim=True)
     clip_score = (image_features @ text_features.T).item()
+    if site:
+        embedding_index.add(image_features[0].cpu().numpy(), {
+            "site": site["name"], "url": site["url"], "category": category,
+            "section": section_type, "path": image_path, "score": clip_score
+        })
 
     clarity_score = min(1.0, clip_score + 0.1)
     modernity_score = min(1.0, clip_score + 0.05)
@@ -132,7 +145,7 @@ def compare_websites(websites, category):
             for section_type in ["header", "main", "footer"]:
                 image_path = sections.get(section_type)
                 if image_path:
-                    result = score_section(image_path, section_type, category)
+                    result = score_section(image_path, section_type, category, site)
                     all_scores[section_type].append({
                         "name": name,
                         "path": image_path,
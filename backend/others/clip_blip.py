@@ -1,17 +1,25 @@
 import os
+import sys
 import torch
 import cv2
 from PIL import Image
 from transformers import CLIPProcessor, CLIPModel
 from torch.nn.functional import cosine_similarity
+from pathlib import Path
 from playwright.sync_api import sync_playwright
 
+sys.path.append(str(Path(__file__).parent.parent))
+from embedding_index import get_embedding_index
+
 # Load CLIP model and processor
 device = "cuda" if torch.cuda.is_available() else "cpu"
 clip_processor = CLIPProcessor.from_pretrained("openai/clip-vit-base-patch32")
 clip_model = CLIPModel.from_pretrained("openai/clip-vit-base-patch32").to(device)
 clip_model.eval()
 
+# Section embeddings are kept for similarity search (see embedding_index.py)
+embedding_index = get_embedding_index("clip-vit-b32-openai")
+
 # --- Section-specific scoring prompts ---
 def get_clip_prompt(section_type, category):
     prompts = {
@@ -104,7 +112,7 @@ def capture_sections_and_fullpage(page, url, website_name):
 
 # --- CLIP-based scoring ---
 @torch.no_grad()
-def score_section(image_path, section_type, category):
+def score_section(image_path, section_type, category, site=None):
     prompt = get_clip_prompt(section_type, category)
     processed_image_path = preprocess_image(image_path)
     
@@ -120,6 +128,11 @@ def score_section(image_path, section_type, category):
 
     similarity = cosine_similarity(image_embed, text_embed).item()
     normalized_similarity = (similarity + 1) / 2  # 0 to 1
+    if site:
+        embedding_index.add(image_embed[0].cpu().numpy(), {
+            "site": site["name"], "url": site["url"], "category": category,
+            "section": section_type, "path": image_path, "score": normalized_similarity
+        })
 
     clarity_score = min(1.0, normalized_similarity + 0.1)
     modernity_score = min(1.0, normalized_similarity + 0.05)
@@ -163,7 +176,7 @@ def compare_websites(websites, category):
             for section_type in ["header", "main", "footer", "full"]:
                 image_path = sections.get(section_type)
                 if image_path:
-                    result = score_section(image_path, section_type, category)
+                    result = score_section(image_path, section_type, category, site)
                     all_scores[section_type].append({
                         "name": name,
                         "path": image_path,
@@ -0,0 +1,260 @@
+import os
+import time
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from playwright.sync_api import sync_playwright
+
+from cloudinary_storage import collect_uploads
+from gemini import prepare_website_images, analyze_prepared_websites, local_score_websites, build_comparison
+from website_comparison import (
+    capture_sections_and_fullpage, plan_site_analysis, merge_site_analysis,
+    assemble_scores, batch_text_relevance, new_run_id
+)
+from deadline import remaining_seconds, deadline_passed
+from browser_engine import launch_browser
+from result_model import site_key
+
+# Concurrency of each stage: browsers loading pages, sites uploading, Gemini calls in flight
+CAPTURE_WORKERS = int(os.environ.get("PIPELINE_CAPTURE_WORKERS", "2"))
+UPLOAD_WORKERS = int(os.environ.get("PIPELINE_UPLOAD_WORKERS", "4"))
+ANALYSIS_WORKERS = int(os.environ.get("PIPELINE_ANALYSIS_WORKERS", "2"))
+# Sites allowed to wait between two stages before the earlier stage blocks (backpressure)
+STAGE_QUEUE_SIZE = int(os.environ.get("PIPELINE_QUEUE_SIZE", "2"))
+
+
+def in_thread(executor, fn, *args):
+    """Run a blocking call on an executor thread, carrying over the caller's context (e.g. its deadline)."""
+    context = contextvars.copy_context()
+    return asyncio.get_running_loop().run_in_executor(executor, context.run, fn, *args)
+
+
+class BrowserWorker:
+    """
+    A browser (BROWSER_ENGINE) owned by a single thread, since the sync Playwright API can only be
+    used from the thread that started it. Captures are awaited from the event loop.
+    """
+
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.playwright = None
+        self.browser = None
+        self.context = None
+
+    def _capture(self, site, run_id, viewports):
+        if self.browser is None:
+            self.playwright = sync_playwright().start()
+            self.browser = launch_browser(self.playwright)
+            self.context = self.browser.new_context(viewport={"width": 1280, "height": 3000})
+
+        page = self.context.new_page()
+        start_time = time.time()
+        try:
+            sections = capture_sections_and_fullpage(page, site["url"], site_key(site), run_id, viewports)
+        finally:
+            page.close()
+        if not sections:
+            return None
+        return {
+            "id": site_key(site),
+            "name": site["name"],
+            "url": site["url"],
+            "sections": sections,
+            "run_id": run_id,
+            "capture_seconds": round(time.time() - start_time, 3)
+        }
+
+    def _close(self):
+        if self.browser is not None:
+            browser, self.browser = self.browser, None
+            browser.close()
+            self.playwright.stop()
+
+    async def capture(self, site, run_id, viewports):
+        return await in_thread(self.executor, self._capture, site, run_id, viewports)
+
+    async def close(self):
+        await in_thread(self.executor, self._close)
+        self.executor.shutdown()
+
+    def close_later(self):
+        """Close the browser once its current capture finishes, without waiting for it."""
+        try:
+            self.executor.submit(self._close)
+        except RuntimeError:  # Already closed
+            return
+        self.executor.shutdown(wait=False)
+
+
+def upload_site(site, category):
+    """
+    Upload stage for one site: wait for its Cloudinary uploads, decide what needs
+    re-analysis and prepare those regions for the Gemini call.
+
+    Returns:
+        Tuple of (plan, upload) where upload is None when nothing needs Gemini, or a
+        local fallback result if the screenshots couldn't be read
+    """
+    sections = site["sections"]
+    sections.update(collect_uploads(sections.pop("pending_uploads", {}), timeout=remaining_seconds(120)))
+    plan, gemini_site = plan_site_analysis(site, category)
+    if gemini_site is None:
+        return plan, None
+    try:
+        return plan, prepare_website_images(gemini_site) or {"missing": True}
+    except Exception as e:
+        print(f"Error reading {site['name']} screenshot: {str(e)}")
+        return plan, {"fallback": local_score_websites([gemini_site], category, reason=f"screenshot read failed: {e}")}
+
+
+def analyze_site(plan, upload, category):
+    """
+    Analysis stage for one site: one Gemini call for its prepared regions, merged with its cached analysis.
+
+    Returns:
+        Tuple of (record, fallback_reason), the reason being None unless the local scorer was used
+    """
+    results = {}
+    if upload and "fallback" in upload:
+        results = upload["fallback"]
+    elif upload and "parts" in upload:
+        results = analyze_prepared_websites([upload], category)
+    update = next(iter(results.get("websites", [])), None) if "error" not in results else None
+    fallback_reason = results.get("fallback_reason", "") if results.get("fallback") else None
+    return merge_site_analysis(plan, update, not results.get("fallback"), category), fallback_reason
+
+
+async def run_stages(websites, category, viewports=None):
+    """
+    Run capture → upload → analysis as concurrent stages joined by bounded queues, so one site
+    is analysed while the next uploads and the one after loads in the browser.
+    When the request deadline passes, the sites analysed so far are returned.
+
+    Returns:
+        Dictionary with scores for each section, as returned by score_websites
+    """
+    start_time = time.time()
+    run_id = new_run_id()
+    busy = {"capture": 0.0, "upload": 0.0, "analysis": 0.0}
+
+    pending = asyncio.Queue()
+    for index, site in enumerate(websites):
+        pending.put_nowait((index, site))
+    to_upload = asyncio.Queue(maxsize=STAGE_QUEUE_SIZE)
+    to_analyze = asyncio.Queue(maxsize=STAGE_QUEUE_SIZE)
+    captured = {}
+    records = {}
+    fallback_reasons = []
+    # Upload / analysis threads; not waited for if the deadline cuts the run short
+    executor = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS + ANALYSIS_WORKERS + 1)
+
+    async def timed(stage, call, *args):
+        stage_start = time.time()
+        try:
+            return await call(*args)
+        finally:
+            busy[stage] += time.time() - stage_start
+
+    async def capture_worker(browser):
+        while True:
+            try:
+                index, site = pending.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            try:
+                data = await timed("capture", browser.capture, site, run_id, viewports)
+            except Exception as e:
+                print(f"❌ Failed to process {site['name']}: {str(e)}")
+                continue
+            if data:
+                captured[index] = data
+                await to_upload.put((index, data))  # Blocks while the upload stage is behind
+
+    async def upload_worker():
+        while (item := await to_upload.get()) is not None:
+            index, data = item
+            if deadline_passed():
+                continue
+            try:
+                plan, upload = await timed("upload", in_thread, executor, upload_site, data, category)
+            except Exception as e:
+                print(f"❌ Failed to prepare {data['name']} for analysis: {str(e)}")
+                continue
+            await to_analyze.put((index, plan, upload))
+
+    async def analysis_worker():
+        while (item := await to_analyze.get()) is not None:
+            index, plan, upload = item
+            try:
+                record, fallback_reason = await timed("analysis", in_thread, executor, analyze_site, plan, upload, category)
+            except Exception as e:
+                print(f"❌ Failed to analyze {plan[0]['name']}: {str(e)}")
+                continue
+            if record:
+                records[index] = record
+            if fallback_reason is not None:
+                fallback_reasons.append(fallback_reason)
+
+    browsers = [BrowserWorker() for _ in range(max(1, min(CAPTURE_WORKERS, len(websites))))]
+    uploaders = [asyncio.create_task(upload_worker()) for _ in range(UPLOAD_WORKERS)]
+    analyzers = [asyncio.create_task(analysis_worker()) for _ in range(ANALYSIS_WORKERS)]
+    relevance = None
+
+    async def run_all():
+        nonlocal relevance
+        await asyncio.gather(*(capture_worker(browser) for browser in browsers))
+        await asyncio.gather(*(browser.close() for browser in browsers), return_exceptions=True)
+
+        # Every page is captured, so the batched text relevance call can overlap the remaining analysis
+        relevance = asyncio.ensure_future(in_thread(
+            executor, batch_text_relevance, [captured[index] for index in sorted(captured)], category
+        ))
+
+        for _ in uploaders:
+            await to_upload.put(None)
+        await asyncio.gather(*uploaders)
+        for _ in analyzers:
+            await to_analyze.put(None)
+        await asyncio.gather(*analyzers)
+        await relevance
+
+    try:
+        await asyncio.wait_for(run_all(), timeout=remaining_seconds())
+        timed_out = False
+    except asyncio.TimeoutError:
+        print("⏱️ Request deadline reached. Returning the sites analyzed so far.")
+        timed_out = True
+        for task in uploaders + analyzers:
+            task.cancel()
+        for browser in browsers:
+            browser.close_later()
+    finally:
+        executor.shutdown(wait=False)
+
+    website_data = [captured[index] for index in sorted(captured)]
+    relevance = relevance.result() if relevance and relevance.done() and not relevance.cancelled() else {}
+    analyzed = [records[index] for index in sorted(records)]
+    gemini_results = {
+        "websites": analyzed,
+        "comparison": build_comparison(
+            analyzed, f"Compared {len(analyzed)} {category} websites, each analyzed as soon as it was captured."
+        )
+    }
+    if fallback_reasons:
+        gemini_results["fallback"] = True
+        gemini_results["fallback_reason"] = "; ".join(sorted(set(fallback_reasons)))
+
+    wall = time.time() - start_time
+    print(
+        f"Pipeline finished {len(analyzed)}/{len(websites)} sites in {wall:.1f}s "
+        f"(capture {busy['capture']:.1f}s, upload {busy['upload']:.1f}s, analysis {busy['analysis']:.1f}s of stage time)"
+    )
+    scores = assemble_scores(website_data, gemini_results, category, round(busy["analysis"], 3), relevance)
+    if timed_out:
+        scores["deadline_exceeded"] = True
+    return scores
+
+
+def run_pipeline(websites, category, viewports=None):
+    """Synchronous entry point: run the staged pipeline on a fresh event loop."""
+    return asyncio.run(run_stages(websites, category, viewports))
@@ -0,0 +1,367 @@
+# Pre-warming scheduler: keeps captures (and analyses) of the most requested sites fresh so
+# /compare_websites can answer for them without opening a browser.
+#
+#     python prewarm.py                 # refresh the hot set every PREWARM_INTERVAL seconds
+#     python prewarm.py --once          # one refresh pass now (ignores PREWARM_WINDOW)
+#     python prewarm.py --list          # show the hot set and snapshot ages
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent))
+from singleflight import normalize_url
+from results_store import normalize_category
+from result_model import assign_site_ids, site_key
+from image_archive import screenshot_exists
+
+# Kept out of the screenshots tree, which /screenshots/<path> serves publicly
+DATA_DIR = os.environ.get("DATA_DIR", "data")
+PREWARM_DB_PATH = os.environ.get("PREWARM_DB_PATH", os.path.join(DATA_DIR, "prewarm.db"))
+# Sites kept warm per category, and the (decayed) request count a site needs to qualify
+PREWARM_HOT_SITES = int(os.environ.get("PREWARM_HOT_SITES", "30"))
+PREWARM_MIN_HITS = float(os.environ.get("PREWARM_MIN_HITS", "3"))
+# Request counts halve every this many hours, so the hot set follows current traffic
+PREWARM_HALF_LIFE_HOURS = float(os.environ.get("PREWARM_HALF_LIFE_HOURS", "24"))
+# Refresh cadence: each pass recaptures hot sites whose snapshot is older than this (seconds)
+PREWARM_INTERVAL = int(os.environ.get("PREWARM_INTERVAL", "3600"))
+# Local time window passes may run in, e.g. "01:00-06:00" (empty = any time)
+PREWARM_WINDOW = os.environ.get("PREWARM_WINDOW", "")
+# Browsers capturing at once during a pass
+PREWARM_CONCURRENCY = int(os.environ.get("PREWARM_CONCURRENCY", "2"))
+# Also refresh the Gemini analysis and text relevance of hot sites (not only the captures)
+PREWARM_ANALYSIS = os.environ.get("PREWARM_ANALYSIS", "1") != "0"
+# Oldest snapshot a request is answered from (seconds); use >= 24h with a nightly window
+PREWARM_MAX_AGE = int(os.environ.get("PREWARM_MAX_AGE", "21600"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS site_hits (
+    url TEXT NOT NULL,
+    category TEXT NOT NULL,
+    name TEXT NOT NULL,
+    hits REAL NOT NULL,
+    last_seen REAL NOT NULL,
+    PRIMARY KEY (url, category)
+);
+
+CREATE TABLE IF NOT EXISTS site_snapshots (
+    url TEXT NOT NULL,
+    category TEXT NOT NULL,
+    captured_at REAL NOT NULL,
+    analyzed INTEGER NOT NULL DEFAULT 0,
+    data TEXT NOT NULL,
+    PRIMARY KEY (url, category)
+);
+"""
+
+
+class PrewarmStore:
+    """
+    SQLite store of request frequency per (URL, category) and of the latest pre-warmed
+    snapshot of each hot site: its captured sections plus, optionally, its analysis.
+    One connection per thread; WAL mode lets the API and the scheduler share it.
+    """
+
+    def __init__(self, path=PREWARM_DB_PATH, half_life_hours=PREWARM_HALF_LIFE_HOURS):
+        self.path = path
+        self.half_life = half_life_hours * 3600
+        self.local = threading.local()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self.connection() as db:
+            db.executescript(SCHEMA)
+
+    def connection(self):
+        db = getattr(self.local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30)
+            db.row_factory = sqlite3.Row
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self.local.db = db
+        return db
+
+    def _decayed(self, hits, last_seen, now):
+        return hits * 0.5 ** ((now - last_seen) / self.half_life)
+
+    def record_request(self, websites, category):
+        """Count one request for each site of a comparison."""
+        now = time.time()
+        category = normalize_category(category)
+        with self.connection() as db:
+            for site in websites:
+                url = normalize_url(site["url"])
+                row = db.execute(
+                    "SELECT hits, last_seen FROM site_hits WHERE url = ? AND category = ?", (url, category)
+                ).fetchone()
+                hits = self._decayed(row["hits"], row["last_seen"], now) + 1 if row else 1
+                db.execute(
+                    "INSERT OR REPLACE INTO site_hits (url, category, name, hits, last_seen) VALUES (?, ?, ?, ?, ?)",
+                    (url, category, site["name"], hits, now)
+                )
+
+    def hot_sites(self, limit=PREWARM_HOT_SITES, min_hits=PREWARM_MIN_HITS):
+        """
+        The most requested sites of each category.
+
+        Returns:
+            List of dicts with "url", "name", "category" and "hits", busiest first
+        """
+        now = time.time()
+        by_category = {}
+        with self.connection() as db:
+            for row in db.execute("SELECT * FROM site_hits"):
+                hits = self._decayed(row["hits"], row["last_seen"], now)
+                if hits >= min_hits:
+                    by_category.setdefault(row["category"], []).append(
+                        {"url": row["url"], "name": row["name"], "category": row["category"], "hits": round(hits, 2)}
+                    )
+            # Sites nobody has asked for in a long time
+            db.execute("DELETE FROM site_hits WHERE last_seen < ?", (now - 20 * self.half_life,))
+        hot = []
+        for sites in by_category.values():
+            hot += sorted(sites, key=lambda site: site["hits"], reverse=True)[:limit]
+        return sorted(hot, key=lambda site: site["hits"], reverse=True)
+
+    def snapshot_ages(self):
+        """Seconds since each (url, category) snapshot was captured."""
+        now = time.time()
+        with self.connection() as db:
+            return {
+                (row["url"], row["category"]): now - row["captured_at"]
+                for row in db.execute("SELECT url, category, captured_at FROM site_snapshots")
+            }
+
+    def save_snapshot(self, url, category, site, record=None, relevance=None):
+        """Store the captured site (and its analysis record / text relevance) for a category."""
+        data = {"site": site, "record": record, "relevance": relevance}
+        with self.connection() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO site_snapshots (url, category, captured_at, analyzed, data) VALUES (?, ?, ?, ?, ?)",
+                (normalize_url(url), normalize_category(category), time.time(), int(record is not None), json.dumps(data))
+            )
+
+    def fresh_snapshots(self, websites, category, max_age=PREWARM_MAX_AGE):
+        """
+        Snapshots of every site of a comparison, if all of them are younger than `max_age`.
+
+        Returns:
+            List of snapshot dicts (with "captured_at") in the order of `websites`, or None
+        """
+        category = normalize_category(category)
+        oldest = time.time() - max_age
+        snapshots = []
+        with self.connection() as db:
+            for site in websites:
+                row = db.execute(
+                    "SELECT captured_at, data FROM site_snapshots WHERE url = ? AND category = ? AND captured_at >= ?",
+                    (normalize_url(site["url"]), category, oldest)
+                ).fetchone()
+                if row is None:
+                    return None
+                snapshots.append({**json.loads(row["data"]), "captured_at": row["captured_at"]})
+        return snapshots
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_prewarm_store():
+    """Return the process-wide pre-warm store, creating it on first use."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = PrewarmStore()
+        return _store
+
+
+def prewarmed_scores(websites, category, max_age=None):
+    """
+    Answer a comparison from pre-warmed snapshots when every site has a fresh one.
+    Sites with a pre-warmed analysis skip Gemini entirely; otherwise only the capture is skipped.
+
+    Args:
+        websites: List of dictionaries with website name, URL and id
+        category: Website category
+        max_age: Oldest snapshot the caller accepts, in seconds (capped at PREWARM_MAX_AGE)
+
+    Returns:
+        Dictionary with scores for each section, or None if any site isn't warm
+    """
+    # Imported here: website_comparison imports this module lazily for the same reason
+    from website_comparison import assemble_scores, analyze_changed_websites
+    from gemini import build_comparison
+
+    max_age = PREWARM_MAX_AGE if max_age is None else min(max_age, PREWARM_MAX_AGE)
+    if max_age <= 0:
+        return None
+    snapshots = get_prewarm_store().fresh_snapshots(websites, category, max_age)
+    if snapshots is None:
+        return None
+    # The snapshot's screenshots may have been dropped by archive retention since
+    if not all(screenshot_exists(snapshot["site"]["sections"].get("full")) for snapshot in snapshots):
+        return None
+
+    website_data = []
+    records = []
+    relevance = {}
+    for site, snapshot in zip(websites, snapshots):
+        site_id = site_key(site)
+        # Same capture, but named the way this comparison asked for it
+        website_data.append({**snapshot["site"], "id": site_id, "name": site["name"], "url": site["url"]})
+        if snapshot["record"]:
+            records.append({**snapshot["record"], "id": site_id, "name": site["name"], "url": site["url"], "reused": True})
+        if snapshot["relevance"]:
+            relevance[site_id] = snapshot["relevance"]
+
+    start_time = time.time()
+    if len(records) == len(website_data):
+        gemini_results = {
+            "websites": records,
+            "comparison": build_comparison(records, f"Compared {len(records)} {category} websites from pre-warmed analyses.")
+        }
+    else:
+        gemini_results = analyze_changed_websites(website_data, category)
+    scores = assemble_scores(
+        website_data, gemini_results, category, round(time.time() - start_time, 3),
+        relevance if len(relevance) == len(website_data) else None
+    )
+    scores["prewarmed"] = True
+    scores["prewarmed_age_seconds"] = round(time.time() - min(snapshot["captured_at"] for snapshot in snapshots))
+    return scores
+
+
+def in_window(window=PREWARM_WINDOW, now=None):
+    """Whether the local time is inside a "HH:MM-HH:MM" window (which may wrap past midnight)."""
+    if not window:
+        return True
+    start, end = (datetime.strptime(part.strip(), "%H:%M").time() for part in window.split("-"))
+    current = (now or datetime.now()).time()
+    return start <= current < end if start <= end else current >= start or current < end
+
+
+def refresh_sites(sites, concurrency=PREWARM_CONCURRENCY, analysis=PREWARM_ANALYSIS):
+    """
+    Recapture hot sites (each URL once, `concurrency` browsers at a time) and store a
+    snapshot for every category they're hot in, analysed unless `analysis` is off.
+
+    Args:
+        sites: Hot sites from PrewarmStore.hot_sites
+
+    Returns:
+        Number of snapshots stored
+    """
+    from website_comparison import capture_websites, analyze_changed_websites, batch_text_relevance
+
+    store = get_prewarm_store()
+    unique = {}
+    for site in sites:
+        unique.setdefault(site["url"], {"name": site["name"], "url": site["url"]})
+    targets = assign_site_ids(list(unique.values()))
+    chunks = [targets[i::concurrency] for i in range(min(concurrency, len(targets)))]
+
+    with ThreadPoolExecutor(max_workers=max(1, len(chunks))) as executor:
+        captured = {
+            capture["url"]: capture
+            for captures in executor.map(capture_websites, chunks)
+            for capture in captures
+        }
+    print(f"📸 Pre-warm captured {len(captured)}/{len(targets)} sites")
+
+    stored = 0
+    by_category = {}
+    for site in sites:
+        if site["url"] in captured:
+            by_category.setdefault(site["category"], []).append({**captured[site["url"]], "name": site["name"]})
+    for category, website_data in by_category.items():
+        records, relevance = {}, {}
+        if analysis:
+            try:
+                analyzed = analyze_changed_websites(website_data, category)
+                # Local-scorer stand-ins aren't worth serving later; keep just the captures
+                if not analyzed.get("fallback"):
+                    records = {site_key(record): record for record in analyzed["websites"]}
+                relevance = batch_text_relevance(website_data, category)
+            except Exception as e:
+                print(f"⚠️ Pre-warm analysis for {category} failed, storing captures only: {e}")
+        for site in website_data:
+            record = records.get(site_key(site))
+            store.save_snapshot(
+                site["url"], category, site,
+                {k: v for k, v in record.items() if k not in ("id", "reused", "reanalyzed_sections")} if record else None,
+                relevance.get(site_key(site))
+            )
+            stored += 1
+    return stored
+
+
+class PrewarmScheduler:
+    """Every `interval` seconds (inside the off-peak window), refreshes hot sites whose snapshot is stale."""
+
+    def __init__(self, interval=PREWARM_INTERVAL, window=PREWARM_WINDOW, concurrency=PREWARM_CONCURRENCY):
+        self.interval = interval
+        self.window = window
+        self.concurrency = concurrency
+        self.stopping = threading.Event()
+
+    def run_pass(self):
+        store = get_prewarm_store()
+        ages = store.snapshot_ages()
+        stale = [
+            site for site in store.hot_sites()
+            if ages.get((site["url"], site["category"]), float("inf")) >= self.interval
+        ]
+        if not stale:
+            print("🔥 Pre-warm: hot set is fresh")
+            return 0
+        print(f"🔥 Pre-warming {len(stale)} hot sites")
+        start_time = time.time()
+        stored = refresh_sites(stale, self.concurrency)
+        print(f"🔥 Pre-warm pass stored {stored} snapshots in {time.time() - start_time:.1f}s")
+        return stored
+
+    def run_forever(self):
+        while not self.stopping.is_set():
+            if in_window(self.window):
+                try:
+                    self.run_pass()
+                except Exception as e:
+                    print(f"❌ Pre-warm pass failed: {e}")
+            # Re-check often enough to catch the start of the window and stale snapshots
+            self.stopping.wait(min(self.interval, 300))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Keep captures of frequently compared sites warm.")
+    parser.add_argument("--once", action="store_true", help="Run one refresh pass now and exit")
+    parser.add_argument("--list", action="store_true", help="Print the hot set and snapshot ages")
+    parser.add_argument("--concurrency", type=int, default=PREWARM_CONCURRENCY, help="Browsers used at once")
+    args = parser.parse_args()
+
+    scheduler = PrewarmScheduler(concurrency=args.concurrency)
+    if args.list:
+        ages = get_prewarm_store().snapshot_ages()
+        for site in get_prewarm_store().hot_sites():
+            age = ages.get((site["url"], site["category"]))
+            print(f"{site['category']:<15} {site['hits']:>7.1f} hits  {site['url']:<45} "
+                  f"{f'{age / 60:.0f} min old' if age is not None else 'not warm'}")
+        return
+    if args.once:
+        scheduler.run_pass()
+        return
+
+    print(f"Pre-warming every {scheduler.interval}s" + (f" within {scheduler.window}" if scheduler.window else ""))
+    try:
+        scheduler.run_forever()
+    except KeyboardInterrupt:
+        print("Stopping pre-warm scheduler")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+import os
+import re
+import sys
+import time
+import json
+import uuid
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+from image_archive import write_atomic
+
+# Samples per second taken while a request is profiled (?profile=1)
+PROFILE_SAMPLE_HZ = float(os.environ.get("PROFILE_SAMPLE_HZ", "100"))
+MAX_SAMPLE_HZ = 1000
+# Always-on sampling of the whole process at a low rate (0 = off)
+PROFILE_CONTINUOUS_HZ = float(os.environ.get("PROFILE_CONTINUOUS_HZ", "0"))
+# Profiled requests stop sampling after this long (the request itself carries on)
+PROFILE_MAX_SECONDS = float(os.environ.get("PROFILE_MAX_SECONDS", "600"))
+# Kept out of the screenshots tree, which /screenshots/<path> serves publicly
+DATA_DIR = os.environ.get("DATA_DIR", "data")
+PROFILES_DIR = os.environ.get("PROFILES_DIR", os.path.join(DATA_DIR, "profiles"))
+PROFILES_KEEP = int(os.environ.get("PROFILES_KEEP", "50"))
+
+SPEEDSCOPE_SCHEMA = "https://www.speedscope.app/file-format-schema.json"
+SAMPLER_THREAD_NAME = "sampling-profiler"
+
+
+class SamplingProfiler:
+    """
+    Wall-clock sampling profiler: a background thread records the Python stack of every
+    other thread `hz` times a second (so time spent waiting on the browser, uploads or
+    Gemini shows up too). Stacks are kept per thread and exported in speedscope format.
+    """
+
+    def __init__(self, hz=PROFILE_SAMPLE_HZ, name="profile", max_seconds=None):
+        self.interval = 1.0 / max(1.0, min(hz, MAX_SAMPLE_HZ))
+        self.name = name
+        self.max_seconds = max_seconds
+        self.lock = threading.Lock()
+        self.frames = []
+        self.frame_ids = {}
+        self.samples = defaultdict(list)  # thread name -> [(stack, seconds)]
+        self.sample_count = 0
+        self.started_at = None
+        self.duration = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _frame_id(self, code):
+        key = (code.co_name, code.co_filename, code.co_firstlineno)
+        frame_id = self.frame_ids.get(key)
+        if frame_id is None:
+            frame_id = self.frame_ids[key] = len(self.frames)
+            self.frames.append({"name": code.co_name, "file": code.co_filename, "line": code.co_firstlineno})
+        return frame_id
+
+    def record(self, thread_name, stack, seconds):
+        samples = self.samples[thread_name]
+        # Consecutive identical stacks (idle threads, long waits) are merged to keep profiles small
+        if samples and samples[-1][0] == stack:
+            samples[-1] = (stack, samples[-1][1] + seconds)
+        else:
+            samples.append((stack, seconds))
+
+    def _sample(self, seconds):
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        with self.lock:
+            self.sample_count += 1
+            for ident, frame in sys._current_frames().items():
+                # Skip this and any other profiler's sampling thread
+                if names.get(ident) == SAMPLER_THREAD_NAME:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(self._frame_id(frame.f_code))
+                    frame = frame.f_back
+                stack.reverse()
+                self.record(names.get(ident, f"thread-{ident}"), tuple(stack), seconds)
+
+    def _run(self):
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            self._sample(now - last)
+            last = now
+            if self.max_seconds and now - self.started_at >= self.max_seconds:
+                print(f"⚠️ Profile {self.name} reached {self.max_seconds:.0f}s; sampling stopped")
+                return
+
+    def start(self):
+        self.started_at = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name=SAMPLER_THREAD_NAME, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.duration = time.perf_counter() - self.started_at
+        return self
+
+    def _profiles(self):
+        profiles = []
+        for thread_name, samples in sorted(self.samples.items()):
+            total = sum(seconds for _, seconds in samples)
+            profiles.append({
+                "type": "sampled",
+                "name": thread_name,
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": total,
+                "samples": [list(stack) for stack, _ in samples],
+                "weights": [seconds for _, seconds in samples],
+            })
+        return profiles
+
+    def speedscope(self):
+        """The profile as a speedscope document (open it at https://www.speedscope.app)."""
+        with self.lock:
+            return {
+                "$schema": SPEEDSCOPE_SCHEMA,
+                "name": self.name,
+                "exporter": "SmartBengal sampling profiler",
+                "activeProfileIndex": 0,
+                "shared": {"frames": list(self.frames)},
+                "profiles": self._profiles(),
+            }
+
+
+class ContinuousProfiler(SamplingProfiler):
+    """Always-on, low-rate SamplingProfiler that keeps a total per distinct stack instead of every sample."""
+
+    def __init__(self, hz=PROFILE_CONTINUOUS_HZ):
+        super().__init__(hz, name="continuous")
+        self.totals = defaultdict(lambda: defaultdict(float))  # thread name -> stack -> seconds
+
+    def record(self, thread_name, stack, seconds):
+        # Threads come and go (request threads, pool workers), so numbered names are grouped
+        self.totals[re.sub(r"\d+", "N", thread_name)][stack] += seconds
+
+    def _profiles(self):
+        return [
+            {
+                "type": "sampled",
+                "name": thread_name,
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": sum(stacks.values()),
+                "samples": [list(stack) for stack in stacks],
+                "weights": list(stacks.values()),
+            }
+            for thread_name, stacks in sorted(self.totals.items())
+        ]
+
+    def reset(self):
+        with self.lock:
+            self.totals.clear()
+            self.started_at = time.perf_counter()
+
+
+def to_folded(document):
+    """
+    Convert a speedscope document to folded stacks ("thread;outer;inner <microseconds>" per line),
+    the input format of flamegraph.pl and most flamegraph tools.
+    """
+    frames = document["shared"]["frames"]
+    names = [f"{frame['name']} ({os.path.basename(frame['file'])}:{frame['line']})" for frame in frames]
+    totals = defaultdict(float)
+    for profile in document["profiles"]:
+        for stack, seconds in zip(profile["samples"], profile["weights"]):
+            totals[";".join([profile["name"]] + [names[i] for i in stack])] += seconds
+    return "\n".join(f"{stack} {round(seconds * 1e6)}" for stack, seconds in sorted(totals.items())) + "\n"
+
+
+def save_profile(document, meta):
+    """
+    Store a profile and prune all but the newest PROFILES_KEEP.
+
+    Returns:
+        The profile id
+    """
+    os.makedirs(PROFILES_DIR, exist_ok=True)
+    profile_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    # The profile is written before its metadata, so listed profiles are always complete
+    write_atomic(os.path.join(PROFILES_DIR, f"{profile_id}.speedscope.json"), json.dumps(document).encode())
+    write_atomic(os.path.join(PROFILES_DIR, f"{profile_id}.meta.json"), json.dumps({"id": profile_id, **meta}).encode())
+
+    for stale in list_profiles()[PROFILES_KEEP:]:
+        for suffix in (".meta.json", ".speedscope.json"):
+            try:
+                os.remove(os.path.join(PROFILES_DIR, f"{stale['id']}{suffix}"))
+            except OSError:
+                pass
+    return profile_id
+
+
+def list_profiles():
+    """Metadata of the stored profiles, newest first."""
+    if not os.path.isdir(PROFILES_DIR):
+        return []
+    profiles = []
+    for name in sorted(os.listdir(PROFILES_DIR), reverse=True):
+        if name.endswith(".meta.json"):
+            try:
+                with open(os.path.join(PROFILES_DIR, name)) as f:
+                    profiles.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+    return profiles
+
+
+def load_profile(profile_id):
+    """The stored speedscope document, or None."""
+    if not profile_id.replace("-", "").isalnum():
+        return None
+    try:
+        with open(os.path.join(PROFILES_DIR, f"{profile_id}.speedscope.json")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+@contextmanager
+def profile_scope(name, hz=PROFILE_SAMPLE_HZ, meta=None):
+    """
+    Sample the process while the block runs and store the result; the yielded dict
+    gets the profile "id" once the block exits.
+    """
+    profiler = SamplingProfiler(hz, name, max_seconds=PROFILE_MAX_SECONDS).start()
+    session = {"id": None}
+    try:
+        yield session
+    finally:
+        profiler.stop()
+        samples = profiler.sample_count
+        session["id"] = save_profile(profiler.speedscope(), {
+            "name": name,
+            "created_at": time.time(),
+            "seconds": round(profiler.duration, 3),
+            "sample_hz": round(1.0 / profiler.interval, 1),
+            "samples": samples,
+            **(meta or {})
+        })
+        print(f"📈 Saved profile {session['id']} ({profiler.duration:.1f}s, {samples} samples)")
+
+
+_continuous = None
+_continuous_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    # The sampler thread isn't copied into a forked child; the next get_continuous_profiler() starts a new one
+    global _continuous, _continuous_lock
+    _continuous = None
+    _continuous_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_continuous_profiler():
+    """Return the process-wide always-on profiler, started on first use (None when PROFILE_CONTINUOUS_HZ is 0)."""
+    global _continuous
+    with _continuous_lock:
+        if _continuous is None and PROFILE_CONTINUOUS_HZ > 0:
+            _continuous = ContinuousProfiler().start()
+        return _continuous
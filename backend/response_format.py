@@ -0,0 +1,114 @@
+import gzip
+import json
+
+try:
+    import orjson
+except ImportError:  # Optional fast JSON encoder
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # Optional br compression
+    brotli = None
+
+from result_model import SECTION_TYPES
+
+# Fields that are derivable from "score" and dropped in compact mode
+REDUNDANT_FIELDS = ("criteria", "gemini_score", "details")
+
+# Payloads smaller than this are sent uncompressed
+MIN_COMPRESS_BYTES = 1024
+
+
+def compact_scores(scores):
+    """
+    Convert the compare_websites result into the compact format: every site is stored
+    once under "sites" and section entries reference it by id instead of embedding
+    the Gemini details and a repeated criteria dict.
+
+    Args:
+        scores: Dictionary returned by compare_websites
+
+    Returns:
+        Compact dictionary with "sites", "sections" and "comparison"
+    """
+    sites = []
+    site_ids = {}
+
+    def site_id(key, name, record=None):
+        # Keyed by the site id of the comparison (the name, for results stored before ids)
+        if key not in site_ids:
+            site_ids[key] = f"s{len(sites)}"
+            sites.append({"id": site_ids[key], "name": name, **(record or {})})
+        return site_ids[key]
+
+    for website in scores.get("websites", []):
+        site_id(website.get("id") or website.get("name"), website.get("name"),
+                {k: v for k, v in website.items() if k not in ("id", "name")})
+
+    sections = {}
+    for section_type in SECTION_TYPES:
+        entries = []
+        for entry in scores.get(section_type, []):
+            compact_entry = {"site": site_id(entry.get("site_id") or entry.get("name"), entry.get("name"))}
+            for key, value in entry.items():
+                if key not in REDUNDANT_FIELDS and key not in ("name", "site_id"):
+                    compact_entry[key] = value
+            entries.append(compact_entry)
+        sections[section_type] = entries
+
+    compact = {"format": "compact", "sites": sites, "sections": sections}
+    for key, value in scores.items():
+        if key not in SECTION_TYPES and key != "websites":
+            compact[key] = value
+    return compact
+
+
+def project_fields(scores, fields):
+    """
+    Keep only the requested fields on section entries and site records.
+    Identifying fields ("id", "site", "name") are always kept.
+
+    Args:
+        scores: Full or compact result dictionary
+        fields: Iterable of field names to keep
+
+    Returns:
+        New dictionary with projected entries
+    """
+    keep = set(fields) | {"id", "site", "name"}
+
+    def project(records):
+        return [{k: v for k, v in record.items() if k in keep} for record in records]
+
+    projected = dict(scores)
+    if "sections" in projected:
+        projected["sections"] = {name: project(entries) for name, entries in projected["sections"].items()}
+    for key in SECTION_TYPES + ["websites", "sites"]:
+        if isinstance(projected.get(key), list):
+            projected[key] = project(projected[key])
+    return projected
+
+
+def serialize(payload):
+    """Serialize to compact UTF-8 JSON bytes, using orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def compress(body, accept_encoding):
+    """
+    Compress a response body according to the client's Accept-Encoding header.
+
+    Returns:
+        Tuple of (body, content_encoding or None)
+    """
+    if len(body) < MIN_COMPRESS_BYTES or not accept_encoding:
+        return body, None
+    accepted = {part.split(";")[0].strip().lower() for part in accept_encoding.split(",")}
+    if brotli is not None and "br" in accepted:
+        return brotli.compress(body, quality=5), "br"
+    if "gzip" in accepted:
+        return gzip.compress(body, compresslevel=6), "gzip"
+    return body, None
@@ -0,0 +1,220 @@
+from dataclasses import dataclass, field
+from functools import lru_cache
+
+# Our section names → section keys of the Gemini analysis record. The single source of
+# truth for section names: import these rather than redefining them.
+GEMINI_SECTION_KEYS = {"header": "header", "main": "main_content", "footer": "footer"}
+SECTION_TYPES = ["header", "main", "footer", "full"]
+# Criteria the frontend charts per entry (all carry the entry's score)
+CRITERIA = ("Clarity", "Modernity", "Relevance", "Consistency", "Visual Appeal")
+
+
+def assign_site_ids(websites):
+    """
+    Give every site of a comparison a unique "id": its name, or "<name>-2", "<name>-3", ...
+    when several sites share a display name. Ids are also used in screenshot paths.
+
+    Returns:
+        New list of site dicts with "id" set
+    """
+    taken = {site["name"] for site in websites}
+    seen = set()
+    result = []
+    for site in websites:
+        site_id = site["name"]
+        if site_id in seen:
+            suffix = 2
+            while f"{site['name']}-{suffix}" in taken:
+                suffix += 1
+            site_id = f"{site['name']}-{suffix}"
+            taken.add(site_id)
+        seen.add(site_id)
+        result.append({**site, "id": site_id})
+    return result
+
+
+@lru_cache(maxsize=1024)
+def _criteria_items(score):
+    return tuple((criterion, score) for criterion in CRITERIA)
+
+
+def criteria_scores(score):
+    """Criteria dict for an entry score (a fresh dict; only the item tuple is cached)."""
+    return dict(_criteria_items(score))
+
+
+def site_key(site):
+    """Id of a captured site or analysis record (the name, for data from before ids existed)."""
+    return site.get("id") or site.get("name")
+
+
+@dataclass(slots=True)
+class SectionScore:
+    """Score of one header / main / footer section of a site."""
+    path: str
+    score: float
+    strengths: list
+    weaknesses: list
+    recommendations: list
+    cloudinary_url: str | None = None
+    text_relevance: float | None = None
+
+
+@dataclass(slots=True)
+class SiteResult:
+    """One scored site: its analysis record, full-page score and section scores."""
+    id: str
+    name: str
+    url: str
+    record: dict
+    score: float
+    full_path: str | None = None
+    full_cloudinary_url: str | None = None
+    text_relevance: float | None = None
+    viewports: dict | None = None
+    sections: dict = field(default_factory=dict)
+
+    def full_entry(self):
+        entry = {
+            "name": self.name,
+            "site_id": self.id,
+            "path": self.full_path,
+            "score": self.score,
+            "gemini_score": self.score,
+            "details": self.record,
+            "criteria": criteria_scores(self.score)
+        }
+        if self.full_cloudinary_url:
+            entry["cloudinary_url"] = self.full_cloudinary_url
+        if self.text_relevance is not None:
+            entry["text_relevance"] = self.text_relevance
+        if self.viewports:
+            entry["viewports"] = self.viewports
+        return entry
+
+    def section_entry(self, section):
+        scored = self.sections[section]
+        entry = {
+            "name": self.name,
+            "site_id": self.id,
+            "path": scored.path,
+            "score": scored.score,
+            "gemini_score": scored.score,
+            "criteria": criteria_scores(scored.score),
+            "gemini_strengths": scored.strengths,
+            "gemini_weaknesses": scored.weaknesses,
+            "gemini_recommendations": scored.recommendations
+        }
+        if scored.cloudinary_url:
+            entry["cloudinary_url"] = scored.cloudinary_url
+        if scored.text_relevance is not None:
+            entry["text_relevance"] = scored.text_relevance
+        return entry
+
+
+@dataclass(slots=True)
+class ComparisonResult:
+    """Scored sites of one comparison, indexed by site id and by display name."""
+    records: list = field(default_factory=list)
+    comparison: dict = field(default_factory=dict)
+    fallback: bool = False  # Scored by the local heuristic because Gemini was unavailable
+    fallback_reason: str | None = None
+    sites: list = field(default_factory=list)
+    by_id: dict = field(default_factory=dict)
+    by_name: dict = field(default_factory=dict)
+
+    def add(self, site):
+        self.sites.append(site)
+        self.by_id[site.id] = site
+        self.by_name.setdefault(site.name, []).append(site)
+
+    def get(self, site_id):
+        return self.by_id.get(site_id)
+
+    def named(self, name):
+        """All sites with this display name (several when names are shared)."""
+        return self.by_name.get(name, [])
+
+    @classmethod
+    def build(cls, website_data, records, comparison=None, relevance=None, fallback=False, fallback_reason=None):
+        """
+        Join captured sites with their analysis records in one pass over each.
+
+        Args:
+            website_data: Captured sites (id, name, url, sections)
+            records: Analysis records, matched to captured sites by id
+            comparison: Gemini comparison summary
+            relevance: Text relevance scores out of 10, keyed by site id
+            fallback / fallback_reason: Whether (and why) the local scorer stood in for Gemini
+
+        Returns:
+            ComparisonResult
+        """
+        relevance = relevance or {}
+        captured = {site_key(site): site for site in website_data}
+        result = cls(records=records, comparison=comparison or {}, fallback=fallback, fallback_reason=fallback_reason)
+
+        for record in records:
+            site_id = site_key(record)
+            site = captured.get(site_id)
+            if not site or not site.get("sections"):
+                continue
+            sections = site["sections"]
+            texts = relevance.get(site_id, {})
+
+            site_result = SiteResult(
+                id=site_id,
+                name=site["name"],
+                url=site.get("url"),
+                record=record,
+                score=record.get("overall_score", 0) / 10.0,  # Convert to 0-1 scale
+                full_path=sections.get("full"),
+                full_cloudinary_url=sections.get("full_cloudinary_url"),
+                text_relevance=texts["overall"] / 10.0 if "overall" in texts else None,
+                # Full-page captures at the extra viewport widths, keyed by width
+                viewports={width: paths.get("full") for width, paths in sections["viewports"].items()}
+                if sections.get("viewports") else None
+            )
+
+            analysed = record.get("sections", {})
+            for section, gemini_key in GEMINI_SECTION_KEYS.items():
+                section_data = analysed.get(gemini_key)
+                if section_data is None or not sections.get(section):
+                    continue
+                site_result.sections[section] = SectionScore(
+                    path=sections[section],
+                    score=section_data.get("score", 0) / 10.0,
+                    strengths=section_data.get("strengths", []),
+                    weaknesses=section_data.get("weaknesses", []),
+                    recommendations=section_data.get("recommendations", []),
+                    cloudinary_url=sections.get(f"{section}_cloudinary_url"),
+                    text_relevance=texts[section] / 10.0 if section in texts else None
+                )
+            result.add(site_result)
+        return result
+
+    def summary_rows(self):
+        """(name, header, main, footer, overall) per site, 0 for sections without a score."""
+        return [
+            (
+                site.name,
+                *(site.sections[section].score if section in site.sections else 0 for section in ("header", "main", "footer")),
+                site.score if site.full_path else 0
+            )
+            for site in self.sites
+        ]
+
+    def to_dict(self):
+        """Serialize to the response shape the frontend reads (section lists plus websites / comparison)."""
+        scores = {section: [] for section in SECTION_TYPES}
+        for site in self.sites:
+            if site.full_path:
+                scores["full"].append(site.full_entry())
+            for section in site.sections:
+                scores[section].append(site.section_entry(section))
+        scores["websites"] = self.records
+        scores["comparison"] = self.comparison
+        if self.fallback:
+            scores["fallback"] = True
+            scores["fallback_reason"] = self.fallback_reason
+        return scores
@@ -0,0 +1,224 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+
+from result_model import GEMINI_SECTION_KEYS
+
+# Kept out of the screenshots tree, which /screenshots/<path> serves publicly
+DATA_DIR = os.environ.get("DATA_DIR", "data")
+RESULTS_DB_PATH = os.environ.get("RESULTS_DB_PATH", os.path.join(DATA_DIR, "results.db"))
+
+# Identical comparisons newer than this (seconds) are answered from the store; 0 disables reuse
+RESULTS_MAX_AGE = int(os.environ.get("RESULTS_MAX_AGE", "300"))
+# Stored comparison responses older than this (seconds) are deleted on the next save
+RESPONSE_RETENTION = int(os.environ.get("RESULTS_RESPONSE_RETENTION", "86400"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS site_results (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_id TEXT NOT NULL,
+    site TEXT NOT NULL,
+    url TEXT NOT NULL,
+    category TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    overall_score REAL,
+    header_score REAL,
+    main_score REAL,
+    footer_score REAL,
+    strengths TEXT,
+    weaknesses TEXT,
+    image_hashes TEXT,
+    capture_seconds REAL,
+    analysis_seconds REAL,
+    reused INTEGER NOT NULL DEFAULT 0,
+    fallback INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_site_results_site ON site_results (site, category, created_at);
+CREATE INDEX IF NOT EXISTS idx_site_results_url ON site_results (url, category, created_at);
+
+CREATE TABLE IF NOT EXISTS comparison_results (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    comparison_key TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    response TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_comparison_results_key ON comparison_results (comparison_key, created_at);
+CREATE INDEX IF NOT EXISTS idx_comparison_results_created ON comparison_results (created_at);
+"""
+
+
+def normalize_category(category):
+    return category.strip().lower()
+
+
+class ResultsStore:
+    """
+    Embedded SQLite store of every comparison run: per-site scores, strengths and
+    weaknesses, image hashes and timings, plus full responses for instant repeats.
+    One connection per thread; WAL mode lets readers run alongside the writer.
+    """
+
+    def __init__(self, path=RESULTS_DB_PATH):
+        self.path = path
+        self.local = threading.local()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self.connection() as db:
+            db.executescript(SCHEMA)
+            # Stores created before local-scorer runs were flagged
+            columns = {row["name"] for row in db.execute("PRAGMA table_info(site_results)")}
+            if "fallback" not in columns:
+                db.execute("ALTER TABLE site_results ADD COLUMN fallback INTEGER NOT NULL DEFAULT 0")
+
+    def connection(self):
+        db = getattr(self.local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30)
+            db.row_factory = sqlite3.Row
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self.local.db = db
+        return db
+
+    def record_run(self, run_id, category, website_data, websites, analysis_seconds=None, fallback=False):
+        """
+        Record one scored run.
+
+        Args:
+            run_id: Capture run id
+            category: Website category
+            website_data: Captured sites (name, url, optional capture_seconds / image_hashes)
+            websites: Scored website records from the analysis (matched by site id)
+            analysis_seconds: Wall time of the analysis step
+            fallback: The scores came from the local heuristic scorer, not Gemini
+        """
+        now = time.time()
+        category = normalize_category(category)
+        records = {website.get("id") or website.get("name"): website for website in websites}
+        rows = []
+        for site in website_data:
+            record = records.get(site.get("id") or site["name"])
+            if not record:
+                continue
+            sections = record.get("sections", {})
+            scores = {section: sections.get(key, {}).get("score") for section, key in GEMINI_SECTION_KEYS.items()}
+            rows.append((
+                run_id, site["name"], site["url"], category, now,
+                record.get("overall_score"), scores["header"], scores["main"], scores["footer"],
+                json.dumps({key: sections.get(key, {}).get("strengths", []) for key in GEMINI_SECTION_KEYS.values()}),
+                json.dumps({key: sections.get(key, {}).get("weaknesses", []) for key in GEMINI_SECTION_KEYS.values()}),
+                json.dumps(site.get("image_hashes", {})),
+                site.get("capture_seconds"), analysis_seconds, int(bool(record.get("reused"))), int(bool(fallback))
+            ))
+        with self.connection() as db:
+            db.executemany(
+                """INSERT INTO site_results (run_id, site, url, category, created_at, overall_score,
+                   header_score, main_score, footer_score, strengths, weaknesses, image_hashes,
+                   capture_seconds, analysis_seconds, reused, fallback)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                rows
+            )
+
+    def latest_scores(self, category, sites=None, include_fallback=False):
+        """
+        Latest recorded scores per site for a category.
+
+        Args:
+            category: Website category
+            sites: Optional list of site names to restrict to
+            include_fallback: Also consider runs scored by the local heuristic scorer
+
+        Returns:
+            List of dicts, one per site
+        """
+        category = normalize_category(category)
+        query = """
+            SELECT r.* FROM site_results r
+            JOIN (SELECT site, MAX(created_at) AS created_at FROM site_results
+                  WHERE category = ? {site_filter} {fallback_filter} GROUP BY site) latest
+              ON r.site = latest.site AND r.created_at = latest.created_at
+            WHERE r.category = ? {fallback_filter}
+            ORDER BY r.overall_score DESC
+        """
+        params = [category]
+        site_filter = ""
+        if sites:
+            site_filter = f"AND site IN ({', '.join('?' for _ in sites)})"
+            params += list(sites)
+        params.append(category)
+        fallback_filter = "" if include_fallback else "AND fallback = 0"
+        rows = self.connection().execute(
+            query.format(site_filter=site_filter, fallback_filter=fallback_filter), params
+        ).fetchall()
+        return [self._row(row) for row in rows]
+
+    def score_trend(self, site, category, days=30, include_fallback=False):
+        """
+        Score history for one site over the last `days` days, oldest first.
+        Runs scored by the local heuristic scorer are left out unless `include_fallback`.
+        """
+        since = time.time() - days * 86400
+        rows = self.connection().execute(
+            f"""SELECT * FROM site_results WHERE site = ? AND category = ? AND created_at >= ?
+               {"" if include_fallback else "AND fallback = 0"} ORDER BY created_at""",
+            (site, normalize_category(category), since)
+        ).fetchall()
+        return [self._row(row, details=False) for row in rows]
+
+    def save_response(self, comparison_key, response):
+        now = time.time()
+        with self.connection() as db:
+            db.execute(
+                "INSERT INTO comparison_results (comparison_key, created_at, response) VALUES (?, ?, ?)",
+                (comparison_key, now, json.dumps(response))
+            )
+            # Responses too old to be reused by any request
+            db.execute("DELETE FROM comparison_results WHERE created_at < ?", (now - RESPONSE_RETENTION,))
+
+    def recent_response(self, comparison_key, max_age=RESULTS_MAX_AGE):
+        """Most recent stored response for a comparison key, if newer than max_age seconds."""
+        if not max_age or max_age <= 0:
+            return None
+        row = self.connection().execute(
+            """SELECT response FROM comparison_results WHERE comparison_key = ? AND created_at >= ?
+               ORDER BY created_at DESC LIMIT 1""",
+            (comparison_key, time.time() - max_age)
+        ).fetchone()
+        return json.loads(row["response"]) if row else None
+
+    @staticmethod
+    def _row(row, details=True):
+        result = {
+            "site": row["site"],
+            "url": row["url"],
+            "category": row["category"],
+            "run_id": row["run_id"],
+            "created_at": row["created_at"],
+            "overall_score": row["overall_score"],
+            "header_score": row["header_score"],
+            "main_score": row["main_score"],
+            "footer_score": row["footer_score"],
+            "reused": bool(row["reused"]),
+            "fallback": bool(row["fallback"]),
+        }
+        if details:
+            result["strengths"] = json.loads(row["strengths"] or "{}")
+            result["weaknesses"] = json.loads(row["weaknesses"] or "{}")
+            result["image_hashes"] = json.loads(row["image_hashes"] or "{}")
+            result["capture_seconds"] = row["capture_seconds"]
+            result["analysis_seconds"] = row["analysis_seconds"]
+        return result
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_results_store():
+    """Return the process-wide results store, creating it on first use."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ResultsStore()
+        return _store
@@ -0,0 +1,162 @@
+import io
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from itertools import islice
+from PIL import Image
+
+# Thumbnail widths we generate; requests are snapped up to the nearest one so the cache stays bounded
+THUMBNAIL_WIDTHS = [160, 320, 480, 640, 960, 1280]
+THUMBNAIL_DIR = ".thumbs"
+THUMBNAIL_QUALITY = 80
+
+# Full-page screenshots can be very tall; PIL refuses them by default
+Image.MAX_IMAGE_PIXELS = None
+# What PIL raises for files that aren't (complete) images; those are served as they are
+UNREADABLE_IMAGE_ERRORS = (OSError, ValueError, Image.DecompressionBombError)
+
+# Most recently used paths kept in the ETag cache and the per-thumbnail lock table
+CACHE_MAX_ENTRIES = int(os.environ.get("SCREENSHOT_CACHE_MAX_ENTRIES", "4096"))
+
+_etag_cache = OrderedDict()
+_etag_lock = threading.Lock()
+_thumbnail_locks = OrderedDict()
+_thumbnail_locks_lock = threading.Lock()
+
+
+def snap_width(width):
+    """Round a requested width up to the nearest supported thumbnail width."""
+    for candidate in THUMBNAIL_WIDTHS:
+        if width <= candidate:
+            return candidate
+    return THUMBNAIL_WIDTHS[-1]
+
+
+def file_etag(path):
+    """
+    Strong ETag for a file: SHA-1 of its content, cached by (mtime, size) so
+    unchanged files are hashed only once.
+    """
+    stat = os.stat(path)
+    key = (stat.st_mtime_ns, stat.st_size)
+    with _etag_lock:
+        cached = _etag_cache.get(path)
+        if cached and cached[0] == key:
+            _etag_cache.move_to_end(path)
+            return cached[1]
+
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    etag = digest.hexdigest()
+
+    with _etag_lock:
+        _etag_cache[path] = (key, etag)
+        _etag_cache.move_to_end(path)
+        while len(_etag_cache) > CACHE_MAX_ENTRIES:
+            _etag_cache.popitem(last=False)
+    return etag
+
+
+def _thumbnail_lock(path):
+    with _thumbnail_locks_lock:
+        lock = _thumbnail_locks.setdefault(path, threading.Lock())
+        _thumbnail_locks.move_to_end(path)
+        # Evict idle locks only: dropping a held one would let a second thread build the same thumbnail
+        excess = len(_thumbnail_locks) - CACHE_MAX_ENTRIES
+        for stale in list(islice(_thumbnail_locks, max(0, excess))):
+            if not _thumbnail_locks[stale].locked():
+                del _thumbnail_locks[stale]
+        return lock
+
+
+def get_thumbnail(root, relative_path, width):
+    """
+    Return the path (relative to root) of a width-limited JPEG thumbnail of a screenshot,
+    creating it on first request and regenerating it when the original changes.
+
+    Args:
+        root: Screenshot root directory
+        relative_path: Path of the original image inside root (already validated)
+        width: Requested width in pixels
+
+    Returns:
+        Relative path of the thumbnail, or the original path if it is already narrow enough
+        or isn't a readable image
+    """
+    width = snap_width(width)
+    source = os.path.join(root, relative_path)
+    thumb_relative = os.path.join(THUMBNAIL_DIR, str(width), os.path.splitext(relative_path)[0] + ".jpg")
+    thumb_path = os.path.join(root, thumb_relative)
+
+    source_mtime = os.stat(source).st_mtime_ns
+    if os.path.exists(thumb_path) and os.stat(thumb_path).st_mtime_ns >= source_mtime:
+        return thumb_relative
+
+    with _thumbnail_lock(thumb_path):
+        # Another request may have generated it while we waited
+        if os.path.exists(thumb_path) and os.stat(thumb_path).st_mtime_ns >= source_mtime:
+            return thumb_relative
+
+        try:
+            with Image.open(source) as image:
+                if image.width <= width:
+                    return relative_path
+                height = max(1, round(image.height * width / image.width))
+                image.draft("RGB", (width, height))
+                thumbnail = image.convert("RGB").resize((width, height), Image.LANCZOS)
+        except UNREADABLE_IMAGE_ERRORS as e:
+            print(f"⚠️ Can't make a thumbnail of {relative_path}, serving the original: {e}")
+            return relative_path
+
+        os.makedirs(os.path.dirname(thumb_path), exist_ok=True)
+        tmp_path = f"{thumb_path}.{os.getpid()}-{threading.get_ident()}.tmp"
+        thumbnail.save(tmp_path, "JPEG", quality=THUMBNAIL_QUALITY, optimize=True)
+        os.replace(tmp_path, thumb_path)
+
+    return thumb_relative
+
+
+def get_archived_thumbnail(archive, key, width):
+    """
+    Like get_thumbnail, for a screenshot stored in the packed archive. Thumbnails are
+    stored in the archive too, keyed by the ETag of the original so a recapture
+    invalidates them.
+
+    Args:
+        archive: ImageArchive holding the screenshot
+        key: Archive key of the original image
+        width: Requested width in pixels
+
+    Returns:
+        Archive key of the thumbnail, or the original key if it is already narrow enough
+        or isn't a readable image
+    """
+    width = snap_width(width)
+    source = archive.info(key)
+    thumb_key = f"{THUMBNAIL_DIR}/{width}/{source['etag']}.jpg"
+    if archive.info(thumb_key):
+        return thumb_key
+
+    with _thumbnail_lock(thumb_key):
+        if archive.info(thumb_key):
+            return thumb_key
+
+        try:
+            with Image.open(io.BytesIO(archive.get(key))) as image:
+                if image.width <= width:
+                    return key
+                height = max(1, round(image.height * width / image.width))
+                image.draft("RGB", (width, height))
+                thumbnail = image.convert("RGB").resize((width, height), Image.LANCZOS)
+        except UNREADABLE_IMAGE_ERRORS as e:
+            print(f"⚠️ Can't make a thumbnail of {key}, serving the original: {e}")
+            return key
+
+        buffer = io.BytesIO()
+        thumbnail.save(buffer, "JPEG", quality=THUMBNAIL_QUALITY, optimize=True)
+        archive.put(thumb_key, buffer.getvalue(), source=source["etag"])
+
+    return thumb_key
@@ -1,21 +1,44 @@
 import cv2
-import pytesseract
+import numpy as np
 from PIL import Image
 import os
-from google import genai
+import re
+import json
 
-# Set up Tesseract path (adjust if needed)
-pytesseract.pytesseract.tesseract_cmd = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
+try:
+    import pytesseract
+except ImportError:  # OCR is optional; sections without DOM text are left without text
+    pytesseract = None
 
-# Initialize the GenAI client
-client = genai.Client(api_key="")  # 9🔁 Replace with your actual API key
+from gemini_client import get_gemini_client, CircuitOpenError
+from image_archive import read_screenshot
+
+# Tesseract binary, when it isn't on PATH (e.g. C:\Program Files\Tesseract-OCR\tesseract.exe on Windows)
+TESSERACT_CMD = os.environ.get("TESSERACT_CMD")
+if pytesseract and TESSERACT_CMD:
+    pytesseract.pytesseract.tesseract_cmd = TESSERACT_CMD
+
+# Sections with less DOM text than this that are mostly images / canvas get OCR'd instead
+MIN_DOM_TEXT_CHARS = 20
+MIN_MEDIA_FRACTION = 0.3
+
+# Characters of each section's text sent for relevance scoring
+MAX_RELEVANCE_CHARS = 1500
+
+# Shared, rate-limited GenAI client
+client = get_gemini_client()
 
 def extract_text_from_image(image_path):
-    if not os.path.exists(image_path):
+    if pytesseract is None:
+        print("⚠️ pytesseract not installed. Skipping OCR.")
+        return None
+
+    data = read_screenshot(image_path)
+    if data is None:
         print(f"❌ File not found: {image_path}")
         return None
 
-    image = cv2.imread(image_path)
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
     if image is None:
         print("❌ OpenCV failed to read the image. Please check format or path.")
         return None
@@ -23,15 +46,41 @@ def extract_text_from_image(image_path):
     gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
     gray = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[1]
 
-    extracted_text = pytesseract.image_to_string(gray)
+    try:
+        extracted_text = pytesseract.image_to_string(gray)
+    except Exception as e:
+        print(f"❌ OCR failed for {image_path}: {e}")
+        return None
     print("✅ Extracted Text:\n", extracted_text)
     return extracted_text.strip()
 
+def section_texts(sections):
+    """
+    Text of each captured section: the DOM text collected at capture time, with OCR
+    of the section screenshot only for sections that are image / canvas only.
+
+    Args:
+        sections: Captured sections of one website (paths plus the "text" capture)
+
+    Returns:
+        Dict mapping "header", "main" and "footer" to text
+    """
+    captured = sections.get("text") or {}
+    texts = {}
+    for section in ["header", "main", "footer"]:
+        text = captured.get(section, "")
+        media = captured.get("media", {}).get(section, 0)
+        if len(text) < MIN_DOM_TEXT_CHARS and media >= MIN_MEDIA_FRACTION and sections.get(section):
+            print(f"🔍 {section} has no DOM text; falling back to OCR")
+            text = extract_text_from_image(sections[section]) or text
+        texts[section] = text
+    return texts
+
 def get_relevance_score(text, category):
     prompt = f"Assess the relevance of the following text to the category: {category}. Text: {text}. Give the score out of 10 only."
 
     try:
-        response = client.models.generate_content(
+        response = client.generate_content(
             model="gemini-2.0-flash",
             contents=prompt
         )
@@ -41,6 +90,59 @@ def get_relevance_score(text, category):
         print("❌ Error generating relevance score:", e)
         return None
 
+def score_text_relevance(site_texts, category):
+    """
+    Score how relevant each website's text is to the category, for all sites in one call.
+
+    Args:
+        site_texts: Dict mapping website name to {"header", "main", "footer"} text
+        category: Website category
+
+    Returns:
+        Dict mapping website name to {"header", "main", "footer", "overall"} scores out of 10
+        (empty if the call fails)
+    """
+    site_texts = {name: texts for name, texts in site_texts.items() if any(texts.values())}
+    if not site_texts:
+        return {}
+
+    blocks = []
+    for name, texts in site_texts.items():
+        sections = "\n".join(
+            f"  [{section}] {' '.join(text.split())[:MAX_RELEVANCE_CHARS]}"
+            for section, text in texts.items()
+        )
+        blocks.append(f"Website: {name}\n{sections}")
+
+    prompt = f"""
+    Assess how relevant the visible text of each of these websites is to the category: {category}.
+    Score every section (header, main, footer) and the website overall from 1-10.
+
+    {chr(10).join(blocks)}
+
+    Return only JSON in this format, with one entry per website:
+    {{"<website name>": {{"header": <score>, "main": <score>, "footer": <score>, "overall": <score>}}}}
+    """
+
+    try:
+        response = client.generate_content(
+            model="gemini-2.0-flash",
+            contents=prompt
+        )
+        match = re.search(r'({.*})', response.text, re.DOTALL)
+        scores = json.loads(match.group(1)) if match else {}
+    except CircuitOpenError as e:
+        print(f"⚠️ Skipping text relevance, Gemini API degraded: {e}")
+        return {}
+    except Exception as e:
+        print("❌ Error generating relevance scores:", e)
+        return {}
+    return {
+        name: {key: float(score) for key, score in value.items() if isinstance(score, (int, float))}
+        for name, value in scores.items()
+        if name in site_texts and isinstance(value, dict)
+    }
+
 def main():
     image_path = "flipkart.png"  # 🔁 Update if using a different image
     category_input = input("🔹 Enter the category to compare relevance against: ")
@@ -55,5 +157,5 @@ def main():
     else:
         print("⚠ No text extracted from the image.")
 
-if _name_ == "_main_":
+if __name__ == "__main__":
     main()
@@ -0,0 +1,166 @@
+# Prefork production server: load the app and its read-only resources once, then fork worker
+# processes that share the listening socket, so CPU-bound steps aren't bound by one GIL.
+#
+#     python serve.py --workers 4 --port 5000
+#
+# Each worker runs its own browsers and its own admission slots; caches are shared on disk.
+import os
+import gc
+import sys
+import time
+import signal
+import socket
+import argparse
+import threading
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent))
+
+SERVER_HOST = os.environ.get("SERVER_HOST", "0.0.0.0")
+SERVER_PORT = int(os.environ.get("SERVER_PORT", "5000"))
+SERVER_WORKERS = int(os.environ.get("SERVER_WORKERS", str(os.cpu_count() or 1)))
+# Seconds workers get to finish in-flight requests on shutdown
+SHUTDOWN_GRACE_SECONDS = float(os.environ.get("SHUTDOWN_GRACE_SECONDS", "30"))
+
+
+def preload():
+    """
+    Import the app in the parent so every worker starts with the modules, selector tables,
+    prompt templates and Gemini client already loaded, then freeze them out of the garbage
+    collector so the children's collections don't touch (and copy) the shared pages.
+
+    Returns:
+        The Flask app
+    """
+    start_time = time.time()
+    from app import app
+    from profiler import get_continuous_profiler
+
+    # Started again in each worker; a thread doesn't survive fork
+    profiler = get_continuous_profiler()
+    if profiler:
+        profiler.stop()
+
+    gc.collect()
+    gc.freeze()
+    print(f"📦 Preloaded app in {time.time() - start_time:.1f}s")
+    return app
+
+
+def bind_socket(host, port, backlog=128):
+    sock = socket.create_server((host, port), backlog=backlog, reuse_port=False)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(app, sock, workers):
+    """Serve requests from the shared socket until SIGTERM (runs in the forked child)."""
+    import cv2
+    from werkzeug.serving import make_server
+    from profiler import get_continuous_profiler
+    from gemini_client import get_gemini_client
+
+    # Don't let every worker's OpenCV thread pool use all the cores
+    cv2.setNumThreads(max(1, (os.cpu_count() or 1) // workers))
+    # The rate limiter is per process, so each worker gets its share of GEMINI_RPM / GEMINI_TPM
+    get_gemini_client().share_quota(workers)
+    get_continuous_profiler()
+
+    server = make_server(sock.getsockname()[0], sock.getsockname()[1], app, threaded=True, fd=sock.fileno())
+    # On SIGTERM stop accepting, then let in-flight requests finish (server_close joins their threads)
+    server.daemon_threads = False
+    signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=server.shutdown).start())
+    print(f"👷 Worker {os.getpid()} serving")
+    server.serve_forever()
+    server.server_close()
+
+
+def start_workers(app, sock, count, workers=None):
+    """Fork `count` serving processes (out of `workers` in total). Returns their pids."""
+    pids = []
+    for _ in range(count):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                signal.signal(signal.SIGINT, signal.SIG_IGN)  # The parent handles Ctrl+C
+                run_worker(app, sock, workers or count)
+            except Exception as e:
+                print(f"❌ Worker {os.getpid()} crashed: {e}")
+                code = 1
+            finally:
+                os._exit(code)
+        pids.append(pid)
+    return pids
+
+
+def stop_workers(pids, grace=SHUTDOWN_GRACE_SECONDS):
+    """SIGTERM the workers, wait up to `grace` seconds, then SIGKILL what's left."""
+    for pid in pids:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    give_up_at = time.time() + grace
+    remaining = set(pids)
+    while remaining and time.time() < give_up_at:
+        for pid in list(remaining):
+            try:
+                done, _ = os.waitpid(pid, os.WNOHANG)
+            except ChildProcessError:
+                done = pid
+            if done:
+                remaining.discard(pid)
+        time.sleep(0.1)
+    for pid in remaining:
+        os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
+
+
+def supervise(app, sock, workers):
+    """Run the workers, replacing any that die, until SIGINT / SIGTERM."""
+    pids = start_workers(app, sock, workers)
+    stopping = False
+
+    def stop(*_):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        while not stopping:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                pid = 0
+            if pid and pid in pids and not stopping:
+                print(f"⚠️ Worker {pid} exited ({status}); starting a replacement")
+                pids.remove(pid)
+                pids += start_workers(app, sock, 1, workers)
+            time.sleep(0.5)
+    finally:
+        print("\nStopping workers...")
+        stop_workers(pids)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the API with pre-forked worker processes.")
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--workers", type=int, default=SERVER_WORKERS, help="Worker processes")
+    args = parser.parse_args()
+
+    app = preload()
+    if not hasattr(os, "fork"):
+        print("⚠️ os.fork isn't available on this platform. Serving from a single process.")
+        app.run(host=args.host, port=args.port, threaded=True)
+        return
+
+    sock = bind_socket(args.host, args.port)
+    print(f"🚀 Serving on http://{args.host}:{args.port} with {args.workers} workers")
+    supervise(app, sock, max(1, args.workers))
+
+
+if __name__ == "__main__":
+    main()
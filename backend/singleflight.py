@@ -0,0 +1,107 @@
+import json
+import threading
+from urllib.parse import urlsplit
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key: the first caller runs the function,
+    later callers block until it finishes (or their timeout passes) and receive the same
+    result (or exception).
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.coalesced = 0
+
+    def do(self, key, fn, timeout=None):
+        """
+        Run `fn()` once per key among concurrent callers.
+
+        Args:
+            key: Calls with equal keys are coalesced
+            fn: Zero-argument callable run by the first caller
+            timeout: Longest a later caller waits for the first one's result (None: no limit)
+
+        Returns:
+            Tuple of (result, shared) where shared is True if another caller computed it
+
+        Raises:
+            TimeoutError: if a later caller's timeout passes before the result is ready
+        """
+        with self.lock:
+            call = self.calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self.coalesced += 1
+                leader = False
+            else:
+                call = _Call()
+                self.calls[key] = call
+                leader = True
+
+        if not leader:
+            if not call.done.wait(timeout):
+                with self.lock:
+                    call.waiters -= 1
+                raise TimeoutError(f"In-flight call for {key} did not finish within {timeout:.1f}s")
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+
+        if call.error is not None:
+            raise call.error
+        return call.result, False
+
+    def metrics(self):
+        with self.lock:
+            return {
+                "in_flight": len(self.calls),
+                "waiting": sum(call.waiters for call in self.calls.values()),
+                "coalesced_total": self.coalesced,
+            }
+
+
+def normalize_url(url):
+    """Normalize a URL for comparison keys: lowercase scheme/host, default scheme, no trailing slash."""
+    url = url.strip()
+    if "://" not in url:
+        url = f"https://{url}"
+    parts = urlsplit(url)
+    path = parts.path.rstrip("/")
+    query = f"?{parts.query}" if parts.query else ""
+    return f"{parts.scheme.lower()}://{parts.netloc.lower()}{path}{query}"
+
+
+def comparison_key(websites, category, options=None):
+    """
+    Key identifying a comparison regardless of site order or URL spelling.
+
+    Args:
+        websites: List of dictionaries with website name and URL
+        category: Website category
+        options: Optional dict of extra options that change the result
+
+    Returns:
+        Hashable string key
+    """
+    sites = sorted((normalize_url(site["url"]), site["name"].strip()) for site in websites)
+    return json.dumps([sites, category.strip().lower(), options or {}], sort_keys=True)
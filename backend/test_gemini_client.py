@@ -0,0 +1,42 @@
+# Circuit breaker regression tests for the shared Gemini client.
+#
+#     python -m unittest test_gemini_client      (from backend/)
+import sys
+import time
+import unittest
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent))
+from gemini_client import GeminiClient, CircuitBreaker, RateLimitTimeout
+from deadline import deadline_scope, DeadlineExceeded
+
+
+class HalfOpenTrialTest(unittest.TestCase):
+    """A half-open trial that never reaches the API must not leave the circuit stuck."""
+
+    def setUp(self):
+        self.breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.0)
+        self.breaker.record_failure()  # Open; half-open on the next allow()
+        self.client = GeminiClient(object(), requests_per_minute=1, breaker=self.breaker, max_wait=0.01)
+
+    def test_rate_limit_timeout_releases_trial(self):
+        self.client.request_bucket.acquire(1)  # Empty the bucket so the trial times out waiting
+        with self.assertRaises(RateLimitTimeout):
+            self.client.call(lambda: "ok")
+        self.assertFalse(self.breaker.trial_in_flight)
+        self.client.request_bucket.tokens = 1
+        self.assertEqual(self.client.call(lambda: "ok"), "ok")
+        self.assertEqual(self.breaker.metrics()["state"], "closed")
+
+    def test_deadline_releases_trial(self):
+        with deadline_scope(0.001):
+            time.sleep(0.01)
+            with self.assertRaises(DeadlineExceeded):
+                self.client.call(lambda: "ok")
+        self.assertFalse(self.breaker.trial_in_flight)
+        self.assertEqual(self.client.call(lambda: "ok"), "ok")
+        self.assertEqual(self.breaker.metrics()["state"], "closed")
+
+
+if __name__ == "__main__":
+    unittest.main()
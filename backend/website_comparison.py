@@ -4,38 +4,51 @@ from PIL import Image
 from playwright.sync_api import sync_playwright
 import json
 import sys
+import copy
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 from pathlib import Path
 from prettytable import PrettyTable
 from io import BytesIO
 
 # Add local imports
 sys.path.append(str(Path(__file__).parent))
-from gemini import analyze_websites_with_gemini
-from cloudinary_storage import init_cloudinary, upload_image, upload_website_screenshots
+from gemini import analyze_websites_with_gemini, build_comparison
+from cloudinary_storage import init_cloudinary, upload_website_screenshots, collect_uploads
+from singleflight import SingleFlight, comparison_key, normalize_url
+from change_detection import AnalysisCache, RelevanceCache, plan_reanalysis
+from image_segmentation import segment_screenshot, decode_screenshot, crop_rows
+from results_store import get_results_store, RESULTS_MAX_AGE
+from segmentation import section_texts, score_text_relevance
+from image_archive import save_screenshot
+from deadline import timeout_ms, deadline_passed, capture_reserve, remaining_seconds
+from admission import get_admission_controller
+from browser_engine import launch_browser, screenshot, element_screenshot
+from result_model import ComparisonResult, assign_site_ids, site_key, GEMINI_SECTION_KEYS
 
 # Initialize Cloudinary if environment variables are set
 init_cloudinary()
 
-# Helper function to ensure consistent response structure for the frontend
-def ensure_frontend_compatibility(scores):
-    """
-    Ensure the response structure is compatible with the frontend expectations.
-    The frontend expects each section to have entries with name, score, and criteria.
-    """
-    for section_type in ["header", "main", "footer", "full"]:
-        if section_type in scores:
-            for entry in scores[section_type]:
-                # Ensure criteria exists
-                if "criteria" not in entry:
-                    score_value = entry.get("score", 0.5)
-                    entry["criteria"] = {
-                        "Clarity": score_value,
-                        "Modernity": score_value,
-                        "Relevance": score_value,
-                        "Consistency": score_value,
-                        "Visual Appeal": score_value
-                    }
-    return scores
+# Concurrent identical comparisons share one capture + analysis
+comparison_flight = SingleFlight()
+
+# Last scored analysis + screenshot fingerprints per (URL, category)
+analysis_cache = AnalysisCache()
+relevance_cache = RelevanceCache()
+
+# By default every site is captured first and all sites are compared in one Gemini call; set
+# COMPARISON_PIPELINE=1 to overlap capture → upload → analysis stages instead, at one Gemini
+# call per site (faster, but N calls of quota per comparison)
+COMPARISON_PIPELINE = os.environ.get("COMPARISON_PIPELINE", "0") == "1"
+# Score section text for category relevance with a second Gemini call per comparison (off by
+# default: it doubles the requests a comparison spends of GEMINI_RPM)
+TEXT_RELEVANCE = os.environ.get("TEXT_RELEVANCE", "0") == "1"
+
+def new_run_id():
+    """Unique id for one capture run, used to keep parallel runs from sharing output files."""
+    return f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
 
 # --- OpenCV Preprocessing ---
 def preprocess_image(image_path):
@@ -62,108 +75,394 @@ def preprocess_image(image_path):
         print(f"Error preprocessing image {image_path}: {str(e)}")
         return None
 
-def capture_sections_and_fullpage(page, url, website_name):
-    try:
-        page.goto(url, wait_until="load", timeout=60000)
-        page.wait_for_timeout(3000)
-
-        selectors = {
-            "header": [
-                'header', 'nav', 'div[role="banner"]', '.header', '.navbar', '#header',
-                '#nav-main', '#navbar', '.top-bar', '.main-header', '.global-header',
-                'div[data-role="header"]', '.site-header', 'div[class*="header"]',
-                'div[class*="navbar"]', 'div[class*="top"]', '#masthead', '.page-header',
-                '#site-header', '#main-header', '.app-header', '.layout-header', '#branding',
-                'ytd-masthead', 'ytd-app > #masthead-container'
-            ],
-            "footer": [
-                'footer', '.footer', '#footer', '#navFooter', '.site-footer', '.bottom-bar',
-                'div[role="contentinfo"]', '.main-footer', '.global-footer', '.footer-wrapper',
-                'div[class*="footer"]', 'div[class*="bottom"]', 'div[data-role="footer"]',
-                '.site-info', '#colophon', '#page-footer', '.app-footer', '.layout-footer',
-                'ytd-footer', 'ytd-app > #footer'
-            ]
+SECTION_SELECTORS = {
+    "header": [
+        'header', 'nav', 'div[role="banner"]', '.header', '.navbar', '#header',
+        '#nav-main', '#navbar', '.top-bar', '.main-header', '.global-header',
+        'div[data-role="header"]', '.site-header', 'div[class*="header"]',
+        'div[class*="navbar"]', 'div[class*="top"]', '#masthead', '.page-header',
+        '#site-header', '#main-header', '.app-header', '.layout-header', '#branding',
+        'ytd-masthead', 'ytd-app > #masthead-container'
+    ],
+    "footer": [
+        'footer', '.footer', '#footer', '#navFooter', '.site-footer', '.bottom-bar',
+        'div[role="contentinfo"]', '.main-footer', '.global-footer', '.footer-wrapper',
+        'div[class*="footer"]', 'div[class*="bottom"]', 'div[data-role="footer"]',
+        '.site-info', '#colophon', '#page-footer', '.app-footer', '.layout-footer',
+        'ytd-footer', 'ytd-app > #footer'
+    ]
+}
+
+# Width of the primary capture (matches the browser context viewport)
+PRIMARY_VIEWPORT_WIDTH = 1280
+
+# Sites aren't started when less than this many seconds of capture time are left before the deadline
+MIN_CAPTURE_SECONDS = 5
+
+# Resolves once web fonts are loaded, pending <img> decodes finish and two frames have been painted
+LAYOUT_READY_SCRIPT = """(timeout) => new Promise(resolve => {
+    const timer = setTimeout(resolve, timeout);
+    const fonts = document.fonts ? document.fonts.ready : Promise.resolve();
+    const images = Array.from(document.images)
+        .filter(img => !img.complete)
+        .map(img => img.decode().catch(() => {}));
+    Promise.all([fonts, ...images]).then(() =>
+        requestAnimationFrame(() => requestAnimationFrame(() => { clearTimeout(timer); resolve(); })));
+})"""
+
+# Visible text per section, bucketed by where each text node sits on the page, plus the
+# share of each section covered by images / canvas / video (candidates for OCR)
+SECTION_TEXT_SCRIPT = """([headerBottom, footerTop, maxChars]) => {
+    const bucket = y => y < headerBottom ? "header" : (y >= footerTop ? "footer" : "main");
+    const text = {header: [], main: [], footer: []};
+    const length = {header: 0, main: 0, footer: 0};
+    const walker = document.createTreeWalker(document.body, NodeFilter.SHOW_TEXT, {
+        acceptNode: node => {
+            const parent = node.parentElement;
+            if (!parent || !node.textContent.trim() || ["SCRIPT", "STYLE", "NOSCRIPT", "TEMPLATE"].includes(parent.tagName))
+                return NodeFilter.FILTER_REJECT;
+            const style = getComputedStyle(parent);
+            if (style.visibility === "hidden" || style.display === "none" || style.opacity === "0")
+                return NodeFilter.FILTER_REJECT;
+            return NodeFilter.FILTER_ACCEPT;
         }
+    });
+    const range = document.createRange();
+    for (let node = walker.nextNode(); node; node = walker.nextNode()) {
+        range.selectNodeContents(node);
+        const rect = range.getBoundingClientRect();
+        if (!rect.width || !rect.height) continue;
+        const section = bucket(rect.top + window.scrollY + rect.height / 2);
+        if (length[section] >= maxChars) continue;
+        const value = node.textContent.replace(/\\s+/g, " ").trim();
+        text[section].push(value);
+        length[section] += value.length + 1;
+    }
+    const pageHeight = document.documentElement.scrollHeight;
+    const width = document.documentElement.clientWidth || 1;
+    const spans = {header: [0, headerBottom], main: [headerBottom, footerTop], footer: [footerTop, pageHeight]};
+    const media = {header: 0, main: 0, footer: 0};
+    for (const el of document.querySelectorAll("img, canvas, video, svg, picture")) {
+        const rect = el.getBoundingClientRect();
+        if (!rect.width || !rect.height) continue;
+        const top = rect.top + window.scrollY, bottom = top + rect.height;
+        for (const [section, [start, end]] of Object.entries(spans)) {
+            const overlap = Math.min(bottom, end) - Math.max(top, start);
+            if (overlap > 0) media[section] += overlap * Math.min(rect.width, width);
+        }
+    }
+    for (const [section, [start, end]] of Object.entries(spans))
+        media[section] = end > start ? Math.min(1, media[section] / ((end - start) * width)) : 0;
+    return {
+        header: text.header.join(" ").slice(0, maxChars),
+        main: text.main.join(" ").slice(0, maxChars),
+        footer: text.footer.join(" ").slice(0, maxChars),
+        media
+    };
+}"""
 
-        header = next((el for sel in selectors["header"] if (el := page.query_selector(sel))), None)
-        footer = next((el for sel in selectors["footer"] if (el := page.query_selector(sel))), None)
+# Upper bound on the characters of text kept per section
+MAX_SECTION_TEXT_CHARS = 20000
 
-        if not header or not footer:
-            print(f"❌ Couldn't find header or footer for {website_name}. Skipping...")
-            return None
+# Force lazy-loaded content to load before the full-page capture (no scroll pass)
+CAPTURE_EAGER_LOAD = os.environ.get("CAPTURE_EAGER_LOAD", "1") != "0"
+# Longest wait for the images that eager loading started
+EAGER_LOAD_TIMEOUT_MS = int(os.environ.get("EAGER_LOAD_TIMEOUT_MS", "5000"))
 
-        header_box = header.bounding_box()
-        footer_box = footer.bounding_box()
+# Installed before any page script runs: records every IntersectionObserver and its targets
+# so lazy loaders waiting for elements to scroll into view can be told they're visible
+EAGER_LOAD_INIT_SCRIPT = """(() => {
+    const Native = window.IntersectionObserver;
+    if (!Native || window.__eagerObservers) return;
+    const observers = window.__eagerObservers = [];
+    window.IntersectionObserver = class extends Native {
+        constructor(callback, options) {
+            super(callback, options);
+            this.__callback = callback;
+            this.__targets = new Set();
+            observers.push(this);
+        }
+        observe(target) { this.__targets.add(target); return super.observe(target); }
+        unobserve(target) { this.__targets.delete(target); return super.unobserve(target); }
+        disconnect() { this.__targets.clear(); return super.disconnect(); }
+    };
+})()"""
 
-        if not header_box or not footer_box:
-            print(f"❌ Couldn't retrieve bounding boxes for {website_name}. Skipping...")
-            return None
+# Makes lazy content load now: loading="lazy" → eager, data-src / data-srcset / data-bg promoted,
+# and every observed element reported as intersecting. Then waits (up to `timeout` ms) for
+# the decodes of just the images this started, not for everything else on the page.
+EAGER_LOAD_SCRIPT = """(timeout) => new Promise(resolve => {
+    const stats = {lazy: 0, promoted: 0, observed: 0, waited: 0, timedOut: false};
+    const before = new Map(Array.from(document.images, img => [img, img.currentSrc || img.src]));
+    const started = new Set();
+    for (const el of document.querySelectorAll('img[loading="lazy"], iframe[loading="lazy"]')) {
+        el.loading = "eager";
+        stats.lazy++;
+        if (el.tagName === "IMG") started.add(el);
+    }
+    for (const el of document.querySelectorAll("[data-src], [data-lazy-src], [data-original], [data-srcset], [data-lazy-srcset]")) {
+        const src = el.dataset.src || el.dataset.lazySrc || el.dataset.original;
+        const srcset = el.dataset.srcset || el.dataset.lazySrcset;
+        if (!["IMG", "SOURCE", "IFRAME", "VIDEO"].includes(el.tagName)) continue;
+        if (srcset && el.getAttribute("srcset") !== srcset) { el.setAttribute("srcset", srcset); stats.promoted++; }
+        if (src && el.tagName !== "SOURCE" && el.getAttribute("src") !== src) { el.setAttribute("src", src); stats.promoted++; }
+        const img = el.tagName === "SOURCE" ? el.parentElement && el.parentElement.querySelector("img") : el;
+        if (img && img.tagName === "IMG") started.add(img);
+    }
+    for (const el of document.querySelectorAll("[data-bg], [data-background-image]")) {
+        const url = el.dataset.bg || el.dataset.backgroundImage;
+        if (!url || el.style.backgroundImage) continue;
+        el.style.backgroundImage = url.startsWith("url(") ? url : `url("${url}")`;
+        const img = new Image();
+        img.src = url.replace(/^url\(["']?|["']?\)$/g, "");
+        started.add(img);
+        stats.promoted++;
+    }
+    for (const observer of window.__eagerObservers || []) {
+        const entries = Array.from(observer.__targets, target => {
+            const rect = target.getBoundingClientRect();
+            return {
+                target, isIntersecting: true, intersectionRatio: 1, time: performance.now(),
+                boundingClientRect: rect, intersectionRect: rect, rootBounds: null
+            };
+        });
+        if (!entries.length) continue;
+        stats.observed += entries.length;
+        try { observer.__callback.call(observer, entries, observer); } catch (e) {}
+    }
+    const timer = setTimeout(() => { stats.timedOut = true; resolve(stats); }, timeout);
+    // Lazy loaders set src from their callbacks or on the next frame; pick up whatever changed
+    requestAnimationFrame(() => requestAnimationFrame(() => {
+        for (const img of document.images) {
+            if (before.get(img) !== (img.currentSrc || img.src)) started.add(img);
+        }
+        const pending = Array.from(started).filter(img => !img.complete || !img.naturalWidth);
+        stats.waited = pending.length;
+        Promise.all(pending.map(img => img.decode().catch(() => {}))).then(() =>
+            requestAnimationFrame(() => { clearTimeout(timer); resolve(stats); }));
+    }));
+})"""
 
-        header_bottom = header_box['y'] + header_box['height']
-        footer_top = footer_box['y']
-        main_height = max(0, footer_top - header_bottom)
+def extract_section_text(page, header_bottom, footer_top):
+    """
+    Collect the visible DOM text of the header / main / footer sections of a loaded page.
+    
+    Args:
+        page: Loaded Playwright page
+        header_bottom: Page y coordinate where the header ends
+        footer_top: Page y coordinate where the footer starts
+        
+    Returns:
+        Dict with "header", "main" and "footer" text and a "media" coverage dict, or None
+    """
+    try:
+        return page.evaluate(SECTION_TEXT_SCRIPT, [header_bottom, footer_top, MAX_SECTION_TEXT_CHARS])
+    except Exception as e:
+        print(f"⚠️ Couldn't read page text: {e}")
+        return None
 
-        # Create directory for screenshots
-        screenshots_folder = f"screenshots/{website_name}"
-        os.makedirs(screenshots_folder, exist_ok=True)
+def force_eager_loading(page, website_name, timeout=EAGER_LOAD_TIMEOUT_MS):
+    """
+    Load lazy images, lazy iframes and observer-driven content in place, instead of scrolling
+    through the page, and wait for the images that started loading.
+    The page must have been opened with EAGER_LOAD_INIT_SCRIPT for observer-driven content.
+    """
+    try:
+        stats = page.evaluate(EAGER_LOAD_SCRIPT, timeout)
+    except Exception as e:
+        print(f"⚠️ Couldn't force eager loading for {website_name}: {e}")
+        return
+    if stats["lazy"] or stats["promoted"] or stats["observed"]:
+        print(
+            f"🖼️ {website_name}: eager-loaded {stats['lazy']} lazy elements, promoted {stats['promoted']} data sources, "
+            f"triggered {stats['observed']} observed elements; waited for {stats['waited']} images"
+            + (" (timed out)" if stats["timedOut"] else "")
+        )
+
+def wait_for_layout(page, timeout=5000):
+    """Wait for the page to settle after a viewport change without reloading it."""
+    try:
+        page.wait_for_load_state("networkidle", timeout=timeout)
+    except Exception:
+        pass  # Long-polling pages never go idle; the layout check below still applies
+    page.evaluate(LAYOUT_READY_SCRIPT, timeout)
+
+def capture_section_images(page, website_name, viewport_width=PRIMARY_VIEWPORT_WIDTH):
+    """
+    Screenshot the full page and its header / main / footer sections at the current viewport.
+    
+    Args:
+        page: Loaded Playwright page
+        website_name: Website name (for log messages)
+        viewport_width: Current viewport width, used to clip the main section
+        
+    Returns:
+        Dict mapping section name to PNG bytes ("main" may be None) plus the section
+        "text" read from the DOM and the "layout" (page rows of each section), or None on failure
+    """
+    header = next((el for sel in SECTION_SELECTORS["header"] if (el := page.query_selector(sel))), None)
+    footer = next((el for sel in SECTION_SELECTORS["footer"] if (el := page.query_selector(sel))), None)
 
-        # Create paths for local storage
-        header_path = f"{screenshots_folder}/{website_name}_header.png"
-        main_path = f"{screenshots_folder}/{website_name}_main.png"
-        footer_path = f"{screenshots_folder}/{website_name}_footer.png"
-        full_page_path = f"{screenshots_folder}/{website_name}_full.png"
+    header_box = header.bounding_box() if header else None
+    footer_box = footer.bounding_box() if footer else None
 
-        # Take screenshots and save them locally
-        full_img_bytes = page.screenshot(full_page=True)
-        with open(full_page_path, "wb") as f:
-            f.write(full_img_bytes)
+    # Take screenshots
+    full_img_bytes = screenshot(page, full_page=True)
 
-        header_img_bytes = header.screenshot()
-        with open(header_path, "wb") as f:
-            f.write(header_img_bytes)
+    if header_box and footer_box:
+        header_bottom = header_box['y'] + header_box['height']
+        footer_top = footer_box['y']
+        main_height = max(0, footer_top - header_bottom)
+
+        header_img_bytes = element_screenshot(page, header, header_box)
 
         if main_height > 50:
-            main_img_bytes = page.screenshot(clip={
+            main_img_bytes = screenshot(page, clip={
                 'x': 0,
                 'y': header_bottom,
-                'width': 1280,
+                'width': viewport_width,
                 'height': main_height
             })
-            with open(main_path, "wb") as f:
-                f.write(main_img_bytes)
         else:
             print(f"⚠️ Main section too small for {website_name}. Skipping main.")
-            main_path = None
+            main_img_bytes = None
+
+        footer_img_bytes = element_screenshot(page, footer, footer_box)
+        layout = {
+            "header": [max(0, int(header_box['y'])), int(header_bottom)],
+            "main": [int(header_bottom), int(footer_top)],
+            "footer": [int(footer_top), int(footer_top + footer_box['height'])]
+        }
+    else:
+        # Selectors failed (common on SPAs with hashed class names): segment the screenshot itself
+        print(f"⚠️ Couldn't find header or footer for {website_name}. Segmenting the full-page screenshot...")
+        full_image = decode_screenshot(full_img_bytes)
+        segments = segment_screenshot(full_image)
+        if not segments:
+            print(f"❌ Couldn't segment screenshot for {website_name}. Skipping...")
+            return None
+
+        header_img_bytes = crop_rows(full_image, *segments["header"])
+        main_top, main_bottom = segments["main"]
+        if main_bottom - main_top > 50:
+            main_img_bytes = crop_rows(full_image, main_top, main_bottom)
+        else:
+            print(f"⚠️ Main section too small for {website_name}. Skipping main.")
+            main_img_bytes = None
+        footer_img_bytes = crop_rows(full_image, *segments["footer"])
+        header_bottom, footer_top = segments["main"]
+        layout = {section: list(rows) for section, rows in segments.items()}
+
+    return {
+        "header": header_img_bytes,
+        "main": main_img_bytes,
+        "footer": footer_img_bytes,
+        "full": full_img_bytes,
+        # Same page visit, so the text matches the screenshots without any OCR
+        "text": extract_section_text(page, header_bottom, footer_top),
+        "layout": layout
+    }
 
-        footer_img_bytes = footer.screenshot()
-        with open(footer_path, "wb") as f:
-            f.write(footer_img_bytes)
+def capture_sections_and_fullpage(page, url, website_name, run_id=None, viewports=None):
+    """
+    Load a page once and capture its sections, optionally at several viewport widths.
+    
+    Args:
+        page: Playwright page
+        url: Website URL
+        website_name: Website name
+        run_id: Capture run id (keeps parallel runs apart)
+        viewports: Extra viewport widths (e.g. [375, 768]) captured after resizing the
+            already-loaded page, without navigating again
+        
+    Returns:
+        Dict of section name → local path (plus "viewports" and "pending_uploads"), or None
+    """
+    run_id = run_id or new_run_id()
+    # Timeouts shrink to the request deadline, keeping time back for upload and analysis
+    reserve = capture_reserve()
+    if deadline_passed(reserve + MIN_CAPTURE_SECONDS):
+        print(f"⏱️ Skipping {website_name}: no time left before the request deadline")
+        return None
+    try:
+        if CAPTURE_EAGER_LOAD:
+            page.add_init_script(EAGER_LOAD_INIT_SCRIPT)
+        page.goto(url, wait_until="load", timeout=timeout_ms(60000, reserve))
+        page.wait_for_timeout(timeout_ms(3000, reserve))
+        if CAPTURE_EAGER_LOAD:
+            force_eager_loading(page, website_name, max(1, timeout_ms(EAGER_LOAD_TIMEOUT_MS, reserve)))
+
+        images = capture_section_images(page, website_name)
+        if not images:
+            return None
+        section_text = images.pop("text")
+        layout = images.pop("layout")
+
+        # Each run stores its captures under its own run path; the latest copy is also
+        # published to the stable screenshots/{name}/{name}_{section}.png paths
+        screenshots_folder = f"screenshots/{website_name}"
+        run_folder = f"{screenshots_folder}/runs/{run_id}"
+
+        # Save them in the packed archive (or as loose files with SCREENSHOT_STORAGE=files)
+        for section, data in images.items():
+            if data:
+                save_screenshot(
+                    f"{run_folder}/{website_name}_{section}.png", data, website_name, run_id,
+                    aliases=[f"{screenshots_folder}/{website_name}_{section}.png"]
+                )
+
+        header_path = f"{run_folder}/{website_name}_header.png"
+        main_path = f"{run_folder}/{website_name}_main.png" if images["main"] else None
+        footer_path = f"{run_folder}/{website_name}_footer.png"
+        full_page_path = f"{run_folder}/{website_name}_full.png"
 
         # Store local paths
         local_paths = {
             "header": header_path,
             "main": main_path,
             "footer": footer_path,
-            "full": full_page_path
+            "full": full_page_path,
+            "layout": layout
         }
+        if section_text:
+            save_screenshot(f"{run_folder}/{website_name}_text.json", json.dumps(section_text).encode(), website_name, run_id)
+            local_paths["text"] = section_text
 
-        # Upload to Cloudinary
-        cloudinary_folder = f"website_screenshots/{website_name}"
-        cloudinary_urls = {}
-
-        # Upload each section to Cloudinary
-        for section, path in local_paths.items():
-            if path and os.path.exists(path):
-                public_id = f"{website_name}_{section}"
-                result = upload_image(path, public_id=public_id, folder=cloudinary_folder)
-                
-                if "error" not in result:
-                    cloudinary_urls[f"{section}_cloudinary_url"] = result["url"]
-                else:
-                    print(f"⚠️ Failed to upload {section} screenshot to Cloudinary: {result['error']}")
-        
-        # Combine local paths and Cloudinary URLs
-        return {**local_paths, **cloudinary_urls}
+        # Queue Cloudinary uploads from the in-memory bytes; capture doesn't wait on the CDN
+        pending_uploads = upload_website_screenshots(website_name, images)
+
+        # Resize the loaded page through the extra viewports; the browser reuses its cached resources
+        viewport_paths = {}
+        original_viewport = page.viewport_size or {"width": PRIMARY_VIEWPORT_WIDTH, "height": 3000}
+        for width in viewports or []:
+            if width == original_viewport["width"]:
+                continue
+            if deadline_passed(reserve + 1):
+                print(f"⏱️ Skipping the remaining viewports of {website_name} to meet the request deadline")
+                break
+            try:
+                page.set_viewport_size({"width": width, "height": original_viewport["height"]})
+                wait_for_layout(page, max(1, timeout_ms(5000, reserve)))
+                view_images = capture_section_images(page, website_name, width)
+            except Exception as e:
+                print(f"⚠️ Failed to capture {website_name} at {width}px: {e}")
+                continue
+            if not view_images:
+                continue
+            view_images.pop("text")  # Same DOM text as the primary capture
+            view_layout = view_images.pop("layout")
+            view_paths = {}
+            for section, data in view_images.items():
+                if data:
+                    view_paths[section] = f"{run_folder}/{website_name}_{section}_{width}.png"
+                    save_screenshot(view_paths[section], data, website_name, run_id)
+            view_paths["layout"] = view_layout
+            viewport_paths[str(width)] = view_paths
+        if viewport_paths:
+            page.set_viewport_size(original_viewport)
+            local_paths["viewports"] = viewport_paths
+
+        return {**local_paths, "pending_uploads": pending_uploads}
 
     except Exception as e:
         print(f"❌ Error processing {website_name}: {e}")
@@ -185,36 +484,164 @@ def compare_websites_combined(websites, category):
     return compare_websites(websites, category)
 
 # --- Compare websites (main method) ---
-def compare_websites(websites, category):
+def compare_websites(websites, category, viewports=None, max_age=None, lane=None):
     """
     Compare websites using only Gemini scores.
+    A stored result of the same comparison newer than `max_age` seconds is returned as is;
+    concurrent requests for the same (site set, category, options) wait on a single
+    in-flight comparison and share its result, waiting no longer than their own deadline.
+    A result the deadline of another request cut short isn't shared. Only the caller that
+    actually captures and scores the sites takes an admission slot.
+    
+    Args:
+        websites: List of dictionaries with website name and URL
+        category: Website category
+        viewports: Extra viewport widths to capture for responsive analysis (e.g. [375, 768])
+        max_age: Maximum age in seconds of a stored result or pre-warmed capture to reuse
+            (0 always recomputes; None uses RESULTS_MAX_AGE and PREWARM_MAX_AGE)
+        lane: Admission lane the run waits in ("interactive" / "bulk"); None runs without admission control
+        
+    Returns:
+        Dictionary with scores for each section using only Gemini
+    """
+    key = comparison_key(websites, category, {"viewports": sorted(viewports or [])})
+    
+    stored = get_results_store().recent_response(key, RESULTS_MAX_AGE if max_age is None else max_age)
+    if stored:
+        print(f"Serving stored comparison for {', '.join(site['name'] for site in websites)}")
+        return stored
+    
+    def run_and_store():
+        scores = prewarmed_comparison(websites, category, viewports, max_age)
+        if not scores:
+            with get_admission_controller().admit(lane) if lane else nullcontext():
+                scores = run_comparison(websites, category, viewports)
+        # Partial results (a site failed or the deadline cut it off) and local-scorer fallbacks
+        # aren't reused for later requests
+        if scores.get("full") and not scores.get("partial") and not scores.get("fallback"):
+            get_results_store().save_response(key, scores)
+        return scores
+    
+    try:
+        scores, shared = comparison_flight.do(key, run_and_store, remaining_seconds())
+        if shared and scores.get("deadline_exceeded") and not deadline_passed():
+            # The leader ran out of its own time; this request may have more, so run it again
+            scores, shared = comparison_flight.do(key, run_and_store, remaining_seconds())
+    except TimeoutError:
+        print(f"⏱️ Deadline passed waiting for the in-flight comparison of {', '.join(site['name'] for site in websites)}")
+        return {
+            "header": [], "main": [], "footer": [], "full": [],
+            "partial": True,
+            "missing_sites": [site["name"] for site in websites],
+            "deadline_exceeded": True
+        }
+    if shared:
+        print(f"Reused in-flight comparison for {', '.join(site['name'] for site in websites)}")
+        # Callers may post-process the result; don't hand out the leader's object
+        scores = copy.deepcopy(scores)
+    return scores
+
+def prewarmed_comparison(websites, category, viewports=None, max_age=None):
+    """
+    Answer a comparison from pre-warmed captures, without a browser.
+    
+    Args:
+        websites: List of dictionaries with website name and URL
+        category: Website category
+        viewports: Extra viewport widths (pre-warmed captures have none)
+        max_age: Oldest pre-warmed capture to answer from, in seconds (0 never uses them;
+            None uses PREWARM_MAX_AGE)
+        
+    Returns:
+        Dictionary with scores, or None if a site has no fresh enough snapshot
+    """
+    if viewports or max_age == 0:
+        return None
+    # Imported here: the pre-warm scheduler builds on the capture and scoring helpers in this module
+    from prewarm import prewarmed_scores
+    scores = prewarmed_scores(assign_site_ids(websites), category, max_age)
+    if scores:
+        print(f"🔥 Served {', '.join(site['name'] for site in websites)} from pre-warmed captures")
+    return scores
+
+def run_comparison(websites, category, viewports=None):
+    """
+    Capture and score websites (one run, no request coalescing).
     
     Args:
         websites: List of dictionaries with website name and URL
         category: Website category
+        viewports: Extra viewport widths to capture
         
     Returns:
         Dictionary with scores for each section using only Gemini
     """
-    all_scores = {"header": [], "main": [], "footer": [], "full": []}
+    # Sites sharing a display name are told apart by id from here on
+    websites = assign_site_ids(websites)
+    if COMPARISON_PIPELINE:
+        # Imported here: the pipeline builds on the capture and scoring helpers in this module
+        from pipeline import run_pipeline
+        scores = run_pipeline(websites, category, viewports)
+    else:
+        scores = score_websites(capture_websites(websites, viewports=viewports), category)
+    
+    return mark_missing_sites(scores, websites)
+
+def mark_missing_sites(scores, websites):
+    """
+    Best effort: sites that failed or missed the deadline are listed in "missing_sites" (with
+    "partial": True) rather than failing the comparison.
+    
+    Args:
+        scores: Comparison result
+        websites: Requested sites, with ids from assign_site_ids
+        
+    Returns:
+        The same scores dict
+    """
+    finished = {site_key(website) for website in scores.get("websites", [])}
+    missing = [site["name"] for site in websites if site["id"] not in finished]
+    if missing:
+        scores["partial"] = True
+        scores["missing_sites"] = missing
+        if deadline_passed():
+            scores["deadline_exceeded"] = True
+    return scores
+
+def capture_websites(websites, run_id=None, viewports=None):
+    """
+    Capture section and full-page screenshots for every website in one browser session.
+    
+    Args:
+        websites: List of dictionaries with website name and URL
+        run_id: Capture run id (a new one is generated if omitted)
+        viewports: Extra viewport widths captured from the same page load
+        
+    Returns:
+        List of dictionaries with name, url and captured sections
+    """
     website_data = []
+    run_id = run_id or new_run_id()
     
-    # First, capture screenshots and collect website data
     with sync_playwright() as p:
-        browser = p.firefox.launch(headless=True)
+        browser = launch_browser(p)
         context = browser.new_context(viewport={"width": 1280, "height": 3000})
 
         for site in websites:
             name = site['name']
             url = site['url']
             page = context.new_page()
+            start_time = time.time()
             try:
-                sections = capture_sections_and_fullpage(page, url, name)
+                sections = capture_sections_and_fullpage(page, url, site_key(site), run_id, viewports)
                 if sections:
                     website_data.append({
+                        "id": site_key(site),
                         "name": name,
                         "url": url,
-                        "sections": sections
+                        "sections": sections,
+                        "run_id": run_id,
+                        "capture_seconds": round(time.time() - start_time, 3)
                     })
             except Exception as e:
                 print(f"❌ Failed to process {name}: {str(e)}")
@@ -223,162 +650,288 @@ def compare_websites(websites, category):
 
         browser.close()
     
+    # Wait for background Cloudinary uploads now that the browser work is done
+    for site in website_data:
+        sections = site["sections"]
+        sections.update(collect_uploads(sections.pop("pending_uploads", {})))
+    
+    return website_data
+
+def score_websites(website_data, category):
+    """
+    Score already captured websites with Gemini and assemble the frontend response.
+    
+    Args:
+        website_data: List of dictionaries from capture_websites
+        category: Website category
+        
+    Returns:
+        Dictionary with scores for each section using only Gemini
+    """
     # Check if we have any successful website data
     if not website_data:
         print("No website data available for analysis")
-        return all_scores
+        return {"header": [], "main": [], "footer": [], "full": []}
     
     # Now get Gemini scores for full-page analysis of sections
     print("\nGetting Gemini scores...")
     
-    # Prepare input for Gemini API
-    gemini_input = []
+    # Reuse earlier analyses for visually unchanged pages; only changed sections go to Gemini
+    start_time = time.time()
+    gemini_results = analyze_changed_websites(website_data, category)
+    analysis_seconds = round(time.time() - start_time, 3)
+    
+    return assemble_scores(website_data, gemini_results, category, analysis_seconds)
+
+def batch_text_relevance(website_data, category):
+    """
+    Text relevance for every site, using the text captured from the DOM. Sites whose text is
+    unchanged since it was last scored reuse that score; the rest are scored in one batched call.
+    Empty unless TEXT_RELEVANCE is on.
+    """
+    if not TEXT_RELEVANCE:
+        return {}
+    relevance = {}
+    to_score = {}
     for site in website_data:
-        sections = site.get("sections", {})
-        full_path = sections.get("full")
-        
-        gemini_site = {
-            "name": site["name"],
-            "url": site["url"]
-        }
-        
-        # Check if we have a Cloudinary URL
-        full_cloudinary_url = sections.get("full_cloudinary_url")
-        if full_cloudinary_url:
-            gemini_site["full_cloudinary_url"] = full_cloudinary_url
-        elif full_path:
-            gemini_site["full_path"] = full_path
-            
-        gemini_input.append(gemini_site)
+        texts = section_texts(site["sections"])
+        cached = relevance_cache.load(texts, category)
+        if cached is not None:
+            relevance[site_key(site)] = cached
+        else:
+            to_score[site_key(site)] = texts
+    if to_score:
+        fresh = score_text_relevance(to_score, category)
+        for site_id, scores in fresh.items():
+            relevance_cache.save(to_score[site_id], category, scores)
+        relevance.update(fresh)
+    return relevance
+
+def assemble_scores(website_data, gemini_results, category, analysis_seconds=None, relevance=None):
+    """
+    Build the frontend response from captured sites and their analysis, and record the run.
     
-    # Call Gemini API to get vision improvements and section scores
-    gemini_results = analyze_websites_with_gemini(gemini_input, category)
-    
-    # Extract websites from Gemini results
-    gemini_website_data = {}
-    if "websites" in gemini_results:
-        for website in gemini_results["websites"]:
-            name = website.get("name")
-            gemini_website_data[name] = website
-    
-    # Add vision improvements directly to the result
-    all_scores["websites"] = gemini_results.get("websites", [])
-    all_scores["comparison"] = gemini_results.get("comparison", {})
-    
-    # Process Gemini scores for each section
-    for name, website in gemini_website_data.items():
-        sections = website.get("sections", {})
-        overall_score = website.get("overall_score", 0) / 10.0  # Convert to 0-1 scale
-        
-        # Map Gemini section names to our section types
-        section_mapping = {
-            "header": "header",
-            "main_content": "main",
-            "footer": "footer"
-        }
-        
-        # Find the paths from website_data
-        site_sections = None
-        for site in website_data:
-            if site["name"] == name:
-                site_sections = site["sections"]
-                break
-        
-        if not site_sections:
-            continue
-            
-        # Process full page score
-        full_path = site_sections.get("full")
-        full_cloudinary_url = site_sections.get("full_cloudinary_url")
+    Args:
+        website_data: List of dictionaries from capture_websites
+        gemini_results: Dict shaped like the analyze_websites_with_gemini result
+        category: Website category
+        analysis_seconds: Wall time of the analysis step
+        relevance: Text relevance scores from batch_text_relevance (computed here if omitted)
         
-        if full_path:
-            entry = {
-                "name": name,
-                "path": full_path,
-                "score": overall_score,
-                "gemini_score": overall_score,
-                "details": website,
-                "criteria": {
-                    "Clarity": overall_score,
-                    "Modernity": overall_score,
-                    "Relevance": overall_score,
-                    "Consistency": overall_score,
-                    "Visual Appeal": overall_score
-                }
-            }
-            
-            if full_cloudinary_url:
-                entry["cloudinary_url"] = full_cloudinary_url
-                
-            all_scores["full"].append(entry)
-            
-        # Process section scores
-        for gemini_section, our_section in section_mapping.items():
-            if gemini_section in sections:
-                section_data = sections[gemini_section]
-                section_score = section_data.get("score", 0) / 10.0  # Convert to 0-1 scale
-                
-                section_path = site_sections.get(our_section)
-                section_cloudinary_url = site_sections.get(f"{our_section}_cloudinary_url")
-                
-                if section_path:
-                    entry = {
-                        "name": name,
-                        "path": section_path,
-                        "score": section_score,
-                        "gemini_score": section_score,
-                        "criteria": {
-                            "Clarity": section_score,
-                            "Modernity": section_score,
-                            "Relevance": section_score,
-                            "Consistency": section_score,
-                            "Visual Appeal": section_score
-                        }
-                    }
-                    
-                    # Add strengths and weaknesses
-                    entry["gemini_strengths"] = section_data.get("strengths", [])
-                    entry["gemini_weaknesses"] = section_data.get("weaknesses", [])
-                    entry["gemini_recommendations"] = section_data.get("recommendations", [])
-                    
-                    if section_cloudinary_url:
-                        entry["cloudinary_url"] = section_cloudinary_url
-                        
-                    all_scores[our_section].append(entry)
+    Returns:
+        Dictionary with scores for each section using only Gemini
+    """
+    if not website_data:
+        return {"header": [], "main": [], "footer": [], "full": []}
+    
+    if relevance is None:
+        relevance = batch_text_relevance(website_data, category)
+    
+    result = ComparisonResult.build(
+        website_data, gemini_results.get("websites", []), gemini_results.get("comparison", {}), relevance,
+        gemini_results.get("fallback", False), gemini_results.get("fallback_reason")
+    )
     
     # Print summary table
     print("\n=== FINAL SUMMARY ===")
     print(f"{'Website':<10} {'Header':<10} {'Main':<10} {'Footer':<10} {'Overall':<10}")
     print("-" * 50)
+    for name, header, main, footer, overall in result.summary_rows():
+        print(f"{name:<10} {header:<10.3f} {main:<10.3f} {footer:<10.3f} {overall:<10.3f}")
     
-    website_summaries = {}
-    for section_type in ["header", "main", "footer", "full"]:
-        for entry in all_scores[section_type]:
-            name = entry.get("name")
-            if name not in website_summaries:
-                website_summaries[name] = {}
-            website_summaries[name][section_type] = entry.get("score", 0)
-    
-    for name, sections in website_summaries.items():
-        header = sections.get("header", 0)
-        main = sections.get("main", 0)
-        footer = sections.get("footer", 0)
-        overall = sections.get("full", 0)
+    # Record the run in the results history (never fail the request over it)
+    try:
+        get_results_store().record_run(
+            website_data[0].get("run_id", new_run_id()), category, website_data,
+            result.records, analysis_seconds, result.fallback
+        )
+    except Exception as e:
+        print(f"⚠️ Failed to record results: {e}")
+    
+    return result.to_dict()
+
+# --- Change detection: only send what visually changed to Gemini ---
+def plan_site_analysis(site, category):
+    """
+    Decide how much of a captured site needs Gemini: nothing (unchanged since the cached
+    analysis), only the changed sections, or a full analysis.
+    
+    Args:
+        site: One entry from capture_websites
+        category: Website category
         
-        print(f"{name:<10} {header:<10.3f} {main:<10.3f} {footer:<10.3f} {overall:<10.3f}")
+    Returns:
+        Tuple of (plan, gemini_site) where gemini_site is the analyze_websites_with_gemini
+        input for the site, or None when the cached analysis is reused as is
+    """
+    sections = site.get("sections", {})
+    viewports = sorted(int(width) for width in sections.get("viewports", {}))
+    cached = analysis_cache.load(site["url"], category)
+    if cached and cached.get("viewports", []) != viewports:
+        # The earlier analysis judged responsiveness from a different set of views
+        cached = None
+    fingerprints, changed = plan_reanalysis(sections, cached)
+    site["image_hashes"] = {section: fp["dhash"] for section, fp in fingerprints.items() if fp}
+    plan = (site, cached, fingerprints, changed, viewports)
+    
+    if changed == []:
+        print(f"♻️ {site['name']} unchanged since last analysis. Reusing scores.")
+        return plan, None
+    
+    gemini_site = {
+        "name": site_key(site),  # Unique within the comparison, so results map back to the right site
+        "url": site["url"],
+        "full_path": sections.get("full"),
+        "layout": sections.get("layout")
+    }
+    
+    # Check if we have a Cloudinary URL
+    full_cloudinary_url = sections.get("full_cloudinary_url")
+    if full_cloudinary_url:
+        gemini_site["full_cloudinary_url"] = full_cloudinary_url
+    
+    if changed:
+        print(f"🔁 {site['name']} changed in {', '.join(changed)}. Re-analyzing those sections only.")
+        gemini_site["reanalyze_sections"] = changed
+    elif viewports:
+        gemini_site["viewport_paths"] = {
+            width: paths["full"] for width, paths in sections["viewports"].items() if paths.get("full")
+        }
+        gemini_site["viewport_layouts"] = {
+            width: paths.get("layout") for width, paths in sections["viewports"].items()
+        }
+    return plan, gemini_site
+
+def merge_site_analysis(plan, update, cacheable, category):
+    """
+    Combine a site's plan with the fresh Gemini record for it (if any) and cache the result.
+    
+    Args:
+        plan: Plan from plan_site_analysis
+        update: Fresh Gemini website record, or None
+        cacheable: Whether the fresh result came from Gemini (not the local fallback scorer)
+        category: Website category
+        
+    Returns:
+        Website record, or None if the site has no analysis
+    """
+    site, cached, fingerprints, changed, viewports = plan
+    if changed == []:
+        record = {**copy.deepcopy(cached["analysis"]), "reused": True}
+    elif changed:
+        if not update:
+            return None
+        record = copy.deepcopy(cached["analysis"])
+        record.setdefault("sections", {})
+        deltas = []
+        for section in changed:
+            key = GEMINI_SECTION_KEYS[section]
+            if key in update.get("sections", {}):
+                previous_score = record["sections"].get(key, {}).get("score", 0)
+                record["sections"][key] = update["sections"][key]
+                deltas.append(update["sections"][key].get("score", 0) - previous_score)
+        # Move the overall score by the average change of the re-scored sections
+        if deltas and "overall_score" in record:
+            record["overall_score"] = round(min(10, max(1, record["overall_score"] + sum(deltas) / 3)), 1)
+        record["reanalyzed_sections"] = changed
+    else:
+        record = update
+        if not record:
+            return None
+    
+    record["id"] = site_key(site)
+    record["name"] = site["name"]
+    record["url"] = site["url"]
+    record["screenshot"] = site["sections"].get("full")
+    if changed != [] and cacheable:
+        stored = {k: v for k, v in record.items() if k not in ("id", "reused", "reanalyzed_sections")}
+        analysis_cache.save(site["url"], category, fingerprints, stored, viewports)
+    return record
+
+def analyze_changed_websites(website_data, category):
+    """
+    Analyze captured websites with Gemini, reusing the previous analysis of any site whose
+    screenshots are within the visual-distance threshold of the last scored capture.
+    Sites where only some sections changed get just those sections re-analyzed.
+    
+    Args:
+        website_data: List of dictionaries from capture_websites
+        category: Website category
+        
+    Returns:
+        Dict shaped like the analyze_websites_with_gemini result
+    """
+    plans = []
+    gemini_input = []
+    for site in website_data:
+        plan, gemini_site = plan_site_analysis(site, category)
+        plans.append(plan)
+        if gemini_site:
+            gemini_input.append(gemini_site)
+    
+    # Call Gemini API to get vision improvements and section scores
+    gemini_results = analyze_websites_with_gemini(gemini_input, category) if gemini_input else {}
+    if not gemini_input or "error" in gemini_results:
+        gemini_results = {**gemini_results, "websites": []}
+    fresh = {website.get("name"): website for website in gemini_results.get("websites", [])}
+    cacheable = not gemini_results.get("fallback")
+    
+    websites = []
+    for plan in plans:
+        record = merge_site_analysis(plan, fresh.get(site_key(plan[0])), cacheable, category)
+        if record:
+            websites.append(record)
+    
+    # The Gemini comparison only covers what it saw, so rank all sites from the merged scores
+    if websites and len(fresh) != len(websites):
+        summary = gemini_results.get("comparison", {}).get("summary") or \
+            f"Compared {len(websites)} {category} websites; unchanged pages reuse their previous analysis."
+        gemini_results["comparison"] = build_comparison(websites, summary)
+    gemini_results["websites"] = websites
+    return gemini_results
 
-    # Ensure the response structure is compatible with the frontend
-    all_scores = ensure_frontend_compatibility(all_scores)
+# --- Batch comparison: capture each distinct site once, score every grouping ---
+def compare_websites_batch(comparisons, max_scoring_workers=4, viewports=None):
+    """
+    Run many comparisons that share sites. The union of distinct URLs is captured
+    once, then each (site set, category) grouping is scored against those captures.
+    
+    Args:
+        comparisons: List of dictionaries with "websites" and "category"
+        max_scoring_workers: Number of groupings scored concurrently
+        viewports: Extra viewport widths captured for every site
+        
+    Returns:
+        Dictionary with one result per comparison (in order) and capture statistics
+    """
+    unique_sites = {}
+    for comparison in comparisons:
+        for site in comparison["websites"]:
+            unique_sites.setdefault(normalize_url(site["url"]), site)
+    
+    print(f"Batch of {len(comparisons)} comparisons over {len(unique_sites)} distinct sites")
+    captured = {
+        normalize_url(site["url"]): site
+        for site in capture_websites(assign_site_ids(list(unique_sites.values())), viewports=viewports)
+    }
+    
+    def score_one(comparison):
+        website_data = []
+        for site in assign_site_ids(comparison["websites"]):
+            capture = captured.get(normalize_url(site["url"]))
+            if capture:
+                # Same capture, but named the way this comparison asked for it
+                website_data.append({**capture, "id": site["id"], "name": site["name"], "url": site["url"]})
+        return score_websites(website_data, comparison.get("category", "ecommerce"))
     
-    # Debug: Print the structure of the response
-    print("\nDEBUG - Response Structure:")
-    for section in all_scores.keys():
-        print(f"Section: {section}")
-        if isinstance(all_scores[section], list):
-            for item in all_scores[section]:
-                print(f"  - {item.get('name')}: {item.keys()}")
+    with ThreadPoolExecutor(max_workers=max_scoring_workers) as executor:
+        results = list(executor.map(score_one, comparisons))
     
-    return all_scores
+    return {
+        "results": results,
+        "sites_requested": sum(len(comparison["websites"]) for comparison in comparisons),
+        "sites_captured": len(captured)
+    }
 
 # Example usage
 if __name__ == "__main__":
@@ -0,0 +1,144 @@
+# Queue worker: pulls capture and/or scoring jobs from the durable job queue.
+#
+#     python worker.py --kinds capture --concurrency 2     # browser hosts
+#     python worker.py --kinds score --concurrency 8       # API-bound scoring
+import os
+import sys
+import time
+import uuid
+import socket
+import argparse
+import threading
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent))
+from job_queue import get_job_queue, DEFAULT_LEASE_SECONDS
+from website_comparison import capture_websites, score_websites, mark_missing_sites
+from result_model import assign_site_ids
+from results_store import get_results_store
+
+# Idle workers poll the queue with exponential backoff up to this many seconds
+MAX_POLL_INTERVAL = 5.0
+
+
+def run_capture_job(queue, job):
+    """
+    Capture every site of a comparison, then hand the captures to a scoring job.
+
+    Returns:
+        Tuple of (result, follow-up jobs enqueued when the capture job completes)
+    """
+    payload = job["payload"]
+    # Same site ids as a synchronous comparison (sites sharing a display name are told apart)
+    websites = assign_site_ids(payload["websites"])
+    website_data = capture_websites(websites, viewports=payload.get("viewports"))
+    score_job = queue.new_job(
+        "score",
+        {
+            "websites": websites,
+            "website_data": website_data,
+            "category": payload["category"],
+            "comparison_key": payload.get("comparison_key")
+        },
+        priority=payload.get("priority", 0),
+        parent_id=job["id"]
+    )
+    return {"score_job": score_job["id"], "sites_captured": len(website_data)}, [score_job]
+
+
+def run_score_job(queue, job):
+    """Score captured sites and store the response for the comparison (unless sites are missing)."""
+    payload = job["payload"]
+    scores = score_websites(payload["website_data"], payload["category"])
+    # Score jobs queued before "websites" was handed over can't tell a partial result apart
+    complete = "websites" in payload and not mark_missing_sites(scores, payload["websites"]).get("partial")
+    if payload.get("comparison_key") and scores.get("full") and complete and not scores.get("fallback"):
+        get_results_store().save_response(payload["comparison_key"], scores)
+    return scores, []
+
+
+JOB_HANDLERS = {
+    "capture": run_capture_job,
+    "score": run_score_job
+}
+
+
+class Worker:
+    """Leases jobs of the given kinds and runs them, heartbeating while they execute."""
+
+    def __init__(self, kinds, worker_id=None, lease_seconds=DEFAULT_LEASE_SECONDS):
+        self.kinds = kinds
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.lease_seconds = lease_seconds
+        self.queue = get_job_queue()
+        self.stopping = threading.Event()
+
+    def _heartbeat(self, job_id, done):
+        while not done.wait(self.lease_seconds / 3):
+            if not self.queue.heartbeat(job_id, self.worker_id, self.lease_seconds):
+                print(f"⚠️ Lost lease on job {job_id}; another worker may re-run it")
+                return
+
+    def run_one(self):
+        """Lease and run a single job. Returns False if the queue had nothing ready."""
+        job = self.queue.lease(self.kinds, self.worker_id, self.lease_seconds)
+        if job is None:
+            return False
+
+        print(f"▶️ {self.worker_id} running {job['kind']} job {job['id']} (attempt {job['attempts']})")
+        done = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(job["id"], done), daemon=True)
+        heartbeat.start()
+        try:
+            result, follow_ups = JOB_HANDLERS[job["kind"]](self.queue, job)
+        except Exception as e:
+            print(f"❌ {job['kind']} job {job['id']} failed: {e}")
+            self.queue.fail(job["id"], self.worker_id, e)
+        else:
+            if not self.queue.complete(job["id"], self.worker_id, result, follow_ups):
+                print(f"⚠️ Job {job['id']} finished after its lease was lost; result discarded")
+        finally:
+            done.set()
+            heartbeat.join()
+        return True
+
+    def run_forever(self):
+        interval = 0.2
+        while not self.stopping.is_set():
+            if self.run_one():
+                interval = 0.2
+            else:
+                self.stopping.wait(interval)
+                interval = min(MAX_POLL_INTERVAL, interval * 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run queue workers for capture and scoring jobs.")
+    parser.add_argument("--kinds", default="capture,score", help="Job kinds to run (capture, score)")
+    parser.add_argument("--concurrency", type=int, default=1, help="Jobs run in parallel by this process")
+    parser.add_argument("--lease-seconds", type=int, default=DEFAULT_LEASE_SECONDS)
+    args = parser.parse_args()
+
+    kinds = [kind.strip() for kind in args.kinds.split(",") if kind.strip() in JOB_HANDLERS]
+    if not kinds:
+        parser.error(f"--kinds must include one of: {', '.join(JOB_HANDLERS)}")
+
+    workers = [Worker(kinds, lease_seconds=args.lease_seconds) for _ in range(args.concurrency)]
+    threads = [threading.Thread(target=worker.run_forever, daemon=True) for worker in workers]
+    for thread in threads:
+        thread.start()
+    print(f"Started {len(workers)} worker(s) for {', '.join(kinds)} jobs")
+
+    try:
+        while any(thread.is_alive() for thread in threads):
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print("Stopping workers after their current jobs...")
+        for worker in workers:
+            worker.stopping.set()
+        for thread in threads:
+            thread.join()
+
+
+if __name__ == "__main__":
+    main()